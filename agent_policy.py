@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+
+ANSWERS = ('Yes', 'No', 'Maybe')
+
+def is_decided(initial_decision, final_decision):
+    """An agent that does not answer No stops further agents for this criterion"""
+    return not "No" in initial_decision[:6] and not "No" in final_decision
+
+class AgentPolicy:
+    """
+    Decide how many agents to ask about a criterion.
+
+    With adaptive off, the fixed rule applies: agents are asked until one does not
+    answer No, up to n_agents. With adaptive on, min_agents agents are always asked,
+    and more are added (up to n_agents) only while their final decisions disagree,
+    any of them is Maybe, or a call failed.
+
+    Agreement and cost are counted per criterion type for decisions made by the AI.
+    """
+
+    def __init__(self, n_agents, adaptive=False, min_agents=2):
+        self.n_agents = n_agents
+        self.adaptive = adaptive
+        self.min_agents = max(1, min(int(min_agents), n_agents))
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def first_round(self):
+        """Number of agents worth asking before looking at any answer"""
+        return self.min_agents if self.adaptive else 1
+
+    def enough(self, initial_decisions, final_decisions):
+        """True once no further agent needs to be asked"""
+        if len(final_decisions) >= self.n_agents:
+            return True
+        if not self.adaptive:
+            return is_decided(initial_decisions[-1], final_decisions[-1])
+        if len(final_decisions) < self.min_agents:
+            return False
+        return set(final_decisions) in ({'Yes'}, {'No'})
+
+    def record(self, Criterion, final_decisions):
+        """Count one criterion decided by the AI (NOT RUN padding is ignored)"""
+        answers = [d for d in final_decisions if d != 'NOT RUN']
+        with self._lock:
+            stats = self.stats.setdefault(Criterion['type'], {
+                'criteria': 0, 'calls': 0, 'unanimous': 0, 'with_maybe': 0, 'escalated': 0
+            })
+            stats['criteria'] += 1
+            stats['calls'] += len(answers)
+            stats['unanimous'] += len(set(answers)) == 1 and answers[0] in ANSWERS
+            stats['with_maybe'] += 'Maybe' in answers
+            stats['escalated'] += len(answers) > self.first_round()
+
+    def report(self):
+        report = {}
+        for criterion, stats in self.stats.items():
+            n = stats['criteria']
+            report[criterion] = {
+                **stats,
+                'mean_agents': round(stats['calls'] / n, 3),
+                'unanimous_rate': round(stats['unanimous'] / n, 3),
+                'calls_saved': n * self.n_agents - stats['calls']
+            }
+        return report
+
+    def save_report(self, out_path):
+        report = self.report()
+        with open(os.path.join(out_path, 'agent_report.json'), 'w') as f:
+            json.dump({'adaptive': self.adaptive, 'min_agents': self.min_agents, 'n_agents': self.n_agents, 'criteria': report}, f, indent=2)
+        for criterion, stats in report.items():
+            print(f"{criterion}: {stats['mean_agents']:.2f} agents per paper over {stats['criteria']} papers, "
+                  f"{stats['unanimous_rate']:.0%} unanimous, {stats['calls_saved']} calls saved")
+        return report
+
+_policy = None
+
+def configure_agent_policy(adaptive_config=None, n_agents=1):
+    """
+    Set up the agent policy from the adaptive_agents config, e.g.
+    {"enabled": true, "min_agents": 2}
+    """
+    global _policy
+    adaptive_config = adaptive_config or {}
+    _policy = AgentPolicy(
+        n_agents,
+        adaptive=adaptive_config.get('enabled', False),
+        min_agents=adaptive_config.get('min_agents', 2)
+    )
+    if _policy.adaptive:
+        print(f"Adaptive agents: {_policy.min_agents} to {n_agents} agents per criterion")
+    return _policy
+
+def get_agent_policy(n_agents):
+    """The configured policy, or the fixed rule for n_agents when none is set up"""
+    if _policy is None or _policy.n_agents != n_agents:
+        return AgentPolicy(n_agents)
+    return _policy
+
+def enough_agents(initial_decisions, final_decisions, n_agents):
+    return get_agent_policy(n_agents).enough(initial_decisions, final_decisions)
+
+def record_agents(Criterion, final_decisions, n_agents):
+    get_agent_policy(n_agents).record(Criterion, final_decisions)
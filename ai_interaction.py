@@ -1,17 +1,109 @@
+import json
 import re
-from ask_AI import ask_ai
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from ask_AI import CallCancelled, ask_ai, served_backend
 from data_processing import load_screening_criteria
+from agent_policy import get_agent_policy
+from router import pop_served, record_served
+from metrics import observe_discarded
+
+# Guards the shared per-agent DataFrames when several papers are screened at once
+info_all_lock = threading.Lock()
+
+# Output token caps per response format, sized to the expected answer with some room
+# to spare. They only apply once a response budget is configured.
+RESPONSE_BUDGETS = {'single': 300, 'batch_per_paper': 150, 'combined_per_criterion': 300}
+_budget = None
+
+def configure_response_budget(budget_config=None):
+    """
+    Set up response budgets from the response_budget config, e.g.
+    {"enabled": true, "single": 300, "criteria": {"Topic": 500}, "stream": true}
+    """
+    global _budget
+    budget_config = budget_config or {}
+    if not budget_config.get('enabled', False):
+        _budget = None
+        return None
+    _budget = {kind: budget_config.get(kind, default) for kind, default in RESPONSE_BUDGETS.items()}
+    _budget['criteria'] = budget_config.get('criteria', {})
+    _budget['stream'] = budget_config.get('stream', True)
+    print(f"Response budget: {_budget['single']} output tokens per criterion"
+          f"{', streamed until the decision is given' if _budget['stream'] else ''}")
+    return _budget
+
+def response_budget(kind, Criterion=None, count=1):
+    """Output token cap for a response of kind (see RESPONSE_BUDGETS) covering count papers or criteria"""
+    if _budget is None:
+        return None
+    per_item = _budget['criteria'].get(Criterion['type'], _budget[kind]) if Criterion is not None else _budget[kind]
+    return int(per_item) * count
+
+# How single-criterion answers are requested and read (see configure_structured_output)
+_structured = {'json_mode': False, 'reask': True}
+
+def configure_structured_output(structured_config=None):
+    """
+    Set up structured output from the structured_output config, e.g.
+    {"json_mode": true, "reask": true}
+    """
+    structured_config = structured_config or {}
+    _structured['json_mode'] = bool(structured_config.get('json_mode', False))
+    _structured['reask'] = bool(structured_config.get('reask', True))
+    if _structured['json_mode']:
+        print("Asking for single-criterion answers as JSON")
+    return dict(_structured)
+
+def stop_after_final_responses(count=1):
+    """
+    stop_when for ask_ai: true once count Final Response decisions have been given,
+    when responses are streamed
+    """
+    if _budget is None or not _budget['stream'] or _structured['json_mode']:
+        return None
+    def stop_when(text):
+        return end_of_final_responses(text, count) is not None
+    return stop_when
+
+def end_of_final_responses(text, count=1):
+    """
+    Position just after the count-th Final Response decision word, or None. The word
+    only counts once a character follows it, so "No" is not taken from a partial "Not".
+    """
+    matches = list(final_line_pattern.finditer(text))
+    if len(matches) < count:
+        return None
+    end = matches[count - 1].end()
+    return end if end < len(text) else None
+
+def trim_stopped_response(text, count=1):
+    """Drop the lines of the last streamed chunk that came after the decisions"""
+    end = end_of_final_responses(text, count)
+    if end is None:
+        return text
+    line_end = text.find('\n', end)
+    return text[:line_end] if line_end != -1 else text
+
+# Prompts are laid out as a stable prefix (instructions and criteria), rendered once
+# per criterion, followed by the paper content. ask_ai sends the prefix separately so
+# backends can put it in the system message and mark it for provider prompt caching.
 
 def add_criteria(Criterion):
+    return _criterion_prefix(Criterion["type"], Criterion["included"], Criterion["excluded"])
+
+@lru_cache(maxsize=None)
+def _criterion_prefix(sc_type, included, excluded):
     base_prompt = ("You are a reviewer for a research project and have been asked to assess whether the "
                   "given paper Title and Abstract meets the following Screening Criteria (SC)."
                   " In assessing, do not re-interpret the SC, simply assess the SC at face value.\n"
                   "We are only interested in papers that strictly meet the SC.\n"
                   "If not enough information is available, be inclusive as we can follow-up at a later stage.")
     
-    base_prompt += '\n\n' + f'SC: {Criterion["type"]}'
-    base_prompt += f'\nIncluded: {Criterion["included"]}'
-    base_prompt += f'\nExcluded: {Criterion["excluded"]}'
+    base_prompt += '\n\n' + f'SC: {sc_type}'
+    base_prompt += f'\nIncluded: {included}'
+    base_prompt += f'\nExcluded: {excluded}'
     base_prompt += ('\n\n' + "Task: Given the following Title and Abstract, respond"
                    " to the Screening Criteria (SC) with the following elements, "
                    "Initial Response, Reflection on Initial Response, and Final Response."
@@ -27,59 +119,460 @@ def add_criteria(Criterion):
                    "\nSC: Final Response; One sentence of reasoning.")
     return base_prompt
 
-def get_ai_assessment(Criterion, content, ai_model):
-    prompt = add_criteria(Criterion) + "\n\n" + content + '\n\n'
+# Schema of a single-criterion answer in JSON mode, also used for tool calls
+DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "initial_response": {"type": "string", "enum": ["Yes", "No", "Maybe"]},
+        "reflection": {"type": "string"},
+        "final_response": {"type": "string", "enum": ["Yes", "No", "Maybe"]},
+        "reason": {"type": "string"}
+    },
+    "required": ["initial_response", "reflection", "final_response", "reason"]
+}
+
+def add_criteria_json(Criterion):
+    """Single-criterion prompt answered as one JSON object (see DECISION_SCHEMA)"""
+    return _criterion_json_prefix(Criterion["type"], Criterion["included"], Criterion["excluded"])
+
+@lru_cache(maxsize=None)
+def _criterion_json_prefix(sc_type, included, excluded):
+    base_prompt = ("You are a reviewer for a research project and have been asked to assess whether the "
+                  "given paper Title and Abstract meets the following Screening Criteria (SC)."
+                  " In assessing, do not re-interpret the SC, simply assess the SC at face value.\n"
+                  "We are only interested in papers that strictly meet the SC.\n"
+                  "If not enough information is available, be inclusive as we can follow-up at a later stage.")
+    
+    base_prompt += '\n\n' + f'SC: {sc_type}'
+    base_prompt += f'\nIncluded: {included}'
+    base_prompt += f'\nExcluded: {excluded}'
+    base_prompt += ('\n\n' + "Task: Given the following Title and Abstract, give an Initial Response, "
+                   "a Reflection on the Initial Response, and a Final Response. "
+                   "Respond only with a JSON object, like this:\n"
+                   '{"initial_response": "Yes", "reflection": "Is the Initial Response correct? Be concise.", '
+                   '"final_response": "Yes", "reason": "One sentence of reasoning."}\n'
+                   "initial_response and final_response must be exactly one of Yes, No or Maybe.")
+    return base_prompt
+
+def add_all_criteria(screening_criteria):
+    """Prompt asking for every screening criterion in one response, numbered SC1..SCn"""
+    return _all_criteria_prefix(tuple((SC["type"], SC["included"], SC["excluded"]) for SC in screening_criteria))
+
+@lru_cache(maxsize=None)
+def _all_criteria_prefix(criteria):
+    base_prompt = ("You are a reviewer for a research project and have been asked to assess whether the "
+                  "given paper Title and Abstract meets each of the following Screening Criteria (SC)."
+                  " In assessing, do not re-interpret the SC, simply assess each SC at face value"
+                  " and independently of the others.\n"
+                  "We are only interested in papers that strictly meet the SC.\n"
+                  "If not enough information is available, be inclusive as we can follow-up at a later stage.")
+    
+    for SC_num, (sc_type, included, excluded) in enumerate(criteria, 1):
+        base_prompt += '\n\n' + f'SC{SC_num}: {sc_type}'
+        base_prompt += f'\nIncluded: {included}'
+        base_prompt += f'\nExcluded: {excluded}'
+    
+    base_prompt += ('\n\n' + "Task: Given the following Title and Abstract, respond"
+                   " to every Screening Criterion (SC1 to SC" + str(len(criteria)) + "), in order,"
+                   " with the following elements: Initial Response, Reflection on Initial Response, and Final Response."
+                   " Here is an example of how your response should look for each SC:\n"
+                   "Format: \n"
+                   "SC1 -\n"
+                   "Initial Response: Yes or No or Maybe; Short explanation as rationale.\n"
+                   "Reflection: Is the Initial Response correct? Be concise.\n"
+                   "Final Response: Yes or No or Maybe; Short explanation based on reflection.\n"
+                   "\nStart each block with its SC number on its own line (SC1 -, SC2 -, ...). "
+                   "Initial Response and Final Response should consist of "
+                   "only a Yes or No or Maybe "
+                   "followed by a semicolon and a single sentence explanation for your reasoning.")
+    return base_prompt
+
+combined_block_pattern = re.compile(r'^[\s*#]*SC\s*(\d+)\b', re.MULTILINE)
+combined_initial_pattern = re.compile(r'Initial Response\W*(Yes|No|Maybe)\b')
+combined_final_pattern = re.compile(r'Final Response\W*(Yes|No|Maybe)\b')
+
+def parse_combined_assessment(assessment, n_criteria):
+    """
+    Split a combined response into per-criterion blocks. Returns {SC_num: (initial, final, block)}
+    for the criteria whose Initial and Final Response could both be read.
+    """
+    parsed = {}
+    starts = list(combined_block_pattern.finditer(assessment))
+    for i, match in enumerate(starts):
+        SC_num = int(match.group(1))
+        if not 1 <= SC_num <= n_criteria or SC_num in parsed:
+            continue
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(assessment)
+        block = assessment[match.start():end].strip()
+        initial = combined_initial_pattern.search(block)
+        final = combined_final_pattern.search(block)
+        if initial and final:
+            parsed[SC_num] = (initial.group(1), final.group(1), block)
+    return parsed
+
+def get_combined_assessment(screening_criteria, content, ai_model, agent=0):
     try:
-        assessment = ask_ai(prompt, ai_model)
+        assessment = ask_ai(
+            content + '\n\n', ai_model, response_budget('combined_per_criterion', count=len(screening_criteria)),
+            sample=agent, prefix=add_all_criteria(screening_criteria), criterion='all',
+            stop_when=stop_after_final_responses(len(screening_criteria))
+        )
+        if stop_after_final_responses() is not None:
+            assessment = trim_stopped_response(assessment, len(screening_criteria))
     except Exception as e:
         print(f"Error calling AI: {str(e)}")
         assessment = "No Data"
+    backend = served_backend()
     
-    print("\n**** Response ****\n")
+    print("\n**** Combined Response ****\n")
+    print(assessment)
+    
+    return assessment, parse_combined_assessment(assessment, len(screening_criteria)), backend
+
+def get_combined_data(screening_criteria, content, n_agents, info_all, paper_num, ai_model, title, abstract):
+    """
+    Assess all criteria with one call per agent. Agents are asked in turn, and only while
+    some criterion still needs more agents (the same agent policy as get_data, per criterion).
+    Each agent is only asked about the criteria that are still undecided, numbered SC1..SCk
+    in its prompt. Criteria missing from a combined response fall back to a single-criterion call.
+    Returns {criterion type: (assessments, initial_decisions, final_decisions)}.
+    """
+    results = {Criterion['type']: ([], [], []) for Criterion in screening_criteria}
+    policy = get_agent_policy(n_agents)
+    undecided = list(range(1, len(screening_criteria) + 1))
+    
+    for agent in range(n_agents):
+        if not undecided:
+            break
+        print(f"Agent {agent} (all criteria)")
+        asked = list(undecided)
+        assessment, parsed, backend = get_combined_assessment(
+            [screening_criteria[SC_num - 1] for SC_num in asked], content, ai_model, agent
+        )
+        
+        for position, SC_num in enumerate(asked, 1):
+            Criterion = screening_criteria[SC_num - 1]
+            if position in parsed:
+                initial_decision, final_decision, block = parsed[position]
+                record_served(Criterion['type'], content, agent, backend)
+            else:
+                print(f"SC{SC_num} missing from combined response, asking separately")
+                block, initial_decision, final_decision, _ = get_ai_assessment(Criterion, content, ai_model, agent)
+            
+            assessments, initial_decisions, final_decisions = results[Criterion['type']]
+            assessments.append(block)
+            initial_decisions.append(initial_decision)
+            final_decisions.append(final_decision)
+            store_in_info_all(info_all, agent, paper_num, SC_num, Criterion, title, abstract, initial_decision, final_decision, block)
+            
+            if policy.enough(initial_decisions, final_decisions):
+                undecided.remove(SC_num)
+    
+    return results
+
+def add_criteria_batch(Criterion):
+    """Prompt for assessing several papers against one criterion, answered as a JSON list"""
+    return _criterion_batch_prefix(Criterion["type"], Criterion["included"], Criterion["excluded"])
+
+@lru_cache(maxsize=None)
+def _criterion_batch_prefix(sc_type, included, excluded):
+    base_prompt = ("You are a reviewer for a research project and have been asked to assess whether each of the "
+                  "given papers (Title and Abstract) meets the following Screening Criteria (SC)."
+                  " In assessing, do not re-interpret the SC, simply assess the SC at face value."
+                  " Assess every paper independently of the others.\n"
+                  "We are only interested in papers that strictly meet the SC.\n"
+                  "If not enough information is available, be inclusive as we can follow-up at a later stage.")
+    
+    base_prompt += '\n\n' + f'SC: {sc_type}'
+    base_prompt += f'\nIncluded: {included}'
+    base_prompt += f'\nExcluded: {excluded}'
+    base_prompt += ('\n\n' + "Task: Each paper below starts with its ID. For every paper, give an "
+                   "Initial Response, a Reflection on the Initial Response, and a Final Response. "
+                   "Respond only with a JSON list containing one object per paper, like this:\n"
+                   '[{"id": "P1", "initial_response": "Yes", "reflection": "Is the Initial Response correct? Be concise.", '
+                   '"final_response": "Yes", "reason": "One sentence of reasoning."}]\n'
+                   "initial_response and final_response must be exactly one of Yes, No or Maybe.")
+    return base_prompt
+
+def parse_batch_assessment(assessment, paper_ids):
+    """
+    Read the JSON list returned for a batch. Returns {paper id: (initial, final, thoughts)}
+    for the papers with a valid entry; missing or malformed entries are left out.
+    """
+    start = assessment.find('[')
+    end = assessment.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(assessment[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    
+    parsed = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or item.get('id') not in paper_ids or item['id'] in parsed:
+            continue
+        initial = re.match(r'\s*(Yes|No|Maybe)\b', str(item.get('initial_response', '')))
+        final = re.match(r'\s*(Yes|No|Maybe)\b', str(item.get('final_response', '')))
+        if initial and final:
+            parsed[item['id']] = (initial.group(1), final.group(1), json.dumps(item, ensure_ascii=False))
+    return parsed
+
+def get_batch_assessment(Criterion, contents, ai_model, agent=0):
+    """
+    Assess several papers against one criterion in a single call. contents maps a key
+    (e.g. the paper number) to the paper's content. Papers missing from the response
+    are retried on their own. Returns {key: (assessment, initial, final, thoughts)}.
+    """
+    ids = {f"P{i}": key for i, key in enumerate(contents, 1)}
+    papers_text = "\n\n".join(f"ID: {paper_id}\n{contents[key]}" for paper_id, key in ids.items())
+    try:
+        assessment = ask_ai(
+            papers_text + '\n\n', ai_model, response_budget('batch_per_paper', Criterion, len(ids)),
+            sample=agent, prefix=add_criteria_batch(Criterion), criterion=Criterion['type']
+        )
+    except Exception as e:
+        print(f"Error calling AI: {str(e)}")
+        assessment = "No Data"
+    backend = served_backend()
+    
+    print(f"\n**** Batch Response ({len(ids)} papers) ****\n")
     print(assessment)
     
-    pattern = r'\b(Yes|No|Maybe)\b'
-    matches = re.findall(pattern, assessment)
+    parsed = parse_batch_assessment(assessment, ids)
+    results = {}
+    for paper_id, key in ids.items():
+        if paper_id in parsed:
+            initial_decision, final_decision, thoughts = parsed[paper_id]
+            results[key] = (thoughts, initial_decision, final_decision, thoughts)
+            record_served(Criterion['type'], contents[key], agent, backend)
+        else:
+            print(f"{paper_id} missing from batch response, asking separately")
+            results[key] = get_ai_assessment(Criterion, contents[key], ai_model, agent)
+    return results
+
+def prompt_parts(Criterion, content):
+    """(prefix, prompt) for one criterion and paper, as passed to ask_ai"""
+    prefix = add_criteria_json(Criterion) if _structured['json_mode'] else add_criteria(Criterion)
+    return prefix, content + '\n\n'
+
+def build_prompt(Criterion, content):
+    prefix, prompt = prompt_parts(Criterion, content)
+    return prefix + "\n\n" + prompt
+
+# Decisions are read from labelled lines only, so a Yes or No inside the reasoning is
+# never taken for the decision. Markdown emphasis, bullets or quotes may lead the label.
+DECISION_LINE = r'^[ \t>*_#\-]*{label}\W*(Yes|No|Maybe)\b'
+initial_line_pattern = re.compile(DECISION_LINE.format(label='Initial Response'), re.MULTILINE | re.IGNORECASE)
+final_line_pattern = re.compile(DECISION_LINE.format(label='Final Response'), re.MULTILINE | re.IGNORECASE)
+sc_line_pattern = re.compile(DECISION_LINE.format(label='SC'), re.MULTILINE | re.IGNORECASE)
+bare_decision_pattern = re.compile(r'^\W*(Yes|No|Maybe)\b', re.IGNORECASE)
+# A whole response that is just a decision, optionally followed by punctuation and a reason
+only_decision_pattern = re.compile(r'^\W*(Yes|No|Maybe)\s*(?:[;:.,\-]|$)', re.IGNORECASE)
+
+def decision_of(value):
+    """Yes, No or Maybe at the start of value, else None"""
+    match = bare_decision_pattern.match(str(value or ''))
+    return match.group(1).capitalize() if match else None
+
+def parse_json_assessment(assessment):
+    """(initial, final) from a JSON object answer, or None"""
+    start = assessment.find('{')
+    end = assessment.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        item = json.loads(assessment[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(item, dict):
+        return None
+    item = {str(key).lower(): value for key, value in item.items()}
+    final = decision_of(item.get('final_response'))
+    if final is None:
+        return None
+    return decision_of(item.get('initial_response')) or final, final
+
+def parse_assessment(assessment):
+    """
+    Return (initial_decision, final_decision, thoughts) from a single-criterion response.
+    The decisions come from the first "Initial Response:" and last "Final Response:"
+    lines (an "SC:" line stands in for a missing Final Response), from a JSON answer,
+    or from a response that is only a decision. Anything else gives "No Data".
+    """
+    if assessment == "No Data":
+        return "No Data", "No Data", assessment
+    
+    finals = final_line_pattern.findall(assessment) or sc_line_pattern.findall(assessment)
+    if finals:
+        initials = initial_line_pattern.findall(assessment)
+        final_decision = finals[-1].capitalize()
+        initial_decision = initials[0].capitalize() if initials else final_decision
+        return initial_decision, final_decision, assessment
+    
+    parsed = parse_json_assessment(assessment)
+    if parsed is not None:
+        return parsed[0], parsed[1], assessment
+    
+    bare = only_decision_pattern.match(assessment)
+    if bare is not None:
+        return bare.group(1).capitalize(), bare.group(1).capitalize(), assessment
     
+    print("Bad Parsing...")
+    return "No Data", "No Data", assessment
+
+REFORMAT_PROMPT = ("Below is a reviewer's assessment of a paper against a screening criterion. "
+                   "Restate its decisions as exactly these two lines and nothing else:\n"
+                   "Initial Response: Yes or No or Maybe\n"
+                   "Final Response: Yes or No or Maybe\n\n"
+                   "Assessment:\n")
+
+def reask_unparseable(Criterion, content, ai_model, agent, assessment, cancelled=None):
+    """
+    Second attempt at a response parse_assessment could not read. A response with text
+    in it only needs its decisions restated, which is a short call without the paper;
+    an empty response is asked again in full. Returns (initial, final, thoughts).
+    """
+    if not _structured['reask'] or assessment == "No Data":
+        return parse_assessment(assessment)
+    try:
+        if assessment.strip():
+            print("Could not read the decisions, asking for them to be restated")
+            restated = ask_ai(REFORMAT_PROMPT + assessment, ai_model, 40, sample=agent, criterion=Criterion['type'],
+                              cancelled=cancelled)
+            initial_decision, final_decision, _ = parse_assessment(restated)
+            return initial_decision, final_decision, assessment
+        print("Empty response, asking again")
+        prefix, prompt = prompt_parts(Criterion, content)
+        retry = ask_ai(prompt, ai_model, response_budget('single', Criterion), use_cache=False, sample=agent,
+                       prefix=prefix, criterion=Criterion['type'], json_schema=_json_schema(), cancelled=cancelled)
+        return parse_assessment(retry)
+    except CallCancelled:
+        raise
+    except Exception as e:
+        print(f"Error calling AI: {str(e)}")
+        return "No Data", "No Data", assessment
+
+def _json_schema():
+    return DECISION_SCHEMA if _structured['json_mode'] else None
+
+def get_ai_assessment(Criterion, content, ai_model, agent=0, cancelled=None):
+    """
+    Ask one agent about one criterion. Returns (assessment, initial, final, thoughts).
+    Raises CallCancelled if the cancelled event is set before a call is sent.
+    """
+    prefix, prompt = prompt_parts(Criterion, content)
+    max_tokens = response_budget('single', Criterion)
+    stop_when = stop_after_final_responses()
     try:
-        final_decision = matches[-1]
-        initial_decision = matches[0]
-        thoughts = assessment
-    except:
-        print("Bad Parsing...")
-        final_decision = initial_decision = "No Data"
-        thoughts = assessment
+        assessment = ask_ai(
+            prompt, ai_model, max_tokens, sample=agent, prefix=prefix, criterion=Criterion['type'],
+            stop_when=stop_when, json_schema=_json_schema(), cancelled=cancelled
+        )
+        if stop_when is not None:
+            assessment = trim_stopped_response(assessment)
+        # A long answer without a final decision was most likely cut off by the budget
+        if max_tokens and parse_assessment(assessment)[1] == "No Data" and len(assessment) // 4 >= max_tokens * 0.75:
+            print("Response cut off by the response budget, asking again without it")
+            assessment = ask_ai(prompt, ai_model, sample=agent, prefix=prefix, criterion=Criterion['type'],
+                                json_schema=_json_schema(), cancelled=cancelled)
+    except CallCancelled:
+        raise
+    except Exception as e:
+        print(f"Error calling AI: {str(e)}")
+        assessment = "No Data"
+    # Restating the decisions below does not change which backend made them
+    record_served(Criterion['type'], content, agent, served_backend())
+    
+    print("\n**** Response ****\n")
+    print(assessment)
+    
+    initial_decision, final_decision, thoughts = parse_assessment(assessment)
+    if final_decision == "No Data":
+        initial_decision, final_decision, thoughts = reask_unparseable(Criterion, content, ai_model, agent, assessment, cancelled)
     
     return assessment, initial_decision, final_decision, thoughts
 
-def get_data(Criterion, content, n_agents, SC_num, info_all, paper_num, ai_model, title, abstract):
+def store_in_info_all(info_all, agent, paper_num, SC_num, Criterion, title, abstract, initial_decision, final_decision, thoughts):
+    col_decision = f"Final Decision - SC{SC_num}: {Criterion['type']}"
+    col_initial = f"Initial Decision - SC{SC_num}: {Criterion['type']}"
+    col_thoughts = f"Thoughts - SC{SC_num}: {Criterion['type']}"
+    
+    with info_all_lock:
+        info_all[agent].loc[paper_num, ['Paper Number', "Title", "Abstract"]] = [paper_num, title, abstract] if title and abstract else 'NO DATA'
+        info_all[agent].loc[paper_num, col_decision] = final_decision
+        info_all[agent].loc[paper_num, col_initial] = initial_decision
+        info_all[agent].loc[paper_num, col_thoughts] = thoughts
+
+def get_data(Criterion, content, n_agents, SC_num, info_all, paper_num, ai_model, title, abstract, agent_mode='sequential'):
+    """
+    Ask up to n_agents agents to assess one criterion. The agent policy (see
+    agent_policy.py) decides when enough agents have answered.
+
+    agent_mode controls how the calls are made:
+    - 'sequential': one agent after another, stopping once the policy is satisfied
+    - 'parallel': all agents are asked at once and every answer is kept; with adaptive
+      agents only the first round is asked at once, and further agents one at a time
+    - 'speculative': all agents are asked at once, but answers after the policy is
+      satisfied are dropped, giving the same results as 'sequential' in roughly the time
+      of one round of calls. Calls that have not been sent yet, including those waiting
+      for the rate limiter or a router backend, are cancelled; answers that still arrive
+      are counted as speculative_discarded in the run metrics.
+    """
     assessments = []
     initial_decisions = []
     final_decisions = []
-    decided = False
+    policy = get_agent_policy(n_agents)
     
-    for agent in range(0, n_agents):
-        print(f"Agent {agent}")
-        if decided:
-            continue
-        
-        assessment, initial_decision, final_decision, thoughts = get_ai_assessment(Criterion, content, ai_model)
+    def store(agent, result):
+        assessment, initial_decision, final_decision, thoughts = result
         
         assessments.append(assessment)
         initial_decisions.append(initial_decision)
         final_decisions.append(final_decision)
         
-        col_decision = f"Final Decision - SC{SC_num}: {Criterion['type']}"
-        col_initial = f"Initial Decision - SC{SC_num}: {Criterion['type']}"
-        col_thoughts = f"Thoughts - SC{SC_num}: {Criterion['type']}"
+        store_in_info_all(info_all, agent, paper_num, SC_num, Criterion, title, abstract, initial_decision, final_decision, thoughts)
         
-        info_all[agent].loc[paper_num, ['Paper Number', "Title", "Abstract"]] = [paper_num, title, abstract] if title and abstract else 'NO DATA'
-        info_all[agent].loc[paper_num, col_decision] = final_decision 
-        info_all[agent].loc[paper_num, col_initial] = initial_decision 
-        info_all[agent].loc[paper_num, col_thoughts] = thoughts 
+        return policy.enough(initial_decisions, final_decisions)
+    
+    if agent_mode == 'sequential' or n_agents < 2:
+        for agent in range(0, n_agents):
+            print(f"Agent {agent}")
+            if store(agent, get_ai_assessment(Criterion, content, ai_model, agent)):
+                break
+        return assessments, initial_decisions, final_decisions
+    
+    if agent_mode not in ('parallel', 'speculative'):
+        raise ValueError(f"Unknown agent mode: {agent_mode}")
+    
+    up_front = policy.first_round() if agent_mode == 'parallel' and policy.adaptive else n_agents
+    print(f"Asking {up_front} agents at once ({agent_mode})")
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=n_agents)
+    futures = []
+    try:
+        futures = [executor.submit(get_ai_assessment, Criterion, content, ai_model, agent, cancelled) for agent in range(up_front)]
         
-        if not "No" in initial_decision[:6] and not "No" in final_decision:
-            decided = True
+        # Results are consumed in agent order so the output matches the sequential layout
+        for agent in range(n_agents):
+            print(f"Agent {agent}")
+            if agent >= up_front:
+                futures.append(executor.submit(get_ai_assessment, Criterion, content, ai_model, agent, cancelled))
+            decided = store(agent, futures[agent].result())
+            if decided and (agent_mode == 'speculative' or policy.adaptive):
+                break
+    finally:
+        # Calls that are no longer needed are not sent; the pool waits for the ones already on their way
+        cancelled.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    
+    for agent, future in enumerate(futures[len(final_decisions):], len(final_decisions)):
+        if future.cancelled() or future.exception() is not None:
+            continue
+        # A dropped answer should not show up as the backend of an agent that was not run
+        backend = pop_served(Criterion['type'], content, agent) or ai_model
+        if backend != 'cache':
+            observe_discarded(backend, Criterion['type'], agent)
     
     return assessments, initial_decisions, final_decisions
 
@@ -1,20 +1,78 @@
-import boto3
 import json
 import os
 import time
 import random
-import requests
-import base64
-from groq import Groq
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
-import google.generativeai as genai
-import anthropic
+from response_cache import get_cache
+from rate_limiter import CallCancelled, wait_for_capacity
+from router import get_router
+from metrics import observe_call, observe_cache_hit, estimate_tokens
 
 load_dotenv()
 
-session = boto3.Session(profile_name='bedrockprofile')
-brt = boto3.client(service_name='bedrock-runtime')
+# One long-lived client per provider (and per model for Gemini), shared by all threads
+_clients = {}
+_clients_lock = threading.Lock()
+_max_connections = 10
+
+def configure_clients(max_connections=10):
+    """Size the HTTP connection pools; call before the first request (e.g. to the screening concurrency)"""
+    global _max_connections
+    _max_connections = max(1, int(max_connections))
+
+# Provider SDKs are imported on first use, so a run only pays for the SDK it needs
+
+def _http_client():
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=_max_connections,
+            max_keepalive_connections=_max_connections,
+            keepalive_expiry=60
+        ),
+        timeout=httpx.Timeout(120, connect=10)
+    )
+
+def _build_client(provider, model=None):
+    if provider == 'groq':
+        from groq import Groq
+        return Groq(api_key=os.environ.get("GROQ_API_KEY"), http_client=_http_client())
+    elif provider == 'openai':
+        from openai import OpenAI
+        return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=_http_client())
+    elif provider == 'anthropic':
+        import anthropic
+        return anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"), http_client=_http_client())
+    elif provider == 'bedrock':
+        import boto3
+        from botocore.config import Config as BotoConfig
+        return boto3.client(service_name='bedrock-runtime', config=BotoConfig(max_pool_connections=_max_connections))
+    elif provider == 'google':
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        return genai.GenerativeModel(model)
+    raise ValueError(f"Unknown provider: {provider}")
+
+def get_client(provider, model=None):
+    """Return the shared client for a provider, creating it on first use"""
+    key = (provider, model)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _build_client(provider, model)
+        return _clients[key]
+
+def close_clients():
+    """Close all pooled connections (called at the end of a run)"""
+    with _clients_lock:
+        for client in _clients.values():
+            close = getattr(client, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    print(f"Error closing client: {str(e)}")
+        _clients.clear()
 
 class RateLimitException(Exception):
     pass
@@ -27,62 +85,280 @@ def exponential_backoff(func, max_retries=10, initial_delay=1, factor=2, jitter=
             try:
                 return func(*args, **kwargs)
             except RateLimitException as e:
-                if retries == max_retries - 1:
+                # Behind the router, another backend takes over instead of waiting here
+                if retries == max_retries - 1 or getattr(_call, 'failover', False):
                     raise e
                 sleep_time = delay * (random.uniform(1 - jitter, 1 + jitter))
                 print(f"Rate limit hit. Retrying in {sleep_time:.2f} seconds...")
                 time.sleep(sleep_time)
+                # The retry is a new request, so it takes its share of the rate limit again
+                capacity = getattr(_call, 'capacity', None)
+                if capacity is not None:
+                    sleep_time += wait_for_capacity(*capacity)
+                _call.retries = getattr(_call, 'retries', 0) + 1
+                _call.backoff_seconds = getattr(_call, 'backoff_seconds', 0.0) + sleep_time
                 retries += 1
                 delay *= factor
     return wrapper
 
+# Input tokens reported by the providers over the run, and how many were served from
+# the provider's prompt cache (cache_write counts tokens written to it, where reported)
+_token_usage = {'input': 0, 'cached': 0, 'cache_write': 0, 'calls': 0}
+_usage_lock = threading.Lock()
+# Usage and retries of the call in progress on this thread, for the call's metrics,
+# and the rate limiter arguments its retries acquire capacity with
+_call = threading.local()
+_prompt_caching = False
+
+def configure_prompt_caching(enabled=False):
+    """Send prompt prefixes separately (system message, cache-control markers) when enabled"""
+    global _prompt_caching
+    _prompt_caching = bool(enabled)
+
+def prompt_caching_enabled():
+    return _prompt_caching
+
+def record_usage(input_tokens, cached_tokens=0, cache_write_tokens=0, output_tokens=0):
+    with _usage_lock:
+        _token_usage['input'] += int(input_tokens or 0)
+        _token_usage['cached'] += int(cached_tokens or 0)
+        _token_usage['cache_write'] += int(cache_write_tokens or 0)
+        _token_usage['calls'] += 1
+    _call.usage = (int(input_tokens or 0), int(cached_tokens or 0), int(output_tokens or 0))
+
+def token_usage():
+    with _usage_lock:
+        return dict(_token_usage)
+
+def _record_chat_usage(usage):
+    """Token usage of an OpenAI-style chat completion (completion.usage)"""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    record_usage(
+        getattr(usage, 'prompt_tokens', 0), getattr(details, 'cached_tokens', 0) if details else 0,
+        output_tokens=getattr(usage, 'completion_tokens', 0)
+    )
+
+def _record_claude_usage(usage, output_text=None):
+    """
+    Token usage of a Claude message (a dict from Bedrock or the SDK's usage object).
+    With output_text, the output tokens are estimated from it: a response stopped early
+    never reports how many tokens it generated.
+    """
+    if not isinstance(usage, dict):
+        usage = {key: getattr(usage, key, 0) for key in
+                 ('input_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens', 'output_tokens')}
+    cache_read = usage.get("cache_read_input_tokens") or 0
+    cache_write = usage.get("cache_creation_input_tokens") or 0
+    output_tokens = estimate_tokens(output_text) if output_text is not None else usage.get("output_tokens") or 0
+    record_usage((usage.get("input_tokens") or 0) + cache_read + cache_write, cache_read, cache_write, output_tokens)
+
+def _record_gemini_usage(usage):
+    """Token usage from a Gemini response's (or last streamed chunk's) usage_metadata"""
+    if usage is None:
+        return
+    record_usage(
+        getattr(usage, 'prompt_token_count', 0), getattr(usage, 'cached_content_token_count', 0),
+        output_tokens=getattr(usage, 'candidates_token_count', 0)
+    )
+
+def chat_messages(prompt, prefix=None):
+    """The prefix, when given, replaces the generic system message so it leads every request unchanged"""
+    return [
+        {"role": "system", "content": prefix or "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+# Backend registry: model name -> function(prompt, max_tokens, prefix=None, stop_when=None, json_schema=None)
+BACKENDS = {}
+
+def register_backend(name):
+    """Register an ask_* function as the backend for a model name"""
+    def register(func):
+        BACKENDS[name] = func
+        return func
+    return register
+
+def _collect_stream(pieces, stop_when):
+    """Join streamed text pieces, stopping as soon as stop_when(text) is true; returns (text, stopped)"""
+    text = ''
+    for piece in pieces:
+        text += piece or ''
+        if stop_when(text):
+            print("Decision parsed - stopping the response early")
+            return text, True
+    return text, False
+
+def _chat_completion(client, model, prompt, max_tokens, prefix=None, stop_when=None, json_schema=None):
+    """Chat completion for OpenAI-compatible clients, streamed when stop_when is given"""
+    options = {'max_tokens': int(max_tokens)} if max_tokens is not None else {}
+    if json_schema is not None:
+        # JSON mode; the prompt itself describes the fields
+        options['response_format'] = {'type': 'json_object'}
+    if stop_when is None:
+        completion = client.chat.completions.create(model=model, messages=chat_messages(prompt, prefix), **options)
+        _record_chat_usage(completion.usage)
+        return completion.choices[0].message.content
+
+    # The usage arrives in a last chunk without choices (Groq also reports it in x_groq);
+    # a response stopped early closes the stream before it, so its usage stays estimated
+    usage = []
+    def pieces():
+        for chunk in stream:
+            chunk_usage = getattr(chunk, 'usage', None) or getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+            if chunk_usage is not None:
+                usage.append(chunk_usage)
+            if chunk.choices:
+                yield chunk.choices[0].delta.content
+    stream = client.chat.completions.create(
+        model=model, messages=chat_messages(prompt, prefix), stream=True,
+        extra_body={'stream_options': {'include_usage': True}}, **options
+    )
+    try:
+        output, _ = _collect_stream(pieces(), stop_when)
+    finally:
+        # Closing the stream ends generation on the provider's side
+        stream.close()
+    if usage:
+        _record_chat_usage(usage[-1])
+    return output
+
+def _decision_tool(json_schema):
+    """Claude request options forcing a tool call whose input follows json_schema"""
+    return {
+        "tools": [{"name": "record_assessment", "description": "Record the screening assessment", "input_schema": json_schema}],
+        "tool_choice": {"type": "tool", "name": "record_assessment"}
+    }
+
+def _message_text(content):
+    """Text of a Claude message; the input of a tool call is returned as JSON"""
+    for block in content:
+        if block.get("type") == "tool_use":
+            return json.dumps(block.get("input"), ensure_ascii=False)
+    return "".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+@register_backend('aws_claude')
 @exponential_backoff
-def ask_aws_claude(prompt, max_tokens=200000):
+def ask_aws_claude(prompt, max_tokens=200000, prefix=None, stop_when=None, json_schema=None):
     load_dotenv()
     newline = "\n\n"
-    body = json.dumps({
+    body = {
         "max_tokens": int(max_tokens) if max_tokens is not None else 200000,
         "messages": [{"role": "user",
                     "content": f"{newline}Human: {prompt}{newline}Assistant:"}],
         "anthropic_version": "bedrock-2023-05-31"
-    })
+    }
+    if prefix:
+        body["system"] = prefix
+    if json_schema is not None:
+        body.update(_decision_tool(json_schema))
+        stop_when = None
+    body = json.dumps(body)
  
     modelId = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
     accept = 'application/json'
     contentType = 'application/json'
     
+    brt = get_client('bedrock')
+    if stop_when is not None:
+        response = brt.invoke_model_with_response_stream(body=body, modelId=modelId, accept=accept, contentType=contentType)
+        # message_start carries the input usage and message_delta the output tokens
+        usage = {}
+        def pieces():
+            for event in response['body']:
+                if 'chunk' not in event:
+                    continue
+                event = json.loads(event['chunk']['bytes'])
+                if event.get('type') == 'message_start':
+                    usage.update(event.get('message', {}).get('usage') or {})
+                elif event.get('type') == 'message_delta':
+                    usage.update(event.get('usage') or {})
+                elif event.get('type') == 'content_block_delta':
+                    yield event['delta'].get('text', '')
+        try:
+            out, stopped = _collect_stream(pieces(), stop_when)
+        finally:
+            response['body'].close()
+        if usage:
+            _record_claude_usage(usage, out if stopped else None)
+        print(out)
+        return out
+    
     response = brt.invoke_model(body=body, modelId=modelId, accept=accept, contentType=contentType)
     
     response_body = json.loads(response.get("body").read())
-    out = response_body.get("content")[0]["text"]
+    _record_claude_usage(response_body.get("usage") or {})
+    out = _message_text(response_body.get("content"))
     print(out)
     return out
 
+@register_backend('claude')
 @exponential_backoff
-def ask_claude(prompt, max_tokens=10000):
-    client = anthropic.Anthropic(
-        api_key=os.environ.get("ANTHROPIC_API_KEY")
-    )
+def ask_claude(prompt, max_tokens=10000, prefix=None, stop_when=None, json_schema=None):
+    client = get_client('anthropic')
 
-    message = client.messages.create(
+    options = {}
+    if prefix:
+        # Cache the prefix; providers ignore the marker below their minimum cacheable length
+        options['system'] = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    if json_schema is not None:
+        options.update(_decision_tool(json_schema))
+        stop_when = None
+    request = dict(
         model="claude-3-5-sonnet-20241022",
         max_tokens=int(max_tokens) if max_tokens is not None else 1000,
         temperature=0,
         messages=[
             {"role": "user", "content": prompt}
-        ]
+        ],
+        **options
     )
-    out = message.content[0].text
+    if stop_when is not None:
+        with client.messages.stream(**request) as stream:
+            out, stopped = _collect_stream(stream.text_stream, stop_when)
+            if stopped:
+                # The snapshot has the input usage from message_start, but no final output count
+                _record_claude_usage(stream.current_message_snapshot.usage, out)
+            else:
+                _record_claude_usage(stream.get_final_message().usage)
+        print(out)
+        return out
+    
+    message = client.messages.create(**request)
+    _record_claude_usage(message.usage)
+    out = _message_text([block.model_dump() for block in message.content])
     print(out)
     return out
 
+@register_backend('gemini')
 @exponential_backoff
-def ask_gemini(prompt, max_tokens=None):
-    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-    model = genai.GenerativeModel("gemini-1.5-flash")
+def ask_gemini(prompt, max_tokens=None, prefix=None, stop_when=None, json_schema=None):
+    import google.generativeai as genai
+    model = get_client('google', "gemini-1.5-flash")
+    if prefix:
+        # The shared client has no system instruction, so the prefix simply leads the prompt
+        prompt = prefix + "\n\n" + prompt
+    generation_config = {'max_output_tokens': int(max_tokens)} if max_tokens is not None else {}
+    if json_schema is not None:
+        generation_config['response_mime_type'] = 'application/json'
+    options = {'generation_config': generation_config} if generation_config else {}
     
     try:
-        response = model.generate_content(prompt)
+        if stop_when is not None:
+            # Every chunk carries the usage so far, so the last one read is used
+            usage = []
+            def pieces():
+                for chunk in model.generate_content(prompt, stream=True, **options):
+                    if getattr(chunk, 'usage_metadata', None) is not None:
+                        usage.append(chunk.usage_metadata)
+                    yield chunk.text
+            out, _ = _collect_stream(pieces(), stop_when)
+            if usage:
+                _record_gemini_usage(usage[-1])
+            print(out)
+            return out
+        response = model.generate_content(prompt, **options)
     except genai.types.BlockedPromptException as e:
         if "exhausted" in str(e).lower() or "429" in str(e):
             print(e)
@@ -94,96 +370,147 @@ def ask_gemini(prompt, max_tokens=None):
             raise RateLimitException("Gemini API rate limit exceeded")
         raise
     
+    _record_gemini_usage(getattr(response, 'usage_metadata', None))
     print(response.text)
     return response.text
 
+@register_backend('gemma2')
 @exponential_backoff
-def ask_gemma2(prompt, max_tokens=200000):
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+def ask_gemma2(prompt, max_tokens=200000, prefix=None, stop_when=None, json_schema=None):
+    client = get_client('groq')
     model = 'gemma2-9b-it'
     
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=int(max_tokens) if max_tokens is not None else 200000
-    )
-    
-    output = completion.choices[0].message.content
+    output = _chat_completion(client, model, prompt, max_tokens if max_tokens is not None else 200000, prefix, stop_when, json_schema)
     print(output)
     return output
 
-def ask_llama3(prompt, max_tokens=200000):
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+@register_backend('llama3')
+@exponential_backoff
+def ask_llama3(prompt, max_tokens=200000, prefix=None, stop_when=None, json_schema=None):
+    client = get_client('groq')
     model = 'llama-3.2-90b-text-preview'
     
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=int(max_tokens) if max_tokens is not None else 200000
-    )
-    
-    output = completion.choices[0].message.content
+    output = _chat_completion(client, model, prompt, max_tokens if max_tokens is not None else 200000, prefix, stop_when, json_schema)
     print(output)
     return output
 
+@register_backend('mixtral')
 @exponential_backoff
-def ask_mixtral(prompt, max_tokens=200000):
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+def ask_mixtral(prompt, max_tokens=200000, prefix=None, stop_when=None, json_schema=None):
+    client = get_client('groq')
     model = "mixtral-8x7b-32768"
     
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=int(max_tokens) if max_tokens is not None else 200000
-    )
-    
-    output = completion.choices[0].message.content
+    output = _chat_completion(client, model, prompt, max_tokens if max_tokens is not None else 200000, prefix, stop_when, json_schema)
     print(output)
     return output
 
+@register_backend('openai')
 @exponential_backoff
-def ask_openai(prompt):
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+def ask_openai(prompt, max_tokens=None, prefix=None, stop_when=None, json_schema=None):
+    client = get_client('openai')
     
-    completion = client.chat.completions.create(
-        model="gpt-4-turbo-preview",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        # max_tokens=int(max_tokens) if max_tokens is not None else 100000
-    )
-    
-    output = completion.choices[0].message.content
+    # No output limit unless a response budget sets one
+    output = _chat_completion(client, "gpt-4-turbo-preview", prompt, max_tokens, prefix, stop_when, json_schema)
     print(output)
     return output
 
-def ask_ai(prompt, ai_model='gemini', max_tokens=None):
-    print(f"Asking {ai_model}")
-    if ai_model == "claude":
-        return ask_claude(prompt, max_tokens)
-    elif ai_model == "aws_claude":
-        return ask_aws_claude(prompt, max_tokens)
-    elif ai_model == "gemini":
-        return ask_gemini(prompt, max_tokens)
-    elif ai_model == "gemma2":
-        return ask_gemma2(prompt, max_tokens)
-    elif ai_model == "llama3":
-        return ask_llama3(prompt, max_tokens)
-    elif ai_model == "mixtral":
-        return ask_mixtral(prompt, max_tokens)
-    elif ai_model == "openai":
-        return ask_openai(prompt)
-    else:
+def call_model(prompt, ai_model='gemini', max_tokens=None, prefix=None, stop_when=None, json_schema=None):
+    backend = BACKENDS.get(ai_model)
+    if backend is None:
         raise ValueError(f"Unknown AI model: {ai_model}")
+    options = {}
+    if prefix is not None:
+        options['prefix'] = prefix
+    if stop_when is not None:
+        options['stop_when'] = stop_when
+    if json_schema is not None:
+        options['json_schema'] = json_schema
+    return backend(prompt, max_tokens, **options)
+
+def ask_ai(prompt, ai_model='gemini', max_tokens=None, use_cache=True, sample=0, prefix=None, criterion=None, stop_when=None, json_schema=None, cancelled=None):
+    """
+    Ask ai_model to respond to prompt. Responses are stored in the response cache
+    unless use_cache is False; sample distinguishes repeated independent answers
+    to the same prompt (e.g. one per agent) so they are cached separately.
+
+    prefix is the stable start of the prompt (instructions and criteria). With prompt
+    caching enabled it is sent separately so providers can cache it; otherwise it is
+    joined to the prompt. The response cache sees the same full text either way.
+
+    With stop_when, the response is streamed and cut off as soon as stop_when(text so
+    far) is true, e.g. once the decision has been given.
+
+    With json_schema, backends that support it are asked for JSON (JSON mode, or a
+    forced tool call for Claude whose arguments are returned as the JSON text).
+
+    With ai_model 'router', the call goes to a backend of the configured router pool
+    (see router.py), failing over to the others on errors; served_backend() then
+    names the backend that answered. Responses are cached under 'router'.
+
+    Each call is counted in the run metrics (see metrics.py) under the backend that
+    made it, criterion and sample (the agent).
+
+    cancelled is an optional threading.Event. Once it is set, a call that has not been
+    sent yet (including one waiting for the rate limiter) raises CallCancelled instead;
+    a response cache hit is still returned.
+    """
+    full_prompt = prefix + "\n\n" + prompt if prefix else prompt
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        key = cache.make_key(ai_model, full_prompt, {'max_tokens': max_tokens, 'sample': sample})
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"Using cached {ai_model} response")
+            observe_cache_hit(ai_model, criterion, sample)
+            _call.backend = 'cache'
+            return cached
+    
+    def attempt(backend):
+        print(f"Asking {backend}")
+        _call.usage = None
+        _call.retries = 0
+        _call.backoff_seconds = 0.0
+        started = time.time()
+        try:
+            if prefix and _prompt_caching:
+                response = call_model(prompt, backend, max_tokens, prefix, stop_when, json_schema)
+            else:
+                response = call_model(full_prompt, backend, max_tokens, stop_when=stop_when, json_schema=json_schema)
+        except Exception:
+            observe_call(backend, criterion, sample, time.time() - started, retries=_call.retries,
+                         backoff_seconds=_call.backoff_seconds, error=True)
+            raise
+        
+        # Providers that report no usage get an estimate from the text lengths
+        usage = _call.usage
+        input_tokens, cached_tokens, output_tokens = usage or (estimate_tokens(full_prompt), 0, estimate_tokens(response))
+        observe_call(backend, criterion, sample, time.time() - started, input_tokens, cached_tokens, output_tokens,
+                     _call.retries, _call.backoff_seconds, estimated=usage is None)
+        return response
+    
+    _call.backend = None
+    router = get_router(ai_model)
+    if router is not None:
+        _call.failover = True
+        try:
+            _call.backend, response = router.call(attempt, full_prompt, max_tokens, cancelled)
+        finally:
+            _call.failover = False
+    else:
+        wait_for_capacity(ai_model, full_prompt, max_tokens, cancelled)
+        _call.capacity = (ai_model, full_prompt, max_tokens, cancelled)
+        try:
+            response = attempt(ai_model)
+        finally:
+            _call.capacity = None
+        _call.backend = ai_model
+    
+    if cache is not None and response:
+        cache.put(key, ai_model, response)
+    return response
+
+def served_backend():
+    """Backend that answered the last ask_ai call on this thread ('cache' for a cache hit)"""
+    return getattr(_call, 'backend', None)
 
 # ask_ai('why sky blue','openai')
\ No newline at end of file
@@ -0,0 +1,229 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from ai_interaction import prompt_parts, parse_assessment, get_ai_assessment, reask_unparseable, response_budget
+from ask_AI import chat_messages, prompt_caching_enabled, record_usage
+from router import record_served
+
+class BatchProvider(ABC):
+    """
+    Provider-neutral batch job interface. A job is a JSONL file with one request per
+    line: {"custom_id", "model", "criterion", "prefix", "prompt", "max_tokens", "sample"}, where
+    prefix is the stable start of the prompt (see ask_AI.ask_ai).
+    """
+
+    # ask_AI model names the provider can serve (None for any)
+    models = None
+
+    @abstractmethod
+    def submit(self, requests_path):
+        """Start a job for the requests in requests_path and return its job ID"""
+
+    @abstractmethod
+    def status(self, job_id):
+        """'running', 'completed' or 'failed'"""
+
+    @abstractmethod
+    def results(self, job_id):
+        """{custom_id: response text} for a completed job"""
+
+class LocalBatchProvider(BatchProvider):
+    """
+    File-based stand-in for a provider batch API, for testing bulk runs. The job is
+    worked through when it is first polled, using responder(prompt, ai_model,
+    max_tokens, sample, prefix, criterion), which defaults to ask_ai.
+    """
+
+    def __init__(self, work_dir, responder=None):
+        self.work_dir = work_dir
+        self.responder = responder
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _path(self, job_id, kind):
+        return os.path.join(self.work_dir, f"{job_id}.{kind}.jsonl")
+
+    def submit(self, requests_path):
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(requests_path, self._path(job_id, 'requests'))
+        return job_id
+
+    def status(self, job_id):
+        if os.path.exists(self._path(job_id, 'results')):
+            return 'completed'
+        if not os.path.exists(self._path(job_id, 'requests')):
+            return 'failed'
+
+        responder = self.responder
+        if responder is None:
+            from ask_AI import ask_ai
+            responder = lambda prompt, ai_model, max_tokens, sample, prefix, criterion: ask_ai(prompt, ai_model, max_tokens, sample=sample, prefix=prefix, criterion=criterion)
+
+        partial_path = self._path(job_id, 'partial')
+        with open(self._path(job_id, 'requests'), 'r', encoding='utf-8') as requests_file, \
+             open(partial_path, 'w', encoding='utf-8') as results_file:
+            for line in requests_file:
+                request = json.loads(line)
+                try:
+                    text = responder(request['prompt'], request['model'], request.get('max_tokens'), request.get('sample', 0), request.get('prefix'), request.get('criterion'))
+                    result = {'custom_id': request['custom_id'], 'text': text}
+                except Exception as e:
+                    result = {'custom_id': request['custom_id'], 'error': str(e)}
+                results_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        os.replace(partial_path, self._path(job_id, 'results'))
+        return 'completed'
+
+    def results(self, job_id):
+        results = {}
+        with open(self._path(job_id, 'results'), 'r', encoding='utf-8') as f:
+            for line in f:
+                result = json.loads(line)
+                if 'text' in result:
+                    results[result['custom_id']] = result['text']
+        return results
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI Batch API (chat completions, 24 hour completion window)"""
+
+    models = {'openai': 'gpt-4-turbo-preview'}
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _client(self):
+        from ask_AI import get_client
+        return get_client('openai')
+
+    def submit(self, requests_path):
+        openai_path = requests_path.replace('.jsonl', '.openai.jsonl')
+        with open(requests_path, 'r', encoding='utf-8') as src, open(openai_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                request = json.loads(line)
+                prompt, prefix = request['prompt'], request.get('prefix')
+                if prefix and not prompt_caching_enabled():
+                    prompt, prefix = prefix + "\n\n" + prompt, None
+                body = {
+                    'model': self.models.get(request['model'], request['model']),
+                    'messages': chat_messages(prompt, prefix)
+                }
+                if request.get('max_tokens'):
+                    body['max_tokens'] = int(request['max_tokens'])
+                dst.write(json.dumps({
+                    'custom_id': request['custom_id'],
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': body
+                }, ensure_ascii=False) + '\n')
+
+        client = self._client()
+        with open(openai_path, 'rb') as f:
+            uploaded = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+        return batch.id
+
+    def status(self, job_id):
+        batch = self._client().batches.retrieve(job_id)
+        if batch.status == 'completed':
+            return 'completed'
+        if batch.status in ('failed', 'expired', 'cancelled'):
+            return 'failed'
+        return 'running'
+
+    def results(self, job_id):
+        client = self._client()
+        batch = client.batches.retrieve(job_id)
+        results = {}
+        if not batch.output_file_id:
+            return results
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            try:
+                body = result['response']['body']
+                results[result['custom_id']] = body['choices'][0]['message']['content']
+                usage = body.get('usage') or {}
+                record_usage(usage.get('prompt_tokens', 0), (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0))
+            except (KeyError, IndexError, TypeError):
+                print(f"No usable response for {result.get('custom_id')}")
+        return results
+
+BATCH_PROVIDERS = {
+    'local': LocalBatchProvider,
+    'openai': OpenAIBatchProvider
+}
+
+def get_batch_provider(name, work_dir, ai_model=None):
+    if name not in BATCH_PROVIDERS:
+        raise ValueError(f"Unknown batch provider: {name}")
+    provider_class = BATCH_PROVIDERS[name]
+    if ai_model is not None and provider_class.models is not None and ai_model not in provider_class.models:
+        raise ValueError(f"The {name} batch provider cannot serve {ai_model} (models: {', '.join(provider_class.models)})")
+    return provider_class(work_dir)
+
+def run_batch_job(provider, requests, work_dir, poll_seconds=60):
+    """Write requests to a job file, submit it, wait for it to finish and return its results"""
+    os.makedirs(work_dir, exist_ok=True)
+    requests_path = os.path.join(work_dir, f"batch-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}.jsonl")
+    with open(requests_path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+
+    job_id = provider.submit(requests_path)
+    print(f"Submitted batch job {job_id} with {len(requests)} requests")
+    while True:
+        status = provider.status(job_id)
+        if status == 'completed':
+            break
+        if status == 'failed':
+            raise RuntimeError(f"Batch job {job_id} failed")
+        print(f"Batch job {job_id} is {status}, checking again in {poll_seconds} seconds")
+        time.sleep(poll_seconds)
+
+    results = provider.results(job_id)
+    print(f"Batch job {job_id} returned {len(results)} of {len(requests)} responses")
+    return results
+
+def make_bulk_wave(provider, ai_model, work_dir, poll_seconds=60):
+    """
+    Build an ask_wave function for screening_logic.screen_in_waves that sends each
+    (criterion, agent) wave as one batch job. Papers without a usable response in the
+    job are asked again with a normal call.
+    """
+    def ask_wave(Criterion, agent, contents):
+        requests = []
+        for paper_num, content in contents.items():
+            prefix, prompt = prompt_parts(Criterion, content)
+            requests.append({
+                'custom_id': str(paper_num),
+                'model': ai_model,
+                'criterion': Criterion['type'],
+                'prefix': prefix,
+                'prompt': prompt,
+                'max_tokens': response_budget('single', Criterion),
+                'sample': agent
+            })
+        results = run_batch_job(provider, requests, work_dir, poll_seconds)
+
+        answers = {}
+        for paper_num, content in contents.items():
+            assessment = results.get(str(paper_num))
+            if assessment is None:
+                print(f"Paper {paper_num} missing from batch results, asking separately")
+                answers[paper_num] = get_ai_assessment(Criterion, content, ai_model, agent)
+            else:
+                initial_decision, final_decision, thoughts = parse_assessment(assessment)
+                if final_decision == "No Data":
+                    initial_decision, final_decision, thoughts = reask_unparseable(Criterion, content, ai_model, agent, assessment)
+                record_served(Criterion['type'], content, agent, f"{ai_model} batch")
+                answers[paper_num] = (assessment, initial_decision, final_decision, thoughts)
+        return answers
+
+    return ask_wave
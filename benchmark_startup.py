@@ -0,0 +1,63 @@
+"""
+Measure how long it takes to import each entry point in a fresh interpreter.
+
+Usage: python benchmark_startup.py [repeats]
+
+For every module the script reports the best wall-clock import time over the
+repeats, and the slowest third-party packages pulled in (from python -X importtime).
+"""
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = ['main', 'server', 'ask_AI', 'screening_logic']
+PROVIDER_SDKS = ['groq', 'openai', 'anthropic', 'boto3', 'google.generativeai', 'flask']
+
+def time_import(module):
+    """Wall-clock seconds for a fresh interpreter to import module (None if it fails)"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', f'import {module}'], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        print(f"  import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+        return None
+    return elapsed
+
+def slowest_imports(module, top=5):
+    """The top-level packages with the largest cumulative import time, in seconds"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True)
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        try:
+            _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+            cumulative = int(cumulative)
+        except ValueError:
+            continue
+        package = name.strip().split('.')[0]
+        if not name.startswith(' ') and package != module:
+            packages[package] = max(packages.get(package, 0), cumulative)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return [(package, micros / 1e6) for package, micros in ranked[:top]]
+
+def main(repeats=3):
+    baseline = min(time_import('os') or 0 for _ in range(repeats))
+    print(f"Interpreter start-up: {baseline:.3f}s\n")
+
+    for module in ENTRY_POINTS:
+        times = [time_import(module) for _ in range(repeats)]
+        times = [t for t in times if t is not None]
+        if not times:
+            continue
+        print(f"import {module}: {min(times):.3f}s ({min(times) - baseline:.3f}s over start-up)")
+        for package, seconds in slowest_imports(module):
+            print(f"    {package:<24} {seconds:.3f}s")
+        loaded = subprocess.run(
+            [sys.executable, '-c', f'import sys, {module}; print(",".join(m for m in {PROVIDER_SDKS!r} if m in sys.modules))'],
+            capture_output=True, text=True
+        ).stdout.strip()
+        print(f"    SDKs loaded at import: {loaded or 'none'}\n")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
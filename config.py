@@ -11,6 +11,8 @@ def get_ai_model_name(model_to_use):
         'azure-gpt-4-turbo': 'gemini',  # Default to gemini since Azure isn't in new ask_ai
         'mixtral-8x7b-32768': 'mixtral',
         'llama2-70b-4096': 'llama3',
-        'claude': 'claude'
+        'claude': 'claude',
+        'openai': 'openai',
+        'router': 'router'  # The backend pool set up in the router config
     }
     return model_mapping.get(model_to_use, 'gemini')
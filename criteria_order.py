@@ -0,0 +1,187 @@
+import json
+import os
+import sys
+import threading
+from results_journal import journal_path, _journal_layout
+
+class CriteriaOrder:
+    """
+    Order in which criteria are evaluated, chosen to minimise the expected cost of a
+    paper when screening stops at the first rejection (skip_criteria).
+
+    Each criterion's rejection rate p and average cost c (AI calls or seconds) are
+    tracked as papers are screened, and every reorder_every evaluations the criteria
+    are sorted by c / p, which is the cheapest order for independent filters. Rates
+    are smoothed towards 1/2, so a criterion that has hardly been evaluated moves
+    forward and gets measured; with no data the order stays as in the CSV.
+
+    Criteria keep their SC numbers, so output columns are unaffected.
+    """
+
+    def __init__(self, screening_criteria, n_agents, cost='calls', reorder_every=10):
+        if cost not in ('calls', 'seconds'):
+            raise ValueError(f"Unknown criteria order cost: {cost}")
+        self.criteria = list(enumerate(screening_criteria, 1))
+        self.n_agents = n_agents
+        self.cost = cost
+        self.reorder_every = max(1, int(reorder_every))
+        self.stats = {SC_num: {'evaluated': 0, 'rejected': 0, 'calls': 0, 'seconds': 0.0} for SC_num, _ in self.criteria}
+        self.current = list(self.criteria)
+        self.since_reorder = 0
+        self._lock = threading.Lock()
+
+    def matches(self, screening_criteria):
+        return [Criterion['type'] for _, Criterion in self.criteria] == [Criterion['type'] for Criterion in screening_criteria]
+
+    def order(self):
+        """[(SC_num, Criterion)] in the order to evaluate them"""
+        with self._lock:
+            return list(self.current)
+
+    def record(self, SC_num, rejected, calls, seconds=0.0):
+        """Count one evaluation of criterion SC_num"""
+        with self._lock:
+            stats = self.stats[SC_num]
+            stats['evaluated'] += 1
+            stats['rejected'] += bool(rejected)
+            stats['calls'] += calls
+            stats['seconds'] += seconds
+            self.since_reorder += 1
+            if self.since_reorder >= self.reorder_every:
+                self._reorder()
+
+    def rejection_rate(self, SC_num):
+        stats = self.stats[SC_num]
+        return (stats['rejected'] + 1) / (stats['evaluated'] + 2)
+
+    def mean_cost(self, SC_num):
+        stats = self.stats[SC_num]
+        if not stats['evaluated']:
+            return float(self.n_agents) if self.cost == 'calls' else 1.0
+        return stats[self.cost] / stats['evaluated']
+
+    def _reorder(self):
+        self.current = sorted(self.criteria, key=lambda item: self.mean_cost(item[0]) / self.rejection_rate(item[0]))
+        self.since_reorder = 0
+
+    def expected_cost(self, order=None):
+        """Expected cost per paper of evaluating the criteria in order (default: the current one)"""
+        total = 0.0
+        reached = 1.0
+        for SC_num, _ in (order or self.current):
+            total += reached * self.mean_cost(SC_num)
+            reached *= 1 - self.rejection_rate(SC_num)
+        return total
+
+    def report(self):
+        with self._lock:
+            return {
+                'cost': self.cost,
+                'order': [Criterion['type'] for _, Criterion in self.current],
+                'criteria': {
+                    Criterion['type']: {
+                        **self.stats[SC_num],
+                        'seconds': round(self.stats[SC_num]['seconds'], 2),
+                        'rejection_rate': round(self.rejection_rate(SC_num), 3),
+                        'mean_cost': round(self.mean_cost(SC_num), 3)
+                    }
+                    for SC_num, Criterion in self.criteria
+                },
+                'expected_cost_csv_order': round(self.expected_cost(self.criteria), 3),
+                'expected_cost_current_order': round(self.expected_cost(), 3)
+            }
+
+    def save_report(self, out_path):
+        report = self.report()
+        with open(os.path.join(out_path, 'criteria_order_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Criteria order: {' > '.join(report['order'])}")
+        print(f"Expected {report['cost']} per paper: {report['expected_cost_current_order']:.2f} "
+              f"(CSV order: {report['expected_cost_csv_order']:.2f})")
+        return report
+
+_order = None
+
+def configure_criteria_order(order_config=None, screening_criteria=(), n_agents=1, skip_criteria=True):
+    """
+    Set up criteria ordering from the criteria_order config, e.g.
+    {"enabled": true, "cost": "calls", "reorder_every": 10}
+    """
+    global _order
+    order_config = order_config or {}
+    _order = None
+    if not order_config.get('enabled', False):
+        return None
+    if not skip_criteria:
+        print("Criteria ordering needs skip_criteria - every criterion is evaluated anyway")
+        return None
+    _order = CriteriaOrder(
+        screening_criteria, n_agents,
+        cost=order_config.get('cost', 'calls'),
+        reorder_every=order_config.get('reorder_every', 10)
+    )
+    print("Criteria ordering enabled")
+    return _order
+
+def ordered_criteria(screening_criteria):
+    """[(SC_num, Criterion)] in evaluation order, numbered as in screening_criteria"""
+    if _order is None or not _order.matches(screening_criteria):
+        return list(enumerate(screening_criteria, 1))
+    return _order.order()
+
+def record_criterion_cost(SC_num, rejected, calls, seconds=0.0):
+    if _order is not None:
+        _order.record(SC_num, rejected, calls, seconds)
+
+def agents_asked(decisions):
+    """AI calls made for one criterion's decisions (none when triage decided it)"""
+    if decisions.get('Route', 'llm') != 'llm':
+        return 0
+    return sum(1 for d in decisions.get('Final', []) if d != 'NOT RUN')
+
+def simulate(path, reorder_every=10):
+    """
+    Replay the papers in a journal with criteria ordering and compare the AI calls
+    with those the run actually made. A criterion the run never asked about (because
+    the paper was rejected before it) is assumed to pass at its average cost, so the
+    saving is an estimate that errs low.
+    """
+    from screening_logic import summarize_criterion
+
+    papers, screening_criteria, n_agents = _journal_layout(path)
+    order = CriteriaOrder(screening_criteria, max(1, n_agents), reorder_every=reorder_every)
+    actual = simulated = 0
+    estimated = replayed = 0
+    for record in papers:
+        decisions = record.get('criteria')
+        if not decisions or record.get('duplicate_of'):
+            continue
+        replayed += 1
+        known = {
+            criterion: (agents_asked(d), summarize_criterion('Maybe', d.get('Initial', []), d.get('Final', []))[1])
+            for criterion, d in decisions.items()
+        }
+        actual += sum(calls for calls, _ in known.values())
+        for SC_num, Criterion in order.order():
+            if Criterion['type'] not in known:
+                simulated += order.mean_cost(SC_num)
+                estimated += 1
+                continue
+            calls, rejected = known[Criterion['type']]
+            simulated += calls
+            order.record(SC_num, rejected, calls)
+            if rejected:
+                break
+
+    saved = actual - simulated
+    print(f"Replayed {replayed} papers: {actual} AI calls as screened, about {simulated:.0f} with criteria ordering "
+          f"({saved:.0f} saved, {saved / actual if actual else 0:.1%})")
+    if estimated:
+        print(f"{estimated} criterion evaluations were never made by the run and were estimated")
+    print(f"Final order: {' > '.join(order.report()['order'])}")
+    return {'papers': replayed, 'actual_calls': actual, 'simulated_calls': round(simulated, 1), 'estimated': estimated}
+
+if __name__ == "__main__":
+    # Usage: python criteria_order.py AI_Output/<model>
+    out_path = sys.argv[1] if len(sys.argv) > 1 else '.'
+    simulate(journal_path(out_path))
@@ -1,12 +1,25 @@
+import os
 import pandas as pd
-import numpy as np
 import re
+import hashlib
 from itertools import zip_longest
 
+CORPUS_CACHE_DIR = os.path.join('AI_Output', 'corpus_cache')
+CORPUS_CACHE_VERSION = 1  # Bump when the cleaning changes, so old caches are not used
+
 def clean_string(s):
     s = str(s)
     return re.sub(r'\W+', '', s).lower()
 
+def paper_id(title):
+    """Stable paper ID: a hash of the cleaned title, so it survives re-ordering and sampling"""
+    return hashlib.sha1(clean_string(title).encode('utf-8')).hexdigest()[:16]
+
+def criterion_key(Criterion):
+    """Identify a criterion by its full text, so edited criteria are not treated as done"""
+    text = f"{Criterion['type']}\n{Criterion.get('included', '')}\n{Criterion.get('excluded', '')}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
 def find_column(df, column_name):
     """Find a column that contains the given name (case-insensitive)"""
     for col in df.columns:
@@ -14,8 +27,113 @@ def find_column(df, column_name):
             return col
     return None
 
-def load_papers(excel_sheet, debug=False):
-    papers = pd.read_excel(excel_sheet).replace(np.nan, '')
+RIS_FIELDS = {
+    'TI': 'Title', 'T1': 'Title',
+    'AB': 'Abstract', 'N2': 'Abstract',
+    'AU': 'Authors', 'A1': 'Authors',
+    'PY': 'Year', 'Y1': 'Year',
+    'JO': 'Journal', 'JF': 'Journal', 'T2': 'Journal',
+    'DO': 'DOI'
+}
+RIS_LINE = re.compile(r'^([A-Z][A-Z0-9])  -(?: (.*))?$')
+
+def read_ris(path):
+    """Read a RIS export (e.g. from Scopus, Web of Science or a reference manager) into a DataFrame"""
+    records = []
+    record = {}
+    field = None
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            match = RIS_LINE.match(line)
+            if not match:
+                if field and line.strip():
+                    record[field] += ' ' + line.strip()  # Wrapped value
+                continue
+            tag, value = match.group(1), (match.group(2) or '').strip()
+            if tag == 'ER':
+                if record:
+                    records.append(record)
+                record = {}
+                field = None
+                continue
+            field = RIS_FIELDS.get(tag)
+            if field is None:
+                continue
+            if field not in record:
+                record[field] = value
+            elif field == 'Authors':
+                record[field] += '; ' + value
+            else:
+                field = None  # Keep the first title/abstract/etc. of a record
+    if record:
+        records.append(record)
+    return pd.DataFrame(records, columns=['Title', 'Abstract', 'Authors', 'Year', 'Journal', 'DOI'])
+
+def read_papers(papers_file):
+    """Read a CSV, Excel, Parquet or RIS file of papers, with every column as text"""
+    ext = os.path.splitext(papers_file)[1].lower()
+    if ext == '.csv':
+        papers = pd.read_csv(papers_file, dtype=str, keep_default_na=False, encoding_errors='replace')
+    elif ext in ['.xlsx', '.xls']:
+        papers = pd.read_excel(papers_file, dtype=str)
+    elif ext == '.parquet':
+        papers = pd.read_parquet(papers_file)
+    elif ext == '.ris':
+        papers = read_ris(papers_file)
+    else:
+        raise ValueError(f"Unsupported papers file format: {ext}")
+    return papers.fillna('').astype(str)
+
+def clean_titles(titles):
+    """Vectorised clean_string for a column of titles"""
+    return titles.astype(str).str.replace(r'\W+', '', regex=True).str.lower()
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def _corpus_cache_paths(papers_file, cache_dir):
+    name = f"{file_hash(papers_file)}-v{CORPUS_CACHE_VERSION}"
+    return os.path.join(cache_dir, name + '.parquet'), os.path.join(cache_dir, name + '.pkl')
+
+def _read_corpus_cache(papers_file, cache_dir):
+    for path in _corpus_cache_paths(papers_file, cache_dir):
+        if os.path.exists(path):
+            try:
+                return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_pickle(path)
+            except Exception as e:
+                print(f"Ignoring unreadable corpus cache {path}: {str(e)}")
+    return None
+
+def _write_corpus_cache(papers, papers_file, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    parquet_path, pickle_path = _corpus_cache_paths(papers_file, cache_dir)
+    try:
+        papers.to_parquet(parquet_path)
+    except ImportError:
+        papers.to_pickle(pickle_path)  # pyarrow is not installed
+
+def load_papers(papers_file, debug=False, cache_dir=CORPUS_CACHE_DIR):
+    """
+    Load the papers to screen with duplicate titles removed. The cleaned corpus is
+    cached under cache_dir, keyed by a hash of the file's contents, so later runs on
+    the same file skip parsing and de-duplication.
+    """
+    papers = _read_corpus_cache(papers_file, cache_dir) if cache_dir else None
+    if papers is not None:
+        print(f"Loaded {len(papers)} papers from the corpus cache")
+    else:
+        papers = read_papers(papers_file)
+        title_column = find_column(papers, 'title')
+        if title_column:
+            papers['Title_Clean'] = clean_titles(papers[title_column])
+            papers = papers.drop_duplicates(subset='Title_Clean')
+            if cache_dir:
+                _write_corpus_cache(papers, papers_file, cache_dir)
     
     title_column = find_column(papers, 'title')
     abstract_column = find_column(papers, 'abstract')
@@ -23,9 +141,6 @@ def load_papers(excel_sheet, debug=False):
     if not title_column or not abstract_column:
         raise ValueError("Could not find suitable columns for 'title' and 'abstract'")
     
-    papers['Title_Clean'] = papers[title_column].apply(clean_string)
-    papers = papers.drop_duplicates(subset='Title_Clean')
-    
     n_studies = 3 if debug else len(papers)
     
     return papers, title_column, abstract_column, n_studies
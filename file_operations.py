@@ -1,65 +1,82 @@
+import json
 import os
+import shutil
+import threading
+import time
 import pandas as pd
-from openpyxl import load_workbook, Workbook
-from auxiliary import save_row
+from openpyxl import Workbook
+
+PROGRESS_DATA = 'screening_progress.ndjson'
+DASHBOARD_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'progress_dashboard.html')
+_progress_lock = threading.Lock()
+_dashboards_written = set()
+
+def append_progress(out_path, record):
+    """
+    Append one record to the progress data file. screening_progress.html is a static
+    page that reads this file, so it is only copied into place once per run.
+    """
+    os.makedirs(out_path, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _progress_lock:
+        if out_path not in _dashboards_written:
+            shutil.copyfile(DASHBOARD_TEMPLATE, os.path.join(out_path, 'screening_progress.html'))
+            _dashboards_written.add(out_path)
+        with open(os.path.join(out_path, PROGRESS_DATA), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+def mark_progress_run(out_path, total, status, criteria_set=None):
+    """
+    Record that a run has 'started' or is 'complete' (total is the number of papers in the
+    screen). A run started with a different set of criteria (the journal's criteria_set)
+    starts the progress data afresh, as its earlier papers are screened again.
+    """
+    if status == 'started':
+        with _progress_lock:
+            path = os.path.join(out_path, PROGRESS_DATA)
+            if os.path.exists(path) and last_progress_criteria_set(path) != criteria_set:
+                print("Screening criteria changed, starting the progress data afresh")
+                open(path, 'w').close()
+    append_progress(out_path, {'type': 'run', 'status': status, 'total': total, 'criteria_set': criteria_set, 'time': time.time()})
+
+def last_progress_criteria_set(path):
+    """criteria_set of the last run recorded in a progress data file (None if there is none)"""
+    criteria_set = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if '"type": "run"' not in line:
+                continue
+            try:
+                criteria_set = json.loads(line).get('criteria_set')
+            except ValueError:
+                continue
+    return criteria_set
 
 def update_html(out_path, paper_num, title, summary_decision, update_screening_progress, n_studies):
-    """Update the HTML file with the latest paper information"""
-    html_path = os.path.join(out_path, 'screening_progress.html')
-    
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(html_path), exist_ok=True)
-    
-    if not os.path.exists(html_path):
-        # Create a new HTML file if it doesn't exist
-        with open(html_path, 'w') as f:
-            f.write('''
-            <html>
-            <head>
-                <title>Screening Progress</title>
-                <style>
-                    table { border-collapse: collapse; width: 100%; }
-                    th, td { border: 1px solid black; padding: 8px; text-align: left; }
-                    th { background-color: #f2f2f2; }
-                </style>
-            </head>
-            <body>
-                <h1>Screening Progress</h1>
-                <table>
-                    <tr>
-                        <th>Paper Number</th>
-                        <th>Title</th>
-                        <th>Decision</th>
-                    </tr>
-            ''')
-    
-    # Append the new paper information
-    with open(html_path, 'a') as f:
-        f.write(f'''
-                <tr>
-                    <td>{paper_num}</td>
-                    <td>{title}</td>
-                    <td>{summary_decision}</td>
-                </tr>
-        ''')
-    
-    # Close the HTML tags if it's the last paper
-    if paper_num == n_studies - 1:
-        with open(html_path, 'a') as f:
-            f.write('''
-                </table>
-            </body>
-            </html>
-            ''')
-    
+    """Add the latest paper to the progress page and report it to the server"""
+    append_progress(out_path, {
+        'type': 'paper',
+        'paper_number': int(paper_num),
+        'title': title,
+        'decision': summary_decision,
+        'time': time.time()
+    })
+
     # Update the screening progress
     update_screening_progress(paper_num, title, summary_decision)
 
 def get_last_processed_paper(model_to_use):
     """Get the last processed paper number from existing output"""
+    from results_journal import journal_path, load_index
+    
     output_dir = os.path.join('AI_Output', model_to_use)
-    excel_file = os.path.join(output_dir, 'screening_results.xlsx')
     
+    # The journal is much cheaper to read than the workbook
+    completed, _ = load_index(journal_path(output_dir))
+    if completed:
+        return max(int(record['paper_num']) for record in completed.values())
+    
+    excel_file = os.path.join(output_dir, 'screening_results.xlsx')
     if os.path.exists(excel_file):
         try:
             df = pd.read_excel(excel_file, sheet_name='screening_results_summary')
@@ -71,142 +88,102 @@ def get_last_processed_paper(model_to_use):
             print(f"Error reading Excel file: {str(e)}")
     return -1
 
-def is_valid_excel(file_path):
-    try:
-        pd.read_excel(file_path)
-        return True
-    except:
-        return False
+SUMMARY_HEADERS = ["Paper Number", "Title", "Abstract", "Summary Decision"]
 
-def append_rows_to_excel(file_path, sheet_name, rows_data, headers=None):
-    """Append multiple rows to an existing Excel sheet or create a new one"""
-    try:
-        print(f"Attempting to append rows to {file_path}, sheet: {sheet_name}")
-        
-        if not os.path.exists(file_path) or not is_valid_excel(file_path):
-            print(f"Creating new Excel file: {file_path}")
-            workbook = Workbook()
-            workbook.save(file_path)
-        
-        workbook = load_workbook(file_path)
-        
-        if sheet_name not in workbook.sheetnames:
-            print(f"Creating new sheet: {sheet_name}")
-            workbook.create_sheet(sheet_name)
-        
-        sheet = workbook[sheet_name]
-        
-        if sheet.max_row == 1:  # Sheet is empty, write headers
-            for col, header in enumerate(headers, start=1):
-                sheet.cell(row=1, column=col, value=header)
-        
-        # Append new rows
+# Columns of each criterion in the agent sheets; Backend is the model that answered and
+# Route says who decided (llm, or triage's rule or classifier)
+AGENT_COLUMNS = ['Initial', 'Final', 'Assessment', 'Backend', 'Route']
+
+def agent_sheet_headers(screening_criteria):
+    return ["Title", "Abstract", "Paper Number"] + [f"{SC['type']}_{column}" for SC in screening_criteria for column in AGENT_COLUMNS]
+
+def build_agent_row(paper_num, title, abstract, save_stuff, agent, n_agents, screening_criteria):
+    """Build one agent's sheet row: title, abstract, paper number, then the AGENT_COLUMNS of each criterion"""
+    save_info = [title, abstract, paper_num]
+    for SC in screening_criteria:
+        try:
+            decisions = save_stuff.get(SC['type'], {})
+            values = [decisions.get(column, ['no info'] * n_agents)[agent] for column in AGENT_COLUMNS if column != 'Route']
+            # One route for all agents of a criterion; records from before triage are all llm
+            values.append(decisions.get('Route', 'llm') if decisions else 'no info')
+            
+            # Convert to string if not already
+            save_info.extend(str(value) if value is not None else 'no info' for value in values)
+        except Exception as e:
+            print(f"Error extending save_info for agent {agent}, criterion {SC['type']}: {str(e)}")
+            save_info.extend(['no info'] * len(AGENT_COLUMNS))
+    return save_info
+
+class ResultWriter:
+    """
+    Streams rows into a write-only workbook, so adding a row costs the same however
+    large the workbook already is. Each sheet gets its headers when it is first used,
+    and the file is written once, by close(), next to file_path and then swapped in,
+    so a failed save leaves the old workbook intact.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+
+    def append_rows(self, sheet_name, rows_data, headers=None):
+        sheet = self.sheets.get(sheet_name)
+        if sheet is None:
+            sheet = self.sheets[sheet_name] = self.workbook.create_sheet(sheet_name)
+            if headers:
+                sheet.append(headers)
         for row_data in rows_data:
             sheet.append(row_data)
-        
-        workbook.save(file_path)
-        print(f"Successfully appended rows to {sheet_name} in {file_path}")
-        
-        # Verify that the file was updated
-        if os.path.exists(file_path):
-            print(f"File exists after save operation: {file_path}")
-            print(f"File size: {os.path.getsize(file_path)} bytes")
-        else:
-            print(f"Error: File does not exist after save operation: {file_path}")
-    except Exception as e:
-        print(f"Error appending rows to Excel: {str(e)}")
 
-def save_results(screen_name, out_path, paper_num, title, abstract, summary_decision, resume_from, n_agents, info_all, save_stuff, screening_criteria):
+    def close(self):
+        temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        self.workbook.save(temp_path)
+        os.replace(temp_path, self.file_path)
+
+def save_results(screen_name, out_path, paper_num, title, abstract, summary_decision, resume_from, n_agents, info_all, save_stuff, screening_criteria, writer=None):
+    """
+    Mirror one paper's decisions into info_all and, with a ResultWriter, add it to the
+    summary and per-agent sheets. During a run the journal keeps the results and the
+    workbook is built from it at the end (see results_journal.export_to_excel).
+    """
     try:
         print(f"\nSaving results for paper {paper_num}")
         summary_row = [paper_num, title, abstract, summary_decision]
         
-        # Ensure the output directory exists
-        os.makedirs(out_path, exist_ok=True)
-        
         # Append to summary sheet
-        excel_path = os.path.join(out_path, 'screening_results.xlsx')
-        print(f"Saving to Excel file: {excel_path}")
-        summary_headers = ["Paper Number", "Title", "Abstract", "Summary Decision"]
-        append_rows_to_excel(excel_path, f"{screen_name}_summary", [summary_row], summary_headers)
+        if writer is not None:
+            writer.append_rows(f"{screen_name}_summary", [summary_row], SUMMARY_HEADERS)
         
-        # Load the workbook once for all agent data
-        workbook = load_workbook(excel_path)
+        agent_headers = agent_sheet_headers(screening_criteria)
         
         for agent in range(len(info_all)):
             try:
-                save_info = [title, abstract, paper_num]
-                for SC in screening_criteria:
-                    try:
-                        initial = save_stuff.get(SC['type'], {}).get('Initial', ['no info'] * n_agents)[agent]
-                        final = save_stuff.get(SC['type'], {}).get('Final', ['no info'] * n_agents)[agent]
-                        assessment = save_stuff.get(SC['type'], {}).get('Assessment', ['no info'] * n_agents)[agent]
-                        
-                        # Convert to string if not already
-                        initial = str(initial) if initial is not None else 'no info'
-                        final = str(final) if final is not None else 'no info'
-                        assessment = str(assessment) if assessment is not None else 'no info'
-                        
-                        save_info.extend([initial, final, assessment])
-                        
+                save_info = build_agent_row(paper_num, title, abstract, save_stuff, agent, n_agents, screening_criteria)
+                
+                # Mirror the decisions into info_all
+                width = len(AGENT_COLUMNS)
+                for SC_num, SC in enumerate(screening_criteria):
+                    values = save_info[3 + width * SC_num:3 + width * (SC_num + 1)]
+                    for column, value in zip(AGENT_COLUMNS, values):
                         # Ensure the column exists and is of type object before assigning
-                        for col_suffix in ['_Initial', '_Final', '_Assessment']:
-                            col_name = f"{SC['type']}{col_suffix}"
-                            if col_name not in info_all[agent].columns:
-                                info_all[agent][col_name] = 'no info'
-                            info_all[agent][col_name] = info_all[agent][col_name].astype(object)
+                        col_name = f"{SC['type']}_{column}"
+                        if col_name not in info_all[agent].columns:
+                            info_all[agent][col_name] = 'no info'
+                        info_all[agent][col_name] = info_all[agent][col_name].astype(object)
                         
                         # Update info_all with string values
-                        info_all[agent].at[paper_num, f"{SC['type']}_Initial"] = initial
-                        info_all[agent].at[paper_num, f"{SC['type']}_Final"] = final
-                        info_all[agent].at[paper_num, f"{SC['type']}_Assessment"] = assessment
-                        
-                    except Exception as e:
-                        print(f"Error extending save_info for agent {agent}, criterion {SC['type']}: {str(e)}")
-                        save_info.extend(['no info', 'no info', 'no info'])
+                        info_all[agent].at[paper_num, col_name] = value
                 
                 # Append to agent sheet
-                agent_sheet_name = f"Agent_{agent}"
-                print(f"Saving data for agent {agent} to sheet {agent_sheet_name}")
-                
-                if agent_sheet_name not in workbook.sheetnames:
-                    print(f"Creating new sheet for Agent {agent}")
-                    workbook.create_sheet(agent_sheet_name)
-                
-                sheet = workbook[agent_sheet_name]
-                
-                agent_headers = ["Title", "Abstract", "Paper Number"] + [f"{SC['type']}_{suffix}" for SC in screening_criteria for suffix in ['Initial', 'Final', 'Assessment']]
-                
-                if sheet.max_row == 1:  # Sheet is empty, write headers
-                    sheet.append(agent_headers)
-                
-                sheet.append(save_info)
-                print(f"Appended data for paper {paper_num} to Agent {agent}'s sheet")
+                if writer is not None:
+                    writer.append_rows(f"Agent_{agent}", [save_info], agent_headers)
                 
             except Exception as e:
                 print(f"Could not save data for agent {agent}: {str(e)}")
-        
-        # Save the workbook after all agents' data has been written
-        workbook.save(excel_path)
-        print(f"Saved all data to {excel_path}")
-        
-        # Verify that the file exists and has been updated
-        if os.path.exists(excel_path):
-            print(f"Excel file exists after save operation: {excel_path}")
-            print(f"File size: {os.path.getsize(excel_path)} bytes")
-            print(f"Last modified: {os.path.getmtime(excel_path)}")
-            
-            # Verify each agent's sheet
-            workbook = load_workbook(excel_path)
-            for agent in range(len(info_all)):
-                agent_sheet_name = f"Agent_{agent}"
-                if agent_sheet_name in workbook.sheetnames:
-                    sheet = workbook[agent_sheet_name]
-                    print(f"Agent {agent}'s sheet exists with {sheet.max_row} rows")
-                else:
-                    print(f"Error: Sheet for Agent {agent} not found")
-        else:
-            print(f"Error: Excel file does not exist after save operation: {excel_path}")
     
     except Exception as e:
         print(f"Error in save_results function: {str(e)}")
@@ -4,17 +4,33 @@ import traceback
 import random
 import sys
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from config import load_config, get_ai_model_name
 from data_processing import load_papers, load_screening_criteria, prepare_headers
-from file_operations import get_last_processed_paper, save_results, update_html
-from screening_logic import process_paper
-from server import update_screening_progress
-from ai_interaction import ask_ai_about_paper
+from file_operations import get_last_processed_paper, mark_progress_run
+from screening_logic import process_paper, screen_paper, screen_papers_batched, screen_in_waves, record_paper
+from progress import update_screening_progress, start_progress_events, publish_event, close_progress_events
+from ai_interaction import ask_ai_about_paper, configure_response_budget, configure_structured_output
+from response_cache import configure_cache
+from rate_limiter import configure_rate_limits
+from ask_AI import configure_clients, close_clients, configure_prompt_caching, token_usage
+from results_journal import ResultsJournal, journal_path, export_to_excel, export_to_parquet
+from batch_backend import get_batch_provider, make_bulk_wave
+from near_duplicates import find_near_duplicates
+from triage import configure_triage
+from prioritization import ActiveLearningQueue
+from agent_policy import configure_agent_policy
+from criteria_order import configure_criteria_order
+from metrics import configure_metrics, save_metrics
+from router import configure_router
 
 load_dotenv()
 
 def main(pilot_percentage=100, use_pilot=False):
+    journal = None
+    exports = None
     try:
         # Load configuration
         config = load_config()
@@ -24,17 +40,31 @@ def main(pilot_percentage=100, use_pilot=False):
         debug = config['debug']
         skip_criteria = config['skip_criteria']
         resume_from = config.get('resume_from', 0)  # Get resume point, default to 0
+        max_concurrency = max(1, int(config.get('max_concurrency', 1)))
+        agent_mode = config.get('agent_mode', 'sequential')
+        prompt_mode = config.get('prompt_mode', 'per_criterion')
+        papers_per_request = max(1, int(config.get('papers_per_request', 1)))
+        batch_provider = config.get('batch_provider')
+        response_cache = configure_cache(**config.get('response_cache', {}))
+        configure_rate_limits(config.get('rate_limits', {}))
+        router = configure_router(config.get('router', {}))
+        # Enough pooled connections for every call that can be in flight at once
+        configure_clients(max_concurrency * (n_agents if agent_mode != 'sequential' else 1))
+        configure_prompt_caching(config.get('prompt_caching', False))
+        configure_response_budget(config.get('response_budget', {}))
+        configure_structured_output(config.get('structured_output', {}))
+        agent_policy = configure_agent_policy(config.get('adaptive_agents', {}), n_agents)
         
         print(f"Resuming from paper {resume_from}")
         print(f"Pilot percentage: {pilot_percentage}%")
         print(f"Using pilot mode: {use_pilot}")
         
         # Load papers
-        excel_sheet = "all_1400.xlsx"
+        papers_file = config.get('papers_file', 'all_1400.xlsx')
         screen_name = 'screening_results'
         
         # Read papers and prepare data
-        papers, title_column, abstract_column, n_studies = load_papers(excel_sheet, debug)
+        papers, title_column, abstract_column, n_studies = load_papers(papers_file, debug)
         screening_criteria = load_screening_criteria()
         
         # Setup headers
@@ -46,6 +76,10 @@ def main(pilot_percentage=100, use_pilot=False):
         out_path = new_proj_location
         os.makedirs(out_path, exist_ok=True)
         
+        # Latency, token and cost metrics of every AI call, for /metrics and run_metrics.json
+        metrics_config = config.get('metrics', {})
+        configure_metrics(out_path, metrics_config.get('prices'), metrics_config.get('flush_seconds', 10))
+        
         # Prepare data
         info = papers[[title_column, abstract_column]]
         info = info[:n_studies]
@@ -58,8 +92,22 @@ def main(pilot_percentage=100, use_pilot=False):
         print(f'Assessing {len(pilot_papers)} papers for {"pilot" if use_pilot else "full"} screening ({pilot_percentage}%)')
         
         info_all = [pilot_papers.copy() for _ in range(n_agents)]
+        start_progress_events(out_path, len(pilot_papers))
         summary_decisions = pd.DataFrame(index=pilot_papers.index)
         
+        # Every screened paper is appended to the journal, the primary record of the run
+        journal = ResultsJournal(journal_path(out_path))
+        journal.start_run(model_to_use, n_agents, screening_criteria)
+        mark_progress_run(out_path, len(pilot_papers), 'started', journal.criteria_set)
+        # The workbook is built from the journal when the run ends, however it ends
+        exports = (out_path, screen_name, journal.criteria_set, config.get('export_parquet', True))
+        
+        # Decide obvious cases locally before asking the AI
+        triage = configure_triage(config.get('triage', {}), screening_criteria, journal)
+        
+        # Evaluate the most selective, cheapest criteria first
+        criteria_order = configure_criteria_order(config.get('criteria_order', {}), screening_criteria, n_agents, skip_criteria)
+        
         # Save initial headers only if starting fresh
         if resume_from == 0:
             print("Starting fresh screening - writing headers")
@@ -72,43 +120,320 @@ def main(pilot_percentage=100, use_pilot=False):
         else:
             print("Resuming existing screening - skipping headers")
         
-        # Process papers starting from resume point
-        for index, row in pilot_papers.iterrows():
-            try:
-                print(f'\nProcessing Paper Number: {index} (Paper {index + 1} of {n_pilot_papers})')
-                
-                if use_pilot:
-                    # In pilot mode, we'll wait for user input before processing each paper
-                    user_decision = wait_for_user_decision(index, row[title_column], row[abstract_column], model_to_use)
-                    summary_decision = user_decision
-                else:
-                    summary_decision = process_paper(
-                        index, pilot_papers, title_column, abstract_column, n_agents, 
-                        screening_criteria, info_all, get_ai_model_name(model_to_use), 
-                        out_path, screen_name, skip_criteria, resume_from,
-                        update_screening_progress,
-                        n_pilot_papers
-                    )
-                
-                summary_decisions.at[index, 'Accept'] = summary_decision
-                
-                # Update progress
-                update_screening_progress(index, row[title_column], summary_decision)
-                
-            except Exception as e:
-                print(f"Error processing paper {index}: {str(e)}")
-                print(traceback.format_exc())
-                summary_decisions.at[index, 'Accept'] = 'Error'
+        # Near-duplicates are not screened; they get the decisions of the first paper of their cluster
+        near_duplicates = config.get('near_duplicates', {})
+        duplicate_of = {}
+        if near_duplicates.get('enabled', False) and not use_pilot:
+            duplicate_of = find_near_duplicates(
+                pilot_papers[title_column], pilot_papers[abstract_column],
+                near_duplicates.get('threshold', 0.75), near_duplicates.get('num_perm', 64)
+            )
+            print(f"Found {len(duplicate_of)} near-duplicate papers in {len(set(duplicate_of.values()))} clusters")
+        
+        # Optionally screen likely includes first, and stop once they have probably all been found
+        prioritization = config.get('prioritization', {})
+        queue = None
+        if prioritization.get('enabled', False) and not use_pilot:
+            queue = ActiveLearningQueue(
+                pilot_papers[title_column].astype(str) + ' ' + pilot_papers[abstract_column].astype(str),
+                reorder_every=prioritization.get('reorder_every', 20),
+                stop_after_excludes=prioritization.get('stop_after_excludes'),
+                target_recall=prioritization.get('target_recall'),
+                recall_window=prioritization.get('recall_window', 100),
+                min_screened=prioritization.get('min_screened', 100)
+            )
+            # Start from the decisions of earlier runs; near-duplicates are never screened
+            for index, title in pilot_papers[title_column].items():
+                recorded_decision = journal.completed_decision(title)
+                if recorded_decision is not None:
+                    summary_decisions.at[index, 'Accept'] = recorded_decision
+                    queue.record(index, recorded_decision)
+                elif index in duplicate_of:
+                    queue.record(index, None)
+        
+        # Process papers, skipping any the journal already has with the current criteria
+        ai_model = get_ai_model_name(model_to_use)
+        if batch_provider and not use_pilot:
+            # Offline bulk screening: each criterion and agent becomes one provider batch job
+            print(f"Screening with the {batch_provider} batch API")
+            batch_dir = config.get('batch_dir', os.path.join(out_path, 'batches'))
+            ask_wave = make_bulk_wave(
+                get_batch_provider(batch_provider, batch_dir, ai_model),
+                ai_model, batch_dir, config.get('batch_poll_seconds', 60)
+            )
+            screen_papers_in_groups(
+                pilot_papers, title_column, n_agents, screening_criteria, info_all,
+                out_path, screen_name, resume_from, n_pilot_papers, summary_decisions,
+                journal, config.get('batch_group_size', 0), duplicate_of, queue,
+                lambda group: screen_in_waves(
+                    group, pilot_papers, title_column, abstract_column, n_agents,
+                    screening_criteria, info_all, skip_criteria, ask_wave, journal
+                )
+            )
+        elif papers_per_request > 1 and not use_pilot:
+            print(f"Screening up to {papers_per_request} papers per request")
+            max_request_chars = config.get('max_request_chars', 24000)
+            screen_papers_in_groups(
+                pilot_papers, title_column, n_agents, screening_criteria, info_all,
+                out_path, screen_name, resume_from, n_pilot_papers, summary_decisions,
+                journal, papers_per_request * max_concurrency, duplicate_of, queue,
+                lambda group: screen_papers_batched(
+                    group, pilot_papers, title_column, abstract_column, n_agents,
+                    screening_criteria, info_all, ai_model, skip_criteria,
+                    papers_per_request, max_request_chars, max_concurrency, journal
+                )
+            )
+        elif max_concurrency > 1 and not use_pilot:
+            print(f"Screening with up to {max_concurrency} papers in flight")
+            screen_papers_concurrently(
+                pilot_papers, title_column, abstract_column, n_agents,
+                screening_criteria, info_all, get_ai_model_name(model_to_use),
+                out_path, screen_name, skip_criteria, resume_from,
+                n_pilot_papers, summary_decisions, max_concurrency, agent_mode, journal,
+                prompt_mode, duplicate_of, queue
+            )
+        else:
+            for index in (queue if queue is not None else pilot_papers.index):
+                if index in duplicate_of:
+                    continue
+                row = pilot_papers.loc[index]
+                try:
+                    recorded_decision = None if use_pilot else journal.completed_decision(row[title_column])
+                    if recorded_decision is not None:
+                        summary_decisions.at[index, 'Accept'] = recorded_decision
+                        continue
+                    
+                    print(f'\nProcessing Paper Number: {index} (Paper {index + 1} of {n_pilot_papers})')
+
+                    if use_pilot:
+                        # In pilot mode, we'll wait for user input before processing each paper
+                        user_decision = wait_for_user_decision(index, row[title_column], row[abstract_column], model_to_use)
+                        summary_decision = user_decision
+                        update_screening_progress(index, row[title_column], summary_decision)
+                    else:
+                        summary_decision = process_paper(
+                            index, pilot_papers, title_column, abstract_column, n_agents, 
+                            screening_criteria, info_all, get_ai_model_name(model_to_use), 
+                            out_path, screen_name, skip_criteria, resume_from,
+                            update_screening_progress,
+                            n_pilot_papers, agent_mode, journal=journal, prompt_mode=prompt_mode
+                        )
+
+                    summary_decisions.at[index, 'Accept'] = summary_decision
+
+                except Exception as e:
+                    print(f"Error processing paper {index}: {str(e)}")
+                    print(traceback.format_exc())
+                    summary_decisions.at[index, 'Accept'] = 'Error'
+                if queue is not None:
+                    queue.record(index, summary_decisions.at[index, 'Accept'])
+        
+        if queue is not None:
+            queue.save_report(out_path)
+        
+        if duplicate_of:
+            calls_saved = record_near_duplicates(
+                pilot_papers, duplicate_of, title_column, abstract_column, n_agents,
+                screening_criteria, info_all, out_path, screen_name, resume_from,
+                n_pilot_papers, summary_decisions, journal
+            )
+            print(f"Near-duplicate detection saved {calls_saved} AI calls")
         
         # Update progress with completion status
-        update_html(out_path, n_pilot_papers - 1, "Screening Complete", "Complete", update_screening_progress, n_pilot_papers)
+        mark_progress_run(out_path, len(pilot_papers), 'complete', journal.criteria_set)
+        publish_event('complete', counts=summary_decisions['Accept'].value_counts().to_dict() if 'Accept' in summary_decisions else {})
+        
+        journal.close()
+        journal = None
+        
+        if triage is not None:
+            routed = sum(triage.counts.values())
+            detail = ', '.join(f"{route} {decision}: {n}" for (route, decision), n in sorted(triage.counts.items()))
+            print(f"Triage decided {routed} criteria locally ({detail}), saving about {routed * n_agents} AI calls")
+        
+        if criteria_order is not None:
+            criteria_order.save_report(out_path)
         
-        # Save final results
-        save_results(summary_decisions, f"{screen_name}_summary", out_path)
+        if agent_policy.stats:
+            agent_policy.save_report(out_path)
+        
+        if router is not None:
+            router.save_report(out_path)
+        
+        usage = token_usage()
+        if usage['input']:
+            print(f"Input tokens: {usage['input']} over {usage['calls']} calls, {usage['cached']} "
+                  f"({usage['cached'] / usage['input']:.1%}) read from the provider's prompt cache")
+        
+        if response_cache is not None:
+            stats = response_cache.stats()
+            print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses")
+        
+        summary = save_metrics()
+        if summary is not None:
+            for provider, total in summary['by_provider'].items():
+                print(f"{provider}: {total['calls']} calls, {total['mean_latency_seconds']:.2f}s mean latency, "
+                      f"{total['input_tokens']} input and {total['output_tokens']} output tokens, "
+                      f"{total['retries']} retries, about ${total['cost_usd']:.2f}")
         
     except Exception as e:
         print(f"An error occurred during the screening process: {str(e)}")
         print(traceback.format_exc())
+        publish_event('failed', message=str(e))
+    finally:
+        if journal is not None:
+            journal.close()
+        if exports is not None:
+            export_results(*exports)
+        close_clients()
+        close_progress_events()
+        save_metrics()
+
+def export_results(out_path, screen_name, criteria_set, parquet=True):
+    """
+    Build screening_results.xlsx (and the Parquet export) from the journal, which has
+    every paper screened so far, including those of earlier or killed runs
+    """
+    try:
+        export_to_excel(journal_path(out_path), os.path.join(out_path, 'screening_results.xlsx'), screen_name, criteria_set)
+        if parquet:
+            export_to_parquet(journal_path(out_path), os.path.join(out_path, 'screening_results.parquet'), criteria_set)
+    except Exception as e:
+        print(f"Error exporting results from the journal: {str(e)}")
+
+def screen_papers_concurrently(papers, title_column, abstract_column, n_agents, screening_criteria, info_all, ai_model, out_path, screen_name, skip_criteria, resume_from, n_studies, summary_decisions, max_concurrency, agent_mode='sequential', journal=None, prompt_mode='per_criterion', duplicate_of=None, queue=None):
+    """
+    Screen papers on a bounded thread pool while writing results in paper order.
+    The AI calls for up to max_concurrency papers run at once; saving, the progress
+    page and summary decisions are handled here, on the calling thread, in the
+    same order as the sequential loop so the output workbook stays deterministic.
+    """
+    in_flight = deque()
+    paper_rows = ((index, papers.loc[index]) for index in (queue if queue is not None else papers.index))
+
+    def submit_next(executor):
+        while True:
+            try:
+                index, row = next(paper_rows)
+            except StopIteration:
+                return False
+            if duplicate_of and index in duplicate_of:
+                continue
+            recorded_decision = journal.completed_decision(row[title_column]) if journal is not None else None
+            if recorded_decision is None:
+                break
+            summary_decisions.at[index, 'Accept'] = recorded_decision
+        print(f'\nQueueing Paper Number: {index} (Paper {index + 1} of {n_studies})')
+        future = executor.submit(
+            screen_paper, index, papers, title_column, abstract_column, n_agents,
+            screening_criteria, info_all, ai_model, skip_criteria, agent_mode, journal,
+            prompt_mode
+        )
+        in_flight.append((index, row, future))
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # Keep a small backlog queued so workers never wait on the journal
+        while len(in_flight) < 2 * max_concurrency and submit_next(executor):
+            pass
+
+        while in_flight:
+            index, row, future = in_flight.popleft()
+            try:
+                title, abstract, summary_decision, save_stuff = future.result()
+                record_paper(
+                    index, title, abstract, summary_decision, save_stuff, n_agents,
+                    info_all, screening_criteria, out_path, screen_name, resume_from,
+                    update_screening_progress, n_studies, journal=journal
+                )
+                summary_decisions.at[index, 'Accept'] = summary_decision
+            except Exception as e:
+                print(f"Error processing paper {index}: {str(e)}")
+                print(traceback.format_exc())
+                summary_decisions.at[index, 'Accept'] = 'Error'
+            if queue is not None:
+                queue.record(index, summary_decisions.at[index, 'Accept'])
+            submit_next(executor)
+
+def screen_papers_in_groups(papers, title_column, n_agents, screening_criteria, info_all, out_path, screen_name, resume_from, n_studies, summary_decisions, journal, group_size, duplicate_of, queue, screen_group):
+    """
+    Screen the papers the journal does not have yet (other than near-duplicates) in
+    groups of group_size, taken in file order or from the prioritization queue, where
+    screen_group(paper_nums) returns {paper_num: (title, abstract, summary_decision, save_stuff)},
+    recording each group in paper order before moving on to the next.
+    """
+    order = iter(queue if queue is not None else papers.index)
+    group_size = group_size or len(papers) or 1
+    screened = 0
+    while True:
+        group = []
+        for index in order:
+            if index in duplicate_of:
+                continue
+            recorded_decision = journal.completed_decision(papers[title_column][index])
+            if recorded_decision is not None:
+                summary_decisions.at[index, 'Accept'] = recorded_decision
+                continue
+            group.append(index)
+            if len(group) >= group_size:
+                break
+        if not group:
+            break
+
+        screened += len(group)
+        print(f'\nScreening papers {group[0]} to {group[-1]} ({screened} screened so far)')
+        try:
+            results = screen_group(group)
+        except Exception as e:
+            print(f"Error processing papers {group[0]} to {group[-1]}: {str(e)}")
+            print(traceback.format_exc())
+            results = {}
+
+        for index in group:
+            if index in results:
+                title, abstract, summary_decision, save_stuff = results[index]
+                record_paper(
+                    index, title, abstract, summary_decision, save_stuff, n_agents,
+                    info_all, screening_criteria, out_path, screen_name, resume_from,
+                    update_screening_progress, n_studies, journal=journal
+                )
+            else:
+                summary_decision = 'Error'
+            summary_decisions.at[index, 'Accept'] = summary_decision
+            if queue is not None:
+                queue.record(index, summary_decision)
+
+def record_near_duplicates(papers, duplicate_of, title_column, abstract_column, n_agents, screening_criteria, info_all, out_path, screen_name, resume_from, n_studies, summary_decisions, journal):
+    """
+    Record each near-duplicate with the decisions of the paper it duplicates.
+    Returns the number of AI calls that screening the duplicates would have taken.
+    """
+    calls_saved = 0
+    for index, original in sorted(duplicate_of.items()):
+        title = papers[title_column][index]
+        recorded_decision = journal.completed_decision(title)
+        if recorded_decision is not None:
+            summary_decisions.at[index, 'Accept'] = recorded_decision
+            continue
+
+        original_title = papers[title_column][original]
+        record = journal.completed_record(original_title)
+        if record is None:
+            print(f"Paper {index} not recorded: its near-duplicate {original} was not screened")
+            continue
+
+        save_stuff = record['criteria']
+        record_paper(
+            index, title, papers[abstract_column][index], record['summary_decision'], save_stuff,
+            n_agents, info_all, screening_criteria, out_path, screen_name, resume_from,
+            update_screening_progress, n_studies, journal=journal, duplicate_of=original_title
+        )
+        summary_decisions.at[index, 'Accept'] = record['summary_decision']
+        calls_saved += sum(
+            1 for decisions in (save_stuff or {}).values()
+            for final in decisions.get('Final', []) if final != 'NOT RUN'
+        )
+    return calls_saved
 
 def wait_for_user_decision(index, title, abstract, model_to_use):
     """
@@ -0,0 +1,203 @@
+# Per-call metrics for AI requests: latency, tokens, retries, response cache hits and
+# cost, labelled by provider (model name), criterion and agent. main.py writes them to
+# AI_Output/<model>/run_metrics.json during the run, and the web server serves that
+# file in the Prometheus text format at /metrics.
+import json
+import os
+import threading
+import time
+
+METRICS_NAME = 'run_metrics.json'
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+COUNTERS = ('calls', 'errors', 'cache_hits', 'input_tokens', 'cached_input_tokens', 'output_tokens',
+            'estimated_calls', 'retries', 'backoff_seconds', 'latency_seconds', 'cost_usd', 'speculative_discarded')
+
+# US dollars per million tokens, keyed by ask_AI backend name. List prices when these
+# backends were added; override or extend them with the metrics "prices" config.
+DEFAULT_PRICES = {
+    'claude': {'input': 3.0, 'cached_input': 0.3, 'output': 15.0},
+    'aws_claude': {'input': 3.0, 'cached_input': 0.3, 'output': 15.0},
+    'openai': {'input': 10.0, 'output': 30.0},
+    'gemini': {'input': 0.075, 'cached_input': 0.01875, 'output': 0.3},
+    'gemma2': {'input': 0.2, 'output': 0.2},
+    'llama3': {'input': 0.9, 'output': 0.9},
+    'mixtral': {'input': 0.24, 'output': 0.24}
+}
+
+def metrics_path(out_path):
+    return os.path.join(out_path, METRICS_NAME)
+
+def estimate_tokens(text):
+    """About four characters per token, for providers that report no usage"""
+    return max(1, len(text or '') // 4)
+
+class Metrics:
+    """Counters and a latency histogram for each (provider, criterion, agent)"""
+
+    def __init__(self, prices=None):
+        self.prices = {**DEFAULT_PRICES, **(prices or {})}
+        self.series = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def _series(self, provider, criterion, agent):
+        key = (provider, criterion or 'none', str(agent))
+        if key not in self.series:
+            self.series[key] = {name: 0 for name in COUNTERS}
+            self.series[key]['latency_buckets'] = [0] * len(LATENCY_BUCKETS)
+        return self.series[key]
+
+    def cost(self, provider, input_tokens, cached_tokens, output_tokens):
+        price = self.prices.get(provider)
+        if not price:
+            return 0.0
+        uncached = input_tokens - cached_tokens
+        return (uncached * price.get('input', 0)
+                + cached_tokens * price.get('cached_input', price.get('input', 0))
+                + output_tokens * price.get('output', 0)) / 1e6
+
+    def observe_call(self, provider, criterion, agent, latency, input_tokens=0, cached_tokens=0, output_tokens=0,
+                     retries=0, backoff_seconds=0.0, estimated=False, error=False):
+        with self._lock:
+            series = self._series(provider, criterion, agent)
+            series['calls'] += 1
+            series['errors'] += bool(error)
+            series['estimated_calls'] += bool(estimated)
+            series['input_tokens'] += input_tokens
+            series['cached_input_tokens'] += cached_tokens
+            series['output_tokens'] += output_tokens
+            series['retries'] += retries
+            series['backoff_seconds'] += backoff_seconds
+            series['latency_seconds'] += latency
+            series['cost_usd'] += self.cost(provider, input_tokens, cached_tokens, output_tokens)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    series['latency_buckets'][i] += 1
+                    break
+
+    def observe_cache_hit(self, provider, criterion, agent):
+        with self._lock:
+            self._series(provider, criterion, agent)['cache_hits'] += 1
+
+    def observe_discarded(self, provider, criterion, agent):
+        with self._lock:
+            self._series(provider, criterion, agent)['speculative_discarded'] += 1
+
+    def summary(self):
+        """Series plus totals per provider, criterion and agent, as stored in the run summary file"""
+        with self._lock:
+            series = [
+                {'provider': provider, 'criterion': criterion, 'agent': agent, **dict(values, latency_buckets=list(values['latency_buckets']))}
+                for (provider, criterion, agent), values in self.series.items()
+            ]
+        summary = {
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'latency_buckets': list(LATENCY_BUCKETS),
+            'series': series,
+            'total': _add_up(series)
+        }
+        for label in ('provider', 'criterion', 'agent'):
+            groups = {}
+            for values in series:
+                groups.setdefault(values[label], []).append(values)
+            summary[f'by_{label}'] = {name: _add_up(members) for name, members in groups.items()}
+        return summary
+
+def _add_up(series):
+    total = {name: 0 for name in COUNTERS}
+    for values in series:
+        for name in COUNTERS:
+            total[name] += values[name]
+    total['cost_usd'] = round(total['cost_usd'], 6)
+    total['latency_seconds'] = round(total['latency_seconds'], 3)
+    total['backoff_seconds'] = round(total['backoff_seconds'], 3)
+    total['mean_latency_seconds'] = round(total['latency_seconds'] / total['calls'], 3) if total['calls'] else 0.0
+    return total
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(summary):
+    """Render a run summary in the Prometheus text exposition format"""
+    metrics = [
+        ('calls', 'screening_ai_calls_total', 'counter', 'AI calls made (response cache hits excluded)'),
+        ('errors', 'screening_ai_errors_total', 'counter', 'AI calls that failed'),
+        ('cache_hits', 'screening_ai_response_cache_hits_total', 'counter', 'Responses served from the response cache'),
+        ('input_tokens', 'screening_ai_input_tokens_total', 'counter', 'Input tokens, as reported by the provider or estimated'),
+        ('cached_input_tokens', 'screening_ai_cached_input_tokens_total', 'counter', 'Input tokens read from the provider prompt cache'),
+        ('output_tokens', 'screening_ai_output_tokens_total', 'counter', 'Output tokens, as reported by the provider or estimated'),
+        ('estimated_calls', 'screening_ai_estimated_usage_calls_total', 'counter', 'Calls whose token counts were estimated'),
+        ('retries', 'screening_ai_retries_total', 'counter', 'Retries after rate limit errors'),
+        ('backoff_seconds', 'screening_ai_backoff_seconds_total', 'counter', 'Time spent waiting between retries'),
+        ('cost_usd', 'screening_ai_cost_usd_total', 'counter', 'Estimated cost in US dollars'),
+        ('speculative_discarded', 'screening_ai_speculative_discarded_total', 'counter', 'Answers speculative agent mode received but did not need')
+    ]
+    lines = []
+    for key, name, kind, help_text in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for values in summary.get('series', []):
+            lines.append(f"{name}{{{_labels(values)}}} {values.get(key, 0)}")
+
+    name = 'screening_ai_call_latency_seconds'
+    lines.append(f"# HELP {name} Latency of AI calls, including retries")
+    lines.append(f"# TYPE {name} histogram")
+    bounds = summary.get('latency_buckets', LATENCY_BUCKETS)
+    for values in summary.get('series', []):
+        labels = _labels(values)
+        cumulative = 0
+        for bound, count in zip(bounds, values['latency_buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {values["calls"]}')
+        lines.append(f"{name}_sum{{{labels}}} {values['latency_seconds']}")
+        lines.append(f"{name}_count{{{labels}}} {values['calls']}")
+    return '\n'.join(lines) + '\n'
+
+def _labels(values):
+    return ','.join(f'{label}="{_label(values[label])}"' for label in ('provider', 'criterion', 'agent'))
+
+_metrics = Metrics()
+_out_path = None
+_flush_seconds = 10
+_last_flush = 0.0
+
+def configure_metrics(out_path=None, prices=None, flush_seconds=10):
+    """Start collecting metrics for a run, written to out_path every flush_seconds"""
+    global _metrics, _out_path, _flush_seconds, _last_flush
+    _metrics = Metrics(prices)
+    _out_path = out_path
+    _flush_seconds = flush_seconds
+    _last_flush = 0.0
+    return _metrics
+
+def get_metrics():
+    return _metrics
+
+def save_metrics(force=True):
+    """Write the run summary file (at most every flush_seconds unless force)"""
+    global _last_flush
+    if _out_path is None:
+        return None
+    now = time.time()
+    if not force and now - _last_flush < _flush_seconds:
+        return None
+    _last_flush = now
+    summary = _metrics.summary()
+    path = metrics_path(_out_path)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, default=str)
+    os.replace(temp_path, path)
+    return summary
+
+def observe_call(*args, **kwargs):
+    _metrics.observe_call(*args, **kwargs)
+    save_metrics(force=False)
+
+def observe_cache_hit(provider, criterion, agent):
+    _metrics.observe_cache_hit(provider, criterion, agent)
+
+def observe_discarded(provider, criterion, agent):
+    _metrics.observe_discarded(provider, criterion, agent)
@@ -0,0 +1,130 @@
+import re
+import unicodedata
+import numpy as np
+
+# MinHash with multiply-shift hashing: (a * x + b) >> 32 in wrapping uint64 arithmetic
+SHINGLE_SIZE = 5  # Characters. An edited word only changes the few shingles that overlap it
+MAX_BUCKET_COMPARISONS = 20
+CHUNK_SIZE = 5000  # Texts shingled at once, which bounds memory on large corpora
+MIN_CANDIDATE_PROBABILITY = 0.99  # Chance that LSH compares a pair right at the threshold
+EMPTY = np.uint64(1 << 32)  # Signature value for texts without any words
+
+def normalize_words(text):
+    """Lower-case words with accents and other unicode variants folded to plain letters"""
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r'\w+', text.lower())
+
+def shingle_hashes(texts, size=SHINGLE_SIZE):
+    """
+    Hashes of the character n-grams of every text (its normalised words joined by
+    single spaces), as one array plus the number of shingles of each text; a text
+    shorter than size characters is a single shingle
+    """
+    normalized = [' '.join(normalize_words(text)) for text in texts]
+    lengths = np.array([len(text) for text in normalized], dtype=np.int64)
+    char_hashes = np.frombuffer(''.join(normalized).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64) + np.uint64(1)
+
+    # Combine each run of `size` consecutive characters, then keep the runs that start
+    # and end inside the same text
+    text_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    span = np.minimum(lengths, size)
+    n_shingles = np.where(lengths > 0, lengths - span + 1, 0)
+    positions = np.repeat(text_starts, n_shingles) + (
+        np.arange(n_shingles.sum()) - np.repeat(np.cumsum(n_shingles) - n_shingles, n_shingles)
+    )
+    widths = np.repeat(span, n_shingles)
+    shingles = char_hashes[positions] if len(positions) else np.zeros(0, dtype=np.uint64)
+    for k in range(1, size):
+        inside = widths > k
+        shingles[inside] = shingles[inside] * np.uint64(0x9E3779B97F4A7C15) + char_hashes[positions[inside] + k]
+    return shingles, n_shingles
+
+def minhash_signatures(shingles, n_shingles, num_perm=64, seed=1):
+    """One row of num_perm MinHash values per text (see shingle_hashes)"""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+    signatures = np.full((len(n_shingles), num_perm), EMPTY, dtype=np.uint64)
+
+    # Take the per-text minimum of each permutation over the whole corpus at once
+    rows = np.flatnonzero(n_shingles)
+    if not len(rows):
+        return signatures
+    starts = (np.cumsum(n_shingles) - n_shingles)[rows]
+    with np.errstate(over='ignore'):
+        for perm in range(num_perm):
+            signatures[rows, perm] = np.minimum.reduceat((a[perm] * shingles + b[perm]) >> np.uint64(32), starts)
+    return signatures
+
+def candidate_probability(similarity, bands, rows):
+    """Chance that LSH with (bands, rows) puts a pair with this Jaccard similarity in a shared bucket"""
+    return 1 - (1 - similarity ** rows) ** bands
+
+def lsh_bands(threshold, num_perm):
+    """
+    Pick (bands, rows) with bands * rows == num_perm: the most rows per band (the
+    fewest chance candidates) that still compare a pair right at the threshold with
+    MIN_CANDIDATE_PROBABILITY, so LSH itself loses almost no near-duplicates
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    good = [option for option in options if candidate_probability(threshold, *option) >= MIN_CANDIDATE_PROBABILITY]
+    return max(good, key=lambda option: option[1]) if good else options[0]
+
+def find_clusters(texts, threshold=0.75, num_perm=64):
+    """
+    Group texts whose estimated Jaccard similarity (of character 5-gram shingles) is
+    at least threshold. Returns a list of clusters, each a sorted list of positions;
+    texts without near-duplicates are left out.
+    """
+    texts = list(texts)
+    n_shingles = np.zeros(len(texts), dtype=np.int64)
+    signatures = np.full((len(texts), num_perm), EMPTY, dtype=np.uint64)
+    for start in range(0, len(texts), CHUNK_SIZE):
+        shingles, counts = shingle_hashes(texts[start:start + CHUNK_SIZE])
+        n_shingles[start:start + len(counts)] = counts
+        signatures[start:start + len(counts)] = minhash_signatures(shingles, counts, num_perm)
+    bands, rows = lsh_bands(threshold, num_perm)
+    candidates = np.flatnonzero(n_shingles).tolist()
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets = {}
+        block = signatures[:, band * rows:(band + 1) * rows]
+        for i in candidates:
+            buckets.setdefault(block[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            for j in range(1, len(members)):
+                for earlier in members[max(0, j - MAX_BUCKET_COMPARISONS):j]:
+                    if find(earlier) == find(members[j]):
+                        break
+                    if np.mean(signatures[earlier] == signatures[members[j]]) >= threshold:
+                        parent[find(members[j])] = find(earlier)
+                        break
+
+    clusters = {}
+    for i in candidates:
+        clusters.setdefault(find(i), []).append(i)
+    return [sorted(members) for members in clusters.values() if len(members) > 1]
+
+def find_near_duplicates(titles, abstracts, threshold=0.75, num_perm=64):
+    """
+    Map the index label of each near-duplicate paper to the first paper of its
+    cluster, which is the only one that needs screening
+    """
+    texts = [f"{title} {abstract}" for title, abstract in zip(titles.values, abstracts.values)]
+    labels = list(titles.index)
+    duplicate_of = {}
+    for members in find_clusters(texts, threshold, num_perm):
+        for position in members[1:]:
+            duplicate_of[labels[position]] = labels[members[0]]
+    return duplicate_of
@@ -0,0 +1,134 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from triage import keywords
+
+class ActiveLearningQueue:
+    """
+    Screening order that puts likely includes first. A naive Bayes relevance model
+    over the words of each title and abstract is updated from every recorded
+    decision, and the papers still waiting are re-ranked every reorder_every
+    decisions. Until both an include and an exclude have been seen, papers come in
+    file order.
+
+    Iterating over the queue yields paper indices until every paper has been handed
+    out or a stopping rule fires:
+    - stop_after_excludes: that many excludes in a row
+    - target_recall: the estimated share of includes found so far reaches the target.
+      The include rate over the last recall_window decisions is taken as the rate
+      among the papers left, which overestimates it while the ranking works, so the
+      estimate errs on the side of screening more.
+    Neither rule fires before min_screened papers have been decided.
+    """
+
+    def __init__(self, texts, reorder_every=20, stop_after_excludes=None, target_recall=None, recall_window=100, min_screened=100):
+        self.order = list(texts.index)
+        self.reorder_every = max(1, int(reorder_every))
+        self.stop_after_excludes = stop_after_excludes
+        self.target_recall = target_recall
+        self.recall_window = recall_window
+        self.min_screened = min_screened
+
+        # Word IDs of every paper, concatenated, plus a bias token so no paper is empty
+        words = [sorted(keywords(text)) for text in texts.values]
+        codes, vocabulary = pd.factorize(pd.Series([w for paper_words in words for w in paper_words], dtype=object))
+        self.bias = len(vocabulary)
+        lengths = np.array([len(paper_words) + 1 for paper_words in words], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.word_ids = np.full(lengths.sum(), self.bias, dtype=np.int64)
+        self.word_ids[np.delete(np.arange(lengths.sum()), self.starts)] = codes
+        self.position = {index: position for position, index in enumerate(self.order)}
+
+        self.counts = np.zeros((2, len(vocabulary) + 1))
+        self.labelled = np.zeros(2)
+        self.waiting = np.ones(len(self.order), dtype=bool)  # By position: not yet handed out or decided
+        self.ranked = np.arange(len(self.order))
+        self.next_rank = 0
+        self.since_reorder = 0
+        self.decisions = []
+        self.included = 0
+        self.consecutive_excludes = 0
+        self.stop_reason = None
+
+    def record(self, index, decision):
+        """Learn from a paper's summary decision (Errors are ignored)"""
+        position = self.position[index]
+        self.waiting[position] = False
+        if decision not in ('Yes', 'Maybe', 'No'):
+            return
+        label = 0 if decision == 'No' else 1
+        end = self.starts[position + 1] if position + 1 < len(self.starts) else len(self.word_ids)
+        self.counts[label, self.word_ids[self.starts[position]:end]] += 1
+        self.labelled[label] += 1
+        self.decisions.append(label)
+        self.included += label
+        self.consecutive_excludes = self.consecutive_excludes + 1 if label == 0 else 0
+        self.since_reorder += 1
+        self._check_stopping()
+
+    def estimated_recall(self):
+        found = self.included
+        if not found:
+            return 0.0
+        recent = self.decisions[-self.recall_window:]
+        expected_left = sum(recent) / len(recent) * self.waiting.sum()
+        return found / (found + expected_left)
+
+    def _check_stopping(self):
+        if self.stop_reason or len(self.decisions) < self.min_screened:
+            return
+        if self.stop_after_excludes and self.consecutive_excludes >= self.stop_after_excludes:
+            self.stop_reason = f"{self.consecutive_excludes} excludes in a row"
+        elif self.target_recall and self.estimated_recall() >= self.target_recall:
+            self.stop_reason = f"estimated recall {self.estimated_recall():.3f} reached the target of {self.target_recall}"
+
+    def _reorder(self):
+        if self.labelled.min() == 0:
+            return
+        # Log-odds of relevance for each word, with add-one smoothing
+        probabilities = (self.counts + 1) / (self.labelled[:, None] + 2)
+        weights = np.log(probabilities[1]) - np.log(probabilities[0])
+        weights[self.bias] = 0.0
+        scores = np.add.reduceat(weights[self.word_ids], self.starts)
+        waiting = np.flatnonzero(self.waiting)
+        self.ranked = waiting[np.argsort(-scores[waiting], kind='stable')]
+        self.next_rank = 0
+        self.since_reorder = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stop_reason:
+            raise StopIteration
+        if self.since_reorder >= self.reorder_every:
+            self._reorder()
+        while self.next_rank < len(self.ranked):
+            position = self.ranked[self.next_rank]
+            self.next_rank += 1
+            if self.waiting[position]:
+                self.waiting[position] = False
+                return self.order[position]
+        raise StopIteration
+
+    def report(self):
+        return {
+            'screened': len(self.decisions),
+            'included': self.included,
+            'excluded': len(self.decisions) - self.included,
+            'not_screened': int(self.waiting.sum()),
+            'stopped_early': self.stop_reason is not None,
+            'stop_reason': self.stop_reason,
+            'estimated_recall': round(float(self.estimated_recall()), 4)
+        }
+
+    def save_report(self, out_path):
+        report = self.report()
+        with open(os.path.join(out_path, 'prioritization_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        if report['stopped_early']:
+            print(f"Stopped early ({report['stop_reason']}): {report['not_screened']} papers were not screened")
+        print(f"Prioritised screening: {report['included']} of {report['screened']} screened papers included, "
+              f"estimated recall {report['estimated_recall']:.3f}")
+        return report
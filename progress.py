@@ -0,0 +1,98 @@
+# Screening progress shared between the screening loop and the web server.
+# Kept separate from server.py so main.py can report progress without importing Flask.
+#
+# main.py runs in its own process, so progress is also published as events, one JSON
+# object per line, to AI_Output/<model>/progress_events.ndjson. The server tails that
+# file and streams new events to the browser. An event's ID is "<run>:<byte offset after
+# it>", where run is the ID of the run that started the file; clients send it back as a
+# cursor to pick up where they left off, and a cursor from another run starts over.
+import json
+import os
+import threading
+import time
+import uuid
+
+EVENTS_NAME = 'progress_events.ndjson'
+
+screening_progress = []
+_events_file = None
+_events_lock = threading.Lock()
+
+def events_path(out_path):
+    return os.path.join(out_path, EVENTS_NAME)
+
+def start_progress_events(out_path, total=None):
+    """Start a fresh event file for this run"""
+    global _events_file
+    close_progress_events()
+    os.makedirs(out_path, exist_ok=True)
+    with _events_lock:
+        _events_file = open(events_path(out_path), 'w', encoding='utf-8')
+    publish_event('start', run=uuid.uuid4().hex[:12], total=total)
+
+def publish_event(event, **data):
+    """Append one event ('start', 'paper', 'criterion', 'complete' or 'failed')"""
+    line = json.dumps({'event': event, 'time': time.time(), **data}, ensure_ascii=False, default=str)
+    with _events_lock:
+        if _events_file is None:
+            return
+        _events_file.write(line + '\n')
+        _events_file.flush()
+
+def close_progress_events():
+    global _events_file
+    with _events_lock:
+        if _events_file is not None:
+            _events_file.close()
+            _events_file = None
+
+def parse_cursor(cursor):
+    """Split a cursor into (run, offset); a bare offset has no run"""
+    run, _, offset = str(cursor or 0).rpartition(':')
+    try:
+        return run or None, max(0, int(offset))
+    except ValueError:
+        return None, 0
+
+def read_events(path, cursor=None):
+    """
+    Return (events, cursor) for the complete events after cursor ("<run>:<offset>", or a
+    bare byte offset). Each event gets an 'id', the cursor just after it. A cursor from
+    another run, or past the end of the file, starts again from the beginning.
+    """
+    run, offset = parse_cursor(cursor)
+    if not os.path.exists(path):
+        return [], '0'
+    events = []
+    with open(path, 'rb') as f:
+        first = f.readline()
+        try:
+            current = json.loads(first).get('run') if first.endswith(b'\n') else None
+        except ValueError:
+            current = None
+        if (run is not None and run != current) or offset > os.path.getsize(path):
+            offset = 0  # The file was replaced by a new run
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Still being written
+            offset += len(line)
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            event['id'] = make_cursor(current, offset)
+            events.append(event)
+    return events, make_cursor(current, offset)
+
+def make_cursor(run, offset):
+    return f"{run}:{offset}" if run else str(offset)
+
+def update_screening_progress(paper_number, title, decision):
+    """Update the screening progress"""
+    screening_progress.append({
+        'paper_number': paper_number,
+        'title': title,
+        'decision': decision
+    })
+    publish_event('paper', paper_number=paper_number, title=title, decision=decision)
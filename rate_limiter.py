@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: limits are still shared between threads, but not processes
+    fcntl = None
+
+# Models that share a provider also share its quota
+PROVIDERS = {
+    'gemma2': 'groq',
+    'llama3': 'groq',
+    'mixtral': 'groq',
+    'gemini': 'google',
+    'claude': 'anthropic',
+    'aws_claude': 'bedrock',
+    'openai': 'openai'
+}
+
+DEFAULT_STATE_DIR = os.path.join('AI_Output', 'rate_limits')
+
+class CallCancelled(Exception):
+    """Raised instead of sending a call whose answer is no longer needed"""
+
+def estimate_tokens(prompt, max_tokens=None, output_allowance=300):
+    """Rough token count for a request: ~4 characters per prompt token plus the expected output"""
+    output = min(int(max_tokens), output_allowance) if max_tokens else output_allowance
+    return len(prompt) // 4 + output
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute of one provider.
+    acquire() blocks until both buckets can cover the request. With a state_path the
+    bucket levels live in a locked file, so several screening processes share the quota.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, state_path=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = state_path if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._state = {'requests': requests_per_minute or 0, 'tokens': tokens_per_minute or 0, 'updated': time.time()}
+        if self.state_path:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, tokens=0, cancelled=None):
+        """
+        Wait until the request fits in both buckets; returns the seconds spent waiting.
+        Raises CallCancelled, without taking anything, once the cancelled event is set.
+        """
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)  # A single huge request must still go through
+        waited = 0.0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise CallCancelled("Call cancelled while waiting for the rate limiter")
+            with self._lock:
+                wait = self._try_take(tokens)
+            if wait <= 0:
+                if waited > 0:
+                    print(f"Rate limiter waited {waited:.2f} seconds")
+                return waited
+            if cancelled is not None:
+                cancelled.wait(wait)
+            else:
+                time.sleep(wait)
+            waited += wait
+
+    def expected_wait(self, tokens=0):
+        """Seconds acquire() would wait for this request now, without taking anything"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            state = dict(self._state)
+            if self.state_path and os.path.exists(self.state_path):
+                try:
+                    with open(self.state_path) as f:
+                        fcntl.flock(f, fcntl.LOCK_SH)
+                        try:
+                            state = json.loads(f.read())
+                        finally:
+                            fcntl.flock(f, fcntl.LOCK_UN)
+                except ValueError:
+                    pass
+            return self._take(state, tokens)
+
+    def _try_take(self, tokens):
+        if not self.state_path:
+            return self._take(self._state, tokens)
+        with open(self.state_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = dict(self._state)
+                wait = self._take(state, tokens)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, state, tokens):
+        """Refill state for the elapsed time, then take the request or return how long to wait"""
+        now = time.time()
+        elapsed = max(0.0, now - state['updated'])
+        state['updated'] = now
+
+        waits = []
+        if self.requests_per_minute:
+            state['requests'] = min(self.requests_per_minute, state['requests'] + elapsed * self.requests_per_minute / 60)
+            if state['requests'] < 1:
+                waits.append((1 - state['requests']) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            state['tokens'] = min(self.tokens_per_minute, state['tokens'] + elapsed * self.tokens_per_minute / 60)
+            if state['tokens'] < tokens:
+                waits.append((tokens - state['tokens']) * 60 / self.tokens_per_minute)
+
+        if waits:
+            return max(waits)
+        if self.requests_per_minute:
+            state['requests'] -= 1
+        if self.tokens_per_minute:
+            state['tokens'] -= tokens
+        return 0.0
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def configure_rate_limits(rate_limits=None, state_dir=DEFAULT_STATE_DIR, share_between_processes=True):
+    """
+    Set up one limiter per provider from the rate_limits config, e.g.
+    {"groq": {"requests_per_minute": 30, "tokens_per_minute": 15000}}
+    """
+    with _limiters_lock:
+        _limiters.clear()
+        for provider, limits in (rate_limits or {}).items():
+            state_path = os.path.join(state_dir, f"{provider}.json") if share_between_processes else None
+            _limiters[provider] = RateLimiter(
+                limits.get('requests_per_minute'),
+                limits.get('tokens_per_minute'),
+                state_path
+            )
+            print(f"Rate limiting {provider}: {limits}")
+
+def get_limiter(ai_model):
+    with _limiters_lock:
+        return _limiters.get(PROVIDERS.get(ai_model, ai_model))
+
+def wait_for_capacity(ai_model, prompt, max_tokens=None, cancelled=None):
+    """Block until the provider for ai_model has room for this prompt (or the call is cancelled)"""
+    if cancelled is not None and cancelled.is_set():
+        raise CallCancelled("Call cancelled before it was sent")
+    limiter = get_limiter(ai_model)
+    if limiter is None:
+        return 0.0
+    return limiter.acquire(estimate_tokens(prompt, max_tokens), cancelled)
+
+def expected_wait(ai_model, prompt, max_tokens=None):
+    """Seconds the provider for ai_model would make this prompt wait right now"""
+    limiter = get_limiter(ai_model)
+    if limiter is None:
+        return 0.0
+    return limiter.expected_wait(estimate_tokens(prompt, max_tokens))
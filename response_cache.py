@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join('AI_Output', 'response_cache.sqlite')
+
+class ResponseCache:
+    """
+    On-disk cache of AI responses, keyed by a hash of the model name, the prompt
+    and the sampling parameters. Entries older than max_age_days are dropped, and
+    the least recently used entries are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=200000, max_age_days=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created REAL,
+                last_used REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(ai_model, prompt, params=None):
+        payload = json.dumps([ai_model, prompt, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self._expired(row[1]):
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, ai_model, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, ai_model, response, now, now)
+            )
+            self._conn.commit()
+            self._puts += 1
+            check_size = self._puts % 100 == 0
+        if check_size:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries and trim the cache down to max_entries"""
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute('DELETE FROM responses WHERE created < ?', (cutoff,))
+            if self.max_entries:
+                count = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        'DELETE FROM responses WHERE key IN '
+                        '(SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)',
+                        (count - self.max_entries,)
+                    )
+            self._conn.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _expired(self, created):
+        return bool(self.max_age_days) and created < time.time() - self.max_age_days * 86400
+
+_cache = None
+_cache_enabled = True
+_cache_lock = threading.Lock()
+
+def configure_cache(enabled=True, path=DEFAULT_CACHE_PATH, max_entries=200000, max_age_days=None):
+    """Set up the shared response cache (called once from main with the config values)"""
+    global _cache, _cache_enabled
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = None
+        _cache_enabled = enabled
+        if enabled:
+            _cache = ResponseCache(path, max_entries, max_age_days)
+    return _cache
+
+def get_cache():
+    """Return the shared cache, creating one with the default settings if needed"""
+    global _cache
+    if not _cache_enabled:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
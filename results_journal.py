@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from file_operations import SUMMARY_HEADERS, ResultWriter, agent_sheet_headers, build_agent_row
+from data_processing import paper_id, criterion_key
+
+JOURNAL_NAME = 'screening_journal.jsonl'
+# Final decisions of agents whose call failed or whose answer could not be read
+FAILED_DECISIONS = ('Error', 'No Data')
+
+def journal_path(out_path):
+    return os.path.join(out_path, JOURNAL_NAME)
+
+class ResultsJournal:
+    """
+    Append-only record of screening results, one JSON object per line.
+    Every record is flushed and fsync'd before append returns, so a crash can at
+    worst lose the line being written; read_journal skips a torn last line.
+
+    The journal also keeps an index of completed papers and of the criteria already
+    assessed for unfinished papers, keyed by paper ID, which is used to resume runs.
+    Decisions with a failed agent (see FAILED_DECISIONS) are not kept for resuming, so
+    a run cut short by an outage or a bad API key asks about those papers again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.criteria_set = None
+        self.completed, self._partial = load_index(path)
+        if self.completed or self._partial:
+            print(f"Journal has {len(self.completed)} completed and {len(self._partial)} partially screened papers")
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def start_run(self, model, n_agents, screening_criteria):
+        # Papers only count as completed for the same set of criteria
+        self.criteria_set = hashlib.sha1(
+            ','.join(criterion_key(SC) for SC in screening_criteria).encode('utf-8')
+        ).hexdigest()[:16]
+        self.append({
+            'type': 'run',
+            'model': model,
+            'n_agents': n_agents,
+            'criteria': [SC['type'] for SC in screening_criteria],
+            'criteria_set': self.criteria_set,
+            'started_at': time.time()
+        })
+
+    def record_criterion(self, title, Criterion, decisions):
+        """Store one criterion's decisions for a paper as soon as they are known (unless an agent failed)"""
+        if decisions_failed(decisions):
+            return
+        pid = paper_id(title)
+        key = criterion_key(Criterion)
+        self.append({
+            'type': 'criterion',
+            'paper_id': pid,
+            'criterion': Criterion['type'],
+            'criterion_key': key,
+            'decisions': decisions
+        })
+        with self._lock:
+            self._partial.setdefault(pid, {})[key] = decisions
+
+    def completed_criteria(self, title, n_agents):
+        """Decisions already recorded for an unfinished paper, keyed by criterion_key"""
+        with self._lock:
+            done = self._partial.get(paper_id(title), {})
+            return {
+                key: decisions for key, decisions in done.items()
+                if len(decisions.get('Final', [])) == n_agents
+            }
+
+    def completed_record(self, title):
+        """Paper record of a paper already screened with the current criteria, else None"""
+        with self._lock:
+            record = self.completed.get(paper_id(title))
+        if record is None or record.get('criteria_set') != self.criteria_set:
+            return None
+        return record
+
+    def completed_decision(self, title):
+        """Summary decision of a paper already screened with the current criteria, else None"""
+        record = self.completed_record(title)
+        return record['summary_decision'] if record is not None else None
+
+    def record_paper(self, paper_num, title, abstract, summary_decision, save_stuff, n_agents, duplicate_of=None):
+        """
+        save_stuff is None for papers that were not sent to the AI (e.g. no abstract).
+        duplicate_of is the title of the paper whose decisions were copied, for near-duplicates.
+        """
+        pid = paper_id(title)
+        record = {
+            'type': 'paper',
+            'paper_id': pid,
+            'paper_num': paper_num,
+            'title': title,
+            'abstract': abstract,
+            'summary_decision': summary_decision,
+            'n_agents': n_agents,
+            'criteria': save_stuff,
+            'criteria_set': self.criteria_set,
+            'recorded_at': time.time()
+        }
+        if duplicate_of is not None:
+            record['duplicate_of'] = paper_id(duplicate_of)
+        # Still journaled for the results, but screened again on resume
+        if summary_decision == 'Error' or any(decisions_failed(decisions) for decisions in (save_stuff or {}).values()):
+            record['incomplete'] = True
+        self.append(record)
+        if record.get('incomplete'):
+            return
+        with self._lock:
+            self.completed[pid] = record
+            self._partial.pop(pid, None)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_journal(path):
+    """Yield the records in a journal, ignoring a partially written final line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable journal line in {path}")
+
+def load_index(path):
+    """
+    Read the journal once and return (completed, partial): completed maps paper ID to
+    its paper record, partial maps paper ID to {criterion_key: decisions} for papers
+    whose screening was interrupted part way through.
+    """
+    completed = {}
+    partial = {}
+    for record in read_journal(path):
+        pid = record.get('paper_id')
+        if not pid:
+            continue
+        if record.get('type') == 'paper' and not record.get('incomplete'):
+            completed[pid] = record
+            partial.pop(pid, None)
+        elif record.get('type') == 'criterion' and pid not in completed and not decisions_failed(record['decisions']):
+            partial.setdefault(pid, {})[record['criterion_key']] = record['decisions']
+    return completed, partial
+
+def decisions_failed(decisions):
+    """True if any agent's final decision in a criterion's decisions is a failure"""
+    return any(final in FAILED_DECISIONS for final in decisions.get('Final', []))
+
+def _journal_layout(path):
+    """Return the paper records plus the criteria and agent count of the latest run"""
+    papers = []
+    criteria = []
+    n_agents = 0
+    for record in read_journal(path):
+        if record.get('type') == 'run':
+            criteria = record.get('criteria', criteria)
+            n_agents = record.get('n_agents', n_agents)
+        elif record.get('type') == 'paper':
+            papers.append(record)
+            n_agents = max(n_agents, record.get('n_agents') or 0)
+            for criterion in (record.get('criteria') or {}):
+                if criterion not in criteria:
+                    criteria.append(criterion)
+    return papers, [{'type': criterion} for criterion in criteria], n_agents
+
+def canonical_records(path, criteria_set=None):
+    """
+    Return (papers, screening_criteria, n_agents) for the results workbook: the latest
+    record of each paper screened with criteria_set (default: that of the latest run
+    in the journal), in paper number order, with that run's criteria and agent count
+    """
+    runs = {}
+    latest = {}
+    last_set = None
+    for record in read_journal(path):
+        if record.get('type') == 'run':
+            runs[record.get('criteria_set')] = record
+            last_set = record.get('criteria_set')
+        elif record.get('type') == 'paper' and record.get('paper_id'):
+            latest[(record.get('criteria_set'), record['paper_id'])] = record
+    criteria_set = criteria_set or last_set
+    papers = sorted(
+        (record for (record_set, _), record in latest.items() if record_set == criteria_set),
+        key=lambda record: int(record['paper_num'])
+    )
+    run = runs.get(criteria_set, {})
+    n_agents = max([run.get('n_agents') or 0] + [record.get('n_agents') or 0 for record in papers])
+    return papers, [{'type': criterion} for criterion in run.get('criteria', [])], n_agents
+
+def export_to_excel(path, excel_path, screen_name='screening_results', criteria_set=None):
+    """
+    Build the summary and per-agent workbook from a journal. This is how the results
+    workbook is produced at the end of every run, so rows that had not been saved
+    when a run was killed are still written. See canonical_records for which papers
+    are included.
+    """
+    papers, screening_criteria, n_agents = canonical_records(path, criteria_set)
+
+    writer = ResultWriter(excel_path)
+    summary_sheet = f"{screen_name}_summary"
+    writer.append_rows(summary_sheet, [], SUMMARY_HEADERS)
+    agent_headers = agent_sheet_headers(screening_criteria)
+    for agent in range(n_agents):
+        writer.append_rows(f"Agent_{agent}", [], agent_headers)
+
+    exported = 0
+    for record in papers:
+        save_stuff = record.get('criteria')
+        if save_stuff is None:
+            continue  # Papers without an AI assessment are not part of the workbook
+        writer.append_rows(summary_sheet, [[record['paper_num'], record['title'], record['abstract'], record['summary_decision']]])
+        for agent in range(n_agents):
+            writer.append_rows(f"Agent_{agent}", [build_agent_row(
+                record['paper_num'], record['title'], record['abstract'],
+                save_stuff, agent, n_agents, screening_criteria
+            )])
+        exported += 1
+
+    writer.close()
+    print(f"Exported {exported} journal records to {excel_path}")
+    return exported
+
+def export_to_parquet(path, parquet_path, criteria_set=None):
+    """
+    Write one row per paper, criterion and agent to a Parquet file (needs pyarrow), for
+    the same papers as export_to_excel (see canonical_records)
+    """
+    import pandas as pd
+
+    papers, _, _ = canonical_records(path, criteria_set)
+    rows = []
+    for record in papers:
+        base = {
+            'paper_num': record['paper_num'],
+            'title': record['title'],
+            'summary_decision': record['summary_decision'],
+            'recorded_at': record.get('recorded_at')
+        }
+        for criterion, decisions in (record.get('criteria') or {}).items():
+            for agent, final in enumerate(decisions.get('Final', [])):
+                rows.append({
+                    **base,
+                    'criterion': criterion,
+                    'agent': agent,
+                    'initial': str(decisions.get('Initial', [None] * (agent + 1))[agent]),
+                    'final': str(final),
+                    'assessment': str(decisions.get('Assessment', [None] * (agent + 1))[agent]),
+                    'route': decisions.get('Route', 'llm'),
+                    'backend': str(decisions.get('Backend', [None] * (agent + 1))[agent])
+                })
+
+    try:
+        pd.DataFrame(rows).to_parquet(parquet_path, index=False)
+    except ImportError:
+        print("Skipping Parquet export - install pyarrow to enable it")
+        return False
+    print(f"Exported {len(rows)} decisions to {parquet_path}")
+    return True
+
+if __name__ == "__main__":
+    # Usage: python results_journal.py AI_Output/<model>
+    out_path = sys.argv[1] if len(sys.argv) > 1 else '.'
+    export_to_excel(journal_path(out_path), os.path.join(out_path, 'screening_results.xlsx'))
+    export_to_parquet(journal_path(out_path), os.path.join(out_path, 'screening_results.parquet'))
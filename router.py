@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from rate_limiter import CallCancelled, expected_wait, wait_for_capacity
+
+# Model name that sends calls through the router (set "model_to_use": "router")
+ROUTER_NAME = 'router'
+
+def is_rate_limit(error):
+    """True for rate limit errors, whichever SDK raised them"""
+    text = str(error).lower()
+    return type(error).__name__ in ('RateLimitException', 'RateLimitError') or '429' in text or 'rate limit' in text or 'exhausted' in text
+
+class Router:
+    """
+    Spread AI calls over a pool of backends (ask_AI model names) with weights.
+
+    Each call goes to the backend with the lowest score, (smoothed latency x calls in
+    flight + wait for its rate limit quota) / weight, so faster backends with quota to
+    spare and a higher weight get more of the work. A backend that has not answered yet
+    scores zero and is tried first. A backend that fails (rate limit or any other
+    error) is left alone for cooldown_seconds, doubled for every failure in a row up to
+    max_cooldown_seconds, and the call moves on to the next backend. When every
+    backend has failed or is cooling down, the call waits for the first to come back,
+    up to max_rounds times, before giving up with the last error.
+    """
+
+    def __init__(self, backends, cooldown_seconds=5, max_cooldown_seconds=120, max_rounds=5, latency_smoothing=0.3):
+        if isinstance(backends, (list, tuple)):
+            backends = dict.fromkeys(backends, 1)
+        if not backends:
+            raise ValueError("The router needs at least one backend")
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.max_rounds = max(1, int(max_rounds))
+        self.latency_smoothing = latency_smoothing
+        self.backends = {
+            name: {'weight': float(weight), 'latency': None, 'in_flight': 0, 'failures': 0, 'cooldown_until': 0.0,
+                   'served': 0, 'errors': 0, 'rate_limited': 0, 'seconds': 0.0}
+            for name, weight in backends.items() if weight > 0
+        }
+        self._lock = threading.Lock()
+
+    def _score(self, name, wait):
+        backend = self.backends[name]
+        latency = backend['latency'] or 0.0
+        return (latency * (1 + backend['in_flight']) + wait) / backend['weight']
+
+    def choose(self, prompt, max_tokens=None, tried=()):
+        """The best backend not in tried and not cooling down, or None"""
+        now = time.time()
+        candidates = [name for name, backend in self.backends.items() if name not in tried and backend['cooldown_until'] <= now]
+        if not candidates:
+            return None
+        waits = {name: expected_wait(name, prompt, max_tokens) for name in candidates}
+        with self._lock:
+            name = min(candidates, key=lambda name: self._score(name, waits[name]))
+            self.backends[name]['in_flight'] += 1
+        return name
+
+    def _served(self, name, seconds):
+        with self._lock:
+            backend = self.backends[name]
+            backend['in_flight'] -= 1
+            backend['failures'] = 0
+            backend['served'] += 1
+            backend['seconds'] += seconds
+            if backend['latency'] is None:
+                backend['latency'] = seconds
+            else:
+                backend['latency'] += self.latency_smoothing * (seconds - backend['latency'])
+
+    def _released(self, name):
+        with self._lock:
+            self.backends[name]['in_flight'] -= 1
+
+    def _failed(self, name, error):
+        with self._lock:
+            backend = self.backends[name]
+            backend['in_flight'] -= 1
+            backend['failures'] += 1
+            backend['errors'] += 1
+            backend['rate_limited'] += is_rate_limit(error)
+            cooldown = min(self.max_cooldown_seconds, self.cooldown_seconds * 2 ** (backend['failures'] - 1))
+            backend['cooldown_until'] = time.time() + cooldown
+        return cooldown
+
+    def call(self, attempt, prompt, max_tokens=None, cancelled=None):
+        """
+        Call attempt(backend_name) on the chosen backend, failing over to the others on
+        errors. Returns (backend_name, response). Once the cancelled event is set, no
+        further attempt is made and CallCancelled is raised.
+        """
+        last_error = None
+        for _ in range(self.max_rounds):
+            tried = set()
+            while True:
+                name = self.choose(prompt, max_tokens, tried)
+                if name is None:
+                    break
+                tried.add(name)
+                try:
+                    wait_for_capacity(name, prompt, max_tokens, cancelled)
+                except CallCancelled:
+                    self._released(name)
+                    raise
+                try:
+                    started = time.time()
+                    response = attempt(name)
+                except Exception as e:
+                    cooldown = self._failed(name, e)
+                    print(f"{name} failed ({str(e)}), resting it for {cooldown:.0f} seconds and failing over")
+                    last_error = e
+                    continue
+                self._served(name, time.time() - started)
+                return name, response
+
+            with self._lock:
+                wait = min(backend['cooldown_until'] for backend in self.backends.values()) - time.time()
+            if wait > 0:
+                print(f"All backends are resting, waiting {wait:.1f} seconds")
+                if cancelled is None:
+                    time.sleep(wait)
+                elif cancelled.wait(wait):
+                    raise CallCancelled("Call cancelled while the router backends were resting")
+        raise last_error or RuntimeError("No router backend available")
+
+    def report(self):
+        with self._lock:
+            total = sum(backend['served'] for backend in self.backends.values())
+            return {
+                name: {
+                    'weight': backend['weight'],
+                    'served': backend['served'],
+                    'share': round(backend['served'] / total, 3) if total else 0.0,
+                    'errors': backend['errors'],
+                    'rate_limited': backend['rate_limited'],
+                    'mean_latency_seconds': round(backend['seconds'] / backend['served'], 3) if backend['served'] else None
+                }
+                for name, backend in self.backends.items()
+            }
+
+    def save_report(self, out_path):
+        report = self.report()
+        with open(os.path.join(out_path, 'router_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        for name, stats in report.items():
+            latency = f"{stats['mean_latency_seconds']:.2f}s mean latency" if stats['mean_latency_seconds'] is not None else "no answers"
+            print(f"Router {name}: {stats['served']} calls ({stats['share']:.0%}), {latency}, "
+                  f"{stats['errors']} errors ({stats['rate_limited']} rate limits)")
+        return report
+
+_router = None
+
+def configure_router(router_config=None):
+    """
+    Set up the router from the router config, e.g.
+    {"backends": {"gemma2": 2, "gemini": 1}, "cooldown_seconds": 5}
+    """
+    global _router
+    router_config = router_config or {}
+    _router = None
+    if not router_config.get('backends'):
+        return None
+    _router = Router(
+        router_config['backends'],
+        cooldown_seconds=router_config.get('cooldown_seconds', 5),
+        max_cooldown_seconds=router_config.get('max_cooldown_seconds', 120),
+        max_rounds=router_config.get('max_rounds', 5),
+        latency_smoothing=router_config.get('latency_smoothing', 0.3)
+    )
+    pool = ', '.join(f"{name} (weight {backend['weight']:g})" for name, backend in _router.backends.items())
+    print(f"Routing calls over {pool}")
+    return _router
+
+def get_router(ai_model=ROUTER_NAME):
+    """The configured router if ai_model is the router's name, otherwise None"""
+    return _router if ai_model == ROUTER_NAME else None
+
+# Backend that answered each (criterion, paper content, agent), until the screening
+# code collects it for the results. Bounded in case some answers are never collected.
+_served = OrderedDict()
+_served_lock = threading.Lock()
+MAX_SERVED = 10000
+
+def record_served(criterion, content, agent, backend):
+    with _served_lock:
+        _served[(criterion, content, agent)] = backend
+        _served.move_to_end((criterion, content, agent))
+        while len(_served) > MAX_SERVED:
+            _served.popitem(last=False)
+
+def pop_served(criterion, content, agent):
+    """Backend that answered one agent about a criterion for a paper (None when unknown)"""
+    with _served_lock:
+        return _served.pop((criterion, content, agent), None)
+
+def served_backends(criterion, content, agents):
+    """Backends that answered agents 0..agents-1 about a criterion for a paper ('NOT RUN' when unknown)"""
+    with _served_lock:
+        return [_served.pop((criterion, content, agent), None) or 'NOT RUN' for agent in range(agents)]
@@ -1,75 +1,324 @@
-from ai_interaction import get_data
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ai_interaction import get_data, get_combined_data, get_batch_assessment, store_in_info_all, info_all_lock
 from file_operations import save_results, update_html
+from data_processing import criterion_key
+from progress import publish_event
+from triage import triage_criterion
+from agent_policy import enough_agents, record_agents
+from criteria_order import ordered_criteria, record_criterion_cost, agents_asked
+from router import served_backends
 
-def process_paper(paper_num, info, title_column, abstract_column, n_agents, screening_criteria, info_all, model_to_use, out_path, screen_name, skip_criteria, resume_from, update_screening_progress, n_studies):
+decision_numeric = {'Yes': 2, 'No': 0, 'Maybe': 1}
+
+def summarize_criterion(summary_decision, initial_decisions, final_decisions):
+    """Update a paper's summary decision with one criterion's decisions; returns (summary_decision, rejected)"""
+    converted_decisions = [
+        decision_numeric.get(element, element)
+        for element in (initial_decisions + final_decisions)
+    ]
+    converted_decisions = [
+        element for element in converted_decisions
+        if isinstance(element, int)
+    ]
+
+    if converted_decisions and sum(converted_decisions) == 0:
+        return 'No', True
+    elif all(decision == 'Yes' for decision in final_decisions):
+        return 'Yes', False
+    return summary_decision, False
+
+def screen_paper(paper_num, info, title_column, abstract_column, n_agents, screening_criteria, info_all, model_to_use, skip_criteria, agent_mode='sequential', journal=None, prompt_mode='per_criterion'):
+    """Run the AI assessments for a single paper without writing any output.
+
+    Returns (title, abstract, summary_decision, save_stuff). save_stuff is None
+    when the paper was not sent to the AI (missing abstract), and title is None
+    when the paper information could not be read.
+
+    With a journal, each criterion's decisions are recorded as soon as they are
+    known, and criteria already recorded for this paper by an interrupted run are
+    reused instead of asking the AI again.
+
+    prompt_mode 'combined' asks each agent about all criteria in a single call
+    (see get_combined_data) instead of one call per criterion.
+    """
     try:
         title = info[title_column].values[paper_num]
         abstract = info[abstract_column].values[paper_num]
     except Exception as e:
         print(f"Error accessing paper information: {str(e)}")
-        return 'Error'
+        return None, None, 'Error', None
 
     if "No Abstract" in abstract or abstract == "":
         print("Skipping paper - no abstract")
-        summary_decision = 'Maybe'
-        update_html(out_path, paper_num, title, summary_decision, update_screening_progress, n_studies)
-        return summary_decision
+        return title, abstract, 'Maybe', None
 
     content = f"Title: {title}\n\nAbstract: {abstract}"
     print("\n>>>>>>>>>>>>>>>>>>>>>>>>>>")
     print(content)
 
-    save_stuff = {}
-    summary_decision = 'Maybe'  # Default to 'Maybe' if no decision is made
-    decision_numeric = {'Yes': 2, 'No': 0, 'Maybe': 1}
+    done_criteria = journal.completed_criteria(title, n_agents) if journal is not None else {}
 
-    # Process screening criteria
-    for SC_num, Criterion in enumerate(screening_criteria, 1):
-        print(f"\nProcessing Screening Criterion {SC_num}: {Criterion['type']}")
+    combined = {}
+    if prompt_mode == 'combined' and not done_criteria:
         try:
-            assessments, initial_decisions, final_decisions = get_data(
-                Criterion, content, n_agents, SC_num, info_all, paper_num, model_to_use,
+            combined = get_combined_data(
+                screening_criteria, content, n_agents, info_all, paper_num, model_to_use,
                 title, abstract
             )
         except Exception as e:
-            print(f"Error in get_data for criterion {Criterion['type']}: {str(e)}")
-            assessments = initial_decisions = final_decisions = ['Error'] * n_agents
+            print(f"Error in get_combined_data: {str(e)}")
 
-        for lst in [assessments, initial_decisions, final_decisions]:
-            while len(lst) < n_agents:
-                lst.append("NOT RUN")
+    save_stuff = {}
+    summary_decision = 'Maybe'  # Default to 'Maybe' if no decision is made
+
+    # Process screening criteria (in the order set by criteria ordering, if enabled)
+    for SC_num, Criterion in ordered_criteria(screening_criteria):
+        print(f"\nProcessing Screening Criterion {SC_num}: {Criterion['type']}")
+        started = time.time()
+        done = done_criteria.get(criterion_key(Criterion))
+        # Triage only saves calls the combined prompt has not already made
+        triaged = None
+        if done is None and Criterion['type'] not in combined:
+            triaged = triage_criterion(Criterion, title, abstract, n_agents)
+        route = 'llm'
+        if done is not None:
+            print("Using decisions recorded by an earlier run")
+            assessments, initial_decisions, final_decisions = done['Assessment'], done['Initial'], done['Final']
+            route = done.get('Route', 'llm')
+            backends = done.get('Backend', ['NOT RUN'] * n_agents)
+        elif triaged is not None:
+            assessments, initial_decisions, final_decisions, route = triaged
+            backends = [route] * n_agents
+            print(assessments[0])
+        else:
+            try:
+                if Criterion['type'] in combined:
+                    assessments, initial_decisions, final_decisions = combined[Criterion['type']]
+                else:
+                    assessments, initial_decisions, final_decisions = get_data(
+                        Criterion, content, n_agents, SC_num, info_all, paper_num, model_to_use,
+                        title, abstract, agent_mode
+                    )
+                record_agents(Criterion, final_decisions, n_agents)
+            except Exception as e:
+                print(f"Error in get_data for criterion {Criterion['type']}: {str(e)}")
+                assessments = initial_decisions = final_decisions = ['Error'] * n_agents
+
+            for lst in [assessments, initial_decisions, final_decisions]:
+                while len(lst) < n_agents:
+                    lst.append("NOT RUN")
+            backends = served_backends(Criterion['type'], content, n_agents)
 
         save_stuff[Criterion['type']] = {
             "Initial": initial_decisions,
             "Final": final_decisions,
-            "Assessment": assessments
+            "Assessment": assessments,
+            "Route": route,
+            "Backend": backends
         }
+        if done is None:
+            if journal is not None:
+                journal.record_criterion(title, Criterion, save_stuff[Criterion['type']])
+            publish_event('criterion', paper_number=paper_num, criterion=Criterion['type'], decisions=final_decisions)
 
         print("\nInitial Decisions:", initial_decisions)
         print("Final Decisions:", final_decisions)
 
-        converted_decisions = [
-            decision_numeric.get(element, element) 
-            for element in (initial_decisions + final_decisions)
-        ]
-        converted_decisions = [
-            element for element in converted_decisions 
-            if isinstance(element, int)
-        ]
-
-        if converted_decisions and sum(converted_decisions) == 0:
+        summary_decision, rejected = summarize_criterion(summary_decision, initial_decisions, final_decisions)
+        if done is None and Criterion['type'] not in combined:
+            record_criterion_cost(SC_num, rejected, agents_asked(save_stuff[Criterion['type']]), time.time() - started)
+        if rejected:
             print(f"Rejected at SC: {SC_num}")
-            summary_decision = 'No'
             if skip_criteria:
                 break
-        elif all(decision == 'Yes' for decision in final_decisions):
-            summary_decision = 'Yes'
 
-    # Save results
+    return title, abstract, summary_decision, save_stuff
+
+def chunk_contents(contents, papers_per_request, max_request_chars):
+    """Split {key: content} into request-sized dicts by paper count and total characters"""
+    chunks = []
+    chunk = {}
+    chunk_chars = 0
+    for key, content in contents.items():
+        if chunk and (len(chunk) >= papers_per_request or chunk_chars + len(content) > max_request_chars):
+            chunks.append(chunk)
+            chunk = {}
+            chunk_chars = 0
+        chunk[key] = content
+        chunk_chars += len(content)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def screen_in_waves(paper_nums, info, title_column, abstract_column, n_agents, screening_criteria, info_all, skip_criteria, ask_wave, journal=None):
+    """
+    Screen a group of papers one criterion and one agent at a time. Each wave asks
+    ask_wave(Criterion, agent, {paper_num: content}) for every paper that still needs
+    an answer and expects {paper_num: (assessment, initial, final, thoughts)} back.
+    The agent policy per criterion, skip_criteria and the summary decision follow the
+    same rules as screen_paper.
+
+    Returns {paper_num: (title, abstract, summary_decision, save_stuff)}.
+    """
+    results = {}
+    active = {}
+    for paper_num in paper_nums:
+        try:
+            title = info[title_column].values[paper_num]
+            abstract = info[abstract_column].values[paper_num]
+        except Exception as e:
+            print(f"Error accessing paper information: {str(e)}")
+            results[paper_num] = (None, None, 'Error', None)
+            continue
+        if "No Abstract" in abstract or abstract == "":
+            print(f"Skipping paper {paper_num} - no abstract")
+            results[paper_num] = (title, abstract, 'Maybe', None)
+            continue
+        active[paper_num] = {
+            'title': title,
+            'abstract': abstract,
+            'content': f"Title: {title}\n\nAbstract: {abstract}",
+            'done': journal.completed_criteria(title, n_agents) if journal is not None else {},
+            'save_stuff': {},
+            'summary_decision': 'Maybe'
+        }
+
+    for SC_num, Criterion in ordered_criteria(screening_criteria):
+        if not active:
+            break
+        started = time.time()
+        print(f"\nProcessing Screening Criterion {SC_num}: {Criterion['type']} for {len(active)} papers")
+        key = criterion_key(Criterion)
+        decisions = {}
+        routes = {}
+        backends = {}
+        undecided = []
+        triaged = []
+        for paper_num, paper in active.items():
+            done = paper['done'].get(key)
+            if done is not None:
+                decisions[paper_num] = (done['Assessment'], done['Initial'], done['Final'])
+                routes[paper_num] = done.get('Route', 'llm')
+                backends[paper_num] = done.get('Backend', ['NOT RUN'] * n_agents)
+                continue
+            routed = triage_criterion(Criterion, paper['title'], paper['abstract'], n_agents)
+            if routed is not None:
+                decisions[paper_num] = routed[:3]
+                routes[paper_num] = routed[3]
+                backends[paper_num] = [routed[3]] * n_agents
+                triaged.append(paper_num)
+            else:
+                decisions[paper_num] = ([], [], [])
+                routes[paper_num] = 'llm'
+                undecided.append(paper_num)
+        if triaged:
+            print(f"Triage decided {len(triaged)} papers")
+        asked = undecided + triaged
+
+        for agent in range(n_agents):
+            if not undecided:
+                break
+            print(f"Agent {agent}: {len(undecided)} papers")
+            try:
+                answers = ask_wave(Criterion, agent, {paper_num: active[paper_num]['content'] for paper_num in undecided})
+            except Exception as e:
+                print(f"Error asking criterion {Criterion['type']}: {str(e)}")
+                answers = {}
+
+            still_undecided = []
+            for paper_num in undecided:
+                assessment, initial_decision, final_decision, thoughts = answers.get(paper_num, ('Error', 'Error', 'Error', 'Error'))
+                assessments, initial_decisions, final_decisions = decisions[paper_num]
+                assessments.append(assessment)
+                initial_decisions.append(initial_decision)
+                final_decisions.append(final_decision)
+                paper = active[paper_num]
+                store_in_info_all(info_all, agent, paper_num, SC_num, Criterion, paper['title'], paper['abstract'], initial_decision, final_decision, thoughts)
+                if not enough_agents(initial_decisions, final_decisions, n_agents):
+                    still_undecided.append(paper_num)
+            undecided = still_undecided
+
+        # The wave's time is shared out over the papers in it
+        seconds = (time.time() - started) / max(1, len(asked))
+        for paper_num in list(active):
+            paper = active[paper_num]
+            assessments, initial_decisions, final_decisions = decisions[paper_num]
+            for lst in [assessments, initial_decisions, final_decisions]:
+                while len(lst) < n_agents:
+                    lst.append("NOT RUN")
+            if paper_num not in backends:
+                backends[paper_num] = served_backends(Criterion['type'], paper['content'], n_agents)
+            paper['save_stuff'][Criterion['type']] = {
+                "Initial": initial_decisions,
+                "Final": final_decisions,
+                "Assessment": assessments,
+                "Route": routes[paper_num],
+                "Backend": backends[paper_num]
+            }
+            if paper_num in asked:
+                if routes[paper_num] == 'llm':
+                    record_agents(Criterion, final_decisions, n_agents)
+                if journal is not None:
+                    journal.record_criterion(paper['title'], Criterion, paper['save_stuff'][Criterion['type']])
+                publish_event('criterion', paper_number=paper_num, criterion=Criterion['type'], decisions=final_decisions)
+
+            paper['summary_decision'], rejected = summarize_criterion(paper['summary_decision'], initial_decisions, final_decisions)
+            if paper_num in asked:
+                record_criterion_cost(SC_num, rejected, agents_asked(paper['save_stuff'][Criterion['type']]), seconds)
+            if rejected:
+                print(f"Paper {paper_num} rejected at SC: {SC_num}")
+                if skip_criteria:
+                    results[paper_num] = (paper['title'], paper['abstract'], paper['summary_decision'], paper['save_stuff'])
+                    del active[paper_num]
+
+    for paper_num, paper in active.items():
+        results[paper_num] = (paper['title'], paper['abstract'], paper['summary_decision'], paper['save_stuff'])
+    return results
+
+def screen_papers_batched(paper_nums, info, title_column, abstract_column, n_agents, screening_criteria, info_all, model_to_use, skip_criteria, papers_per_request=10, max_request_chars=24000, max_concurrency=1, journal=None):
+    """
+    Screen a group of papers using multi-paper requests: in each wave the papers are
+    packed into requests of up to papers_per_request papers (and max_request_chars
+    characters of content), which run max_concurrency at a time.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+
+    def ask_wave(Criterion, agent, contents):
+        chunks = chunk_contents(contents, papers_per_request, max_request_chars)
+        futures = [(chunk, executor.submit(get_batch_assessment, Criterion, chunk, model_to_use, agent)) for chunk in chunks]
+        answers = {}
+        for chunk, future in futures:
+            try:
+                answers.update(future.result())
+            except Exception as e:
+                print(f"Error in get_batch_assessment for criterion {Criterion['type']}: {str(e)}")
+        return answers
+
     try:
-        save_results(screen_name, out_path, paper_num, title, abstract, summary_decision, resume_from, n_agents, info_all, save_stuff, screening_criteria)
-    except Exception as e:
-        print(f"Error saving results: {str(e)}")
+        return screen_in_waves(
+            paper_nums, info, title_column, abstract_column, n_agents,
+            screening_criteria, info_all, skip_criteria, ask_wave, journal
+        )
+    finally:
+        executor.shutdown()
+
+def record_paper(paper_num, title, abstract, summary_decision, save_stuff, n_agents, info_all, screening_criteria, out_path, screen_name, resume_from, update_screening_progress, n_studies, writer=None, journal=None, duplicate_of=None):
+    """Write the outcome of screen_paper to the journal, results workbook and progress page"""
+    if title is None:
+        return
+
+    # The journal is written first so a crash while saving the workbook loses nothing
+    if journal is not None:
+        journal.record_paper(paper_num, title, abstract, summary_decision, save_stuff, n_agents, duplicate_of)
+
+    # Save results
+    if save_stuff is not None:
+        try:
+            with info_all_lock:
+                save_results(screen_name, out_path, paper_num, title, abstract, summary_decision, resume_from, n_agents, info_all, save_stuff, screening_criteria, writer)
+        except Exception as e:
+            print(f"Error saving results: {str(e)}")
 
     # Update HTML and screening progress
     try:
@@ -78,4 +327,16 @@ def process_paper(paper_num, info, title_column, abstract_column, n_agents, scre
         print(f"Error updating HTML: {str(e)}")
 
     print(f"Completed processing paper {paper_num}")
+
+def process_paper(paper_num, info, title_column, abstract_column, n_agents, screening_criteria, info_all, model_to_use, out_path, screen_name, skip_criteria, resume_from, update_screening_progress, n_studies, agent_mode='sequential', writer=None, journal=None, prompt_mode='per_criterion'):
+    title, abstract, summary_decision, save_stuff = screen_paper(
+        paper_num, info, title_column, abstract_column, n_agents,
+        screening_criteria, info_all, model_to_use, skip_criteria, agent_mode, journal,
+        prompt_mode
+    )
+    record_paper(
+        paper_num, title, abstract, summary_decision, save_stuff, n_agents, info_all,
+        screening_criteria, out_path, screen_name, resume_from,
+        update_screening_progress, n_studies, writer, journal
+    )
     return summary_decision
@@ -1,21 +1,30 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 import os
 import sys
+import time
 import pandas as pd
 import json
 import webbrowser
 from threading import Timer
 from dotenv import load_dotenv
 import subprocess
+from file_operations import get_last_processed_paper
+from data_processing import read_papers
+from progress import screening_progress, events_path, read_events
+from metrics import metrics_path, prometheus_text
 
 app = Flask(__name__, static_url_path='', static_folder='static')
 load_dotenv()
 
-# Global variables to store screening progress and pilot data
-screening_progress = []
+# Global variables to store pilot data
 pilot_papers = []
 current_pilot_index = 0
 
+# The screening process started by this server, so progress streams can tell it has died
+screening_process = None
+# Progress streams end after this long without a new event, so they never hold a thread forever
+STREAM_IDLE_SECONDS = 600
+
 def open_browser():
     webbrowser.open('http://127.0.0.1:5000/')
 
@@ -51,27 +60,21 @@ def update_env_file(data):
         for key, value in env_vars.items():
             f.write(f'{key}={value}\n')
 
-def get_last_processed_paper(model_to_use):
-    """Get the last processed paper number from existing output"""
-    output_dir = os.path.join('AI_Output', model_to_use)
-    excel_file = os.path.join(output_dir, 'screening_results.xlsx')
-    
-    if os.path.exists(excel_file):
-        try:
-            df = pd.read_excel(excel_file, sheet_name='screening_results_summary')
-            if not df.empty:
-                # Convert int64 to regular Python int for JSON serialization
-                return int(df.iloc[:, 0].max())
-        except Exception as e:
-            print(f"Error reading Excel file: {str(e)}")
-    return -1
-
-def create_screening_config(data):
+def create_screening_config(data, papers_file):
     """Create a temporary config file for main.py"""
     model_to_use = data.get('ai_model')
     last_paper = get_last_processed_paper(model_to_use)
     
-    config = {
+    # Keep any tuning options (e.g. max_concurrency) from a previous config
+    config = {}
+    if os.path.exists('screening_config.json'):
+        try:
+            with open('screening_config.json', 'r') as f:
+                config = json.load(f)
+        except:
+            pass
+    
+    config.update({
         'model_to_use': model_to_use,
         'n_agents': int(data.get('num_agents', 5)),
         'proj_location': '.',  # Use current directory
@@ -79,8 +82,9 @@ def create_screening_config(data):
         'skip_criteria': True,
         'resume_from': last_paper + 1,  # Add resume point
         'pilot_percentage': float(data.get('pilot_percentage', 100)),  # Add pilot percentage
-        'use_pilot': data.get('use_pilot') == 'true'  # Add pilot mode flag
-    }
+        'use_pilot': data.get('use_pilot') == 'true',  # Add pilot mode flag
+        'papers_file': papers_file
+    })
     
     with open('screening_config.json', 'w') as f:
         json.dump(config, f)
@@ -137,17 +141,11 @@ def screen():
         # Get file extension
         file_ext = os.path.splitext(uploaded_file.filename)[1].lower()
         
-        # Save the uploaded file temporarily
-        temp_path = 'uploaded_papers' + file_ext
-        uploaded_file.save(temp_path)
-
-        # Read the file based on its extension
-        if file_ext == '.csv':
-            df = pd.read_csv(temp_path)
-        elif file_ext in ['.xlsx', '.xls']:
-            df = pd.read_excel(temp_path)
-        else:
+        # Keep the uploaded file as it is; main.py reads CSV, Excel, Parquet and RIS directly
+        if file_ext not in ['.csv', '.xlsx', '.xls', '.parquet', '.ris']:
             return jsonify({'error': 'Unsupported file format'}), 400
+        papers_file = 'uploaded_papers' + file_ext
+        uploaded_file.save(papers_file)
 
         # Get the screening criteria
         criteria = json.loads(request.form['criteria'])
@@ -157,27 +155,21 @@ def screen():
         criteria_df = pd.DataFrame(criteria)
         criteria_df.to_csv(criteria_path, index=False, encoding='utf-8-sig')
 
-        # Convert to Excel format as expected by main.py
-        excel_path = 'all_1400.xlsx'
-        df.to_excel(excel_path, index=False)
-
-        # Clean up temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-
         # Update .env file with API keys
         update_env_file(request.form)
 
         # Create config file for main.py
-        create_screening_config(request.form)
+        create_screening_config(request.form, papers_file)
 
         # Create output directory if it doesn't exist
         model_dir = os.path.join('AI_Output', request.form.get('ai_model'))
         os.makedirs(model_dir, exist_ok=True)
 
         # Clear previous screening progress
-        global screening_progress, pilot_papers, current_pilot_index
-        screening_progress = []
+        global pilot_papers, current_pilot_index, screening_process
+        screening_progress.clear()
+        if os.path.exists(events_path(model_dir)):
+            os.remove(events_path(model_dir))
         pilot_papers = []
         current_pilot_index = 0
 
@@ -187,32 +179,91 @@ def screen():
 
         if use_pilot:
             # Prepare pilot papers
+            df = read_papers(papers_file)
             num_pilot_papers = int(len(df) * (pilot_percentage / 100))
             pilot_papers = df.head(num_pilot_papers).to_dict('records')
             return jsonify({'message': 'Pilot screening process started', 'pilot_papers': pilot_papers}), 200
         else:
             # Execute the screening script with the config
             venv_python = sys.executable
-            subprocess.Popen([venv_python, 'main.py', str(pilot_percentage)])
+            screening_process = subprocess.Popen([venv_python, 'main.py', str(pilot_percentage)])
             return jsonify({'message': 'Screening process started successfully'}), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_output_path():
+    """Output folder of the model in the current config"""
+    model_to_use = ''
+    if os.path.exists('screening_config.json'):
+        try:
+            with open('screening_config.json', 'r') as f:
+                model_to_use = json.load(f).get('model_to_use', '')
+        except:
+            pass
+    return os.path.join('AI_Output', model_to_use)
+
+def get_events_path():
+    """Progress event file of the model in the current config"""
+    return events_path(get_output_path())
+
 @app.route('/screening_progress')
 def get_screening_progress():
-    """Endpoint to get the current screening progress"""
-    global screening_progress
-    return jsonify(screening_progress)
-
-def update_screening_progress(paper_number, title, decision):
-    """Update the screening progress"""
-    global screening_progress
-    screening_progress.append({
-        'paper_number': paper_number,
-        'title': title,
-        'decision': decision
-    })
+    """Endpoint to get the progress events after ?cursor= (for clients that poll)"""
+    events, cursor = read_events(get_events_path(), request.args.get('cursor', '0'))
+    return jsonify({'events': events, 'cursor': cursor})
+
+@app.route('/screening_progress/stream')
+def stream_screening_progress():
+    """Server-sent events for a screening run, starting after Last-Event-ID (or ?cursor=)"""
+    path = get_events_path()
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor', '0')
+    process = screening_process
+
+    def generate(cursor):
+        idle = 0
+        while True:
+            # Checked before reading, so every event written before the process exited is seen
+            exited = process is not None and process.poll() is not None
+            events, cursor = read_events(path, cursor)
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+                if event['event'] in ('complete', 'failed'):
+                    return
+            if events:
+                idle = 0
+                continue
+            if exited:
+                # Killed (e.g. out of memory) before it could report how the run ended
+                event = {'event': 'failed', 'message': f"The screening process exited with code {process.returncode}"}
+                yield f"event: failed\ndata: {json.dumps(event)}\n\n"
+                return
+            idle += 1
+            if idle * 0.5 >= STREAM_IDLE_SECONDS:
+                return
+            if idle % 30 == 0:
+                yield ": keep-alive\n\n"
+            time.sleep(0.5)
+
+    return Response(generate(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics')
+def get_metrics():
+    """AI call metrics of the current (or last) run in the Prometheus text format"""
+    path = metrics_path(get_output_path())
+    summary = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        except ValueError:
+            pass  # Being replaced; the next scrape picks up the new file
+    return Response(prometheus_text(summary), mimetype='text/plain; version=0.0.4')
+
+@app.route('/output/<path:filename>')
+def output_file(filename):
+    """Serve run outputs such as /output/<model>/screening_progress.html (Range requests are supported)"""
+    return send_from_directory('AI_Output', filename)
 
 @app.route('/ask_ai', methods=['POST'])
 def ask_ai():
@@ -233,7 +284,7 @@ def ask_ai():
 @app.route('/decide_paper', methods=['POST'])
 def decide_paper():
     """Endpoint to record user's decision on a paper"""
-    global current_pilot_index
+    global current_pilot_index, screening_process
     data = request.json
     paper_index = data.get('paper_index')
     decision = data.get('decision')
@@ -251,7 +302,7 @@ def decide_paper():
     # If all pilot papers are processed, start the full screening
     if current_pilot_index >= len(pilot_papers):
         venv_python = sys.executable
-        subprocess.Popen([venv_python, 'main.py', '100'])  # Start full screening
+        screening_process = subprocess.Popen([venv_python, 'main.py', '100'])  # Start full screening
         return jsonify({'message': 'Pilot completed, starting full screening'}), 200
 
     return jsonify({'message': 'Decision recorded successfully'}), 200
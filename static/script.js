@@ -150,7 +150,7 @@ document.getElementById('screeningForm').addEventListener('submit', async (e) =>
                 showStatus('Screening process started successfully! Check the output folder for results.');
                 screeningInProgress = true;
                 document.getElementById('screeningProgress').style.display = 'block';
-                fetchScreeningProgress();
+                startProgressStream();
             }
         } else {
             showStatus(data.error || 'Error starting screening process', true);
@@ -245,7 +245,7 @@ function finishPilotMode() {
     showStatus('Pilot screening completed. Full screening will now begin.');
     screeningInProgress = true;
     document.getElementById('screeningProgress').style.display = 'block';
-    fetchScreeningProgress();
+    startProgressStream();
 }
 
 // Updated function to handle template file upload
@@ -297,42 +297,63 @@ function handleTemplateUpload(event) {
 // Add event listener for template file upload
 document.getElementById('templateFile').addEventListener('change', handleTemplateUpload);
 
-// New function to fetch and display screening progress
-async function fetchScreeningProgress() {
-    if (!screeningInProgress) return;
+// Stream screening progress from the server; each event is sent once, and the
+// browser resumes from the last event ID by itself if the connection drops
+let progressSource = null;
+let papersScreened = 0;
+let papersTotal = null;
 
-    try {
-        const response = await fetch('/screening_progress');
-        if (!response.ok) {
-            throw new Error('Failed to fetch screening progress');
-        }
-        const progressData = await response.json();
-
-        // Update the progress table
-        const progressBody = document.getElementById('progressBody');
-        progressBody.innerHTML = ''; // Clear existing rows
-
-        progressData.forEach(paper => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${paper.paper_number}</td>
-                <td>${paper.title}</td>
-                <td>${paper.decision}</td>
-            `;
-            progressBody.appendChild(row);
+function startProgressStream() {
+    if (progressSource) {
+        progressSource.close();
+    }
+    document.getElementById('progressBody').innerHTML = '';
+    document.getElementById('currentCriterion').textContent = '';
+    papersScreened = 0;
+    papersTotal = null;
+    document.getElementById('dashboardLink').href =
+        `/output/${document.getElementById('aiModel').value}/screening_progress.html`;
+
+    progressSource = new EventSource('/screening_progress/stream');
+
+    progressSource.addEventListener('start', e => {
+        papersTotal = JSON.parse(e.data).total;
+        updateProgressSummary();
+    });
+
+    progressSource.addEventListener('criterion', e => {
+        const event = JSON.parse(e.data);
+        document.getElementById('currentCriterion').textContent =
+            `Paper ${event.paper_number}: ${event.criterion} - ${event.decisions.join(', ')}`;
+    });
+
+    progressSource.addEventListener('paper', e => {
+        const paper = JSON.parse(e.data);
+        const row = document.createElement('tr');
+        [paper.paper_number, paper.title, paper.decision].forEach(value => {
+            const cell = document.createElement('td');
+            cell.textContent = value;
+            row.appendChild(cell);
         });
+        document.getElementById('progressBody').appendChild(row);
+        papersScreened++;
+        updateProgressSummary();
+    });
 
-        // Check if screening is complete
-        if (progressData.length > 0 && progressData[progressData.length - 1].decision === 'Complete') {
-            screeningInProgress = false;
-            showStatus('Screening process completed!');
-        } else {
-            // Schedule the next update
-            setTimeout(fetchScreeningProgress, 5000); // Update every 5 seconds
-        }
-    } catch (error) {
-        console.error('Error fetching screening progress:', error);
-        showStatus('Error fetching screening progress: ' + error.message, true);
-    }
+    progressSource.addEventListener('complete', () => {
+        progressSource.close();
+        screeningInProgress = false;
+        showStatus('Screening process completed!');
+    });
+
+    progressSource.addEventListener('failed', e => {
+        progressSource.close();
+        screeningInProgress = false;
+        showStatus('Screening stopped: ' + JSON.parse(e.data).message, true);
+    });
 }
 
+function updateProgressSummary() {
+    const total = papersTotal === null ? '' : ` of ${papersTotal}`;
+    document.getElementById('progressSummary').textContent = `${papersScreened}${total} papers screened`;
+}
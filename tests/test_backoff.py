@@ -0,0 +1,31 @@
+import ask_AI
+from ask_AI import RateLimitException, exponential_backoff
+
+def test_each_retry_waits_for_the_rate_limiter_again(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(ask_AI, 'wait_for_capacity', lambda ai_model, prompt, max_tokens=None, cancelled=None: acquired.append(ai_model) or 0.0)
+    calls = []
+    def flaky(prompt, max_tokens=None):
+        calls.append(len(acquired))
+        if len(calls) < 3:
+            raise RateLimitException("429")
+        return "Final Response: Yes"
+    monkeypatch.setitem(ask_AI.BACKENDS, 'flaky', exponential_backoff(flaky, initial_delay=0))
+
+    assert ask_AI.ask_ai("prompt", 'flaky', use_cache=False) == "Final Response: Yes"
+    # One acquire before the first request and one before each retry
+    assert calls == [1, 2, 3]
+    assert ask_AI._call.capacity is None
+
+def test_calls_outside_ask_ai_retry_without_the_limiter(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(ask_AI, 'wait_for_capacity', lambda *args: acquired.append(args) or 0.0)
+    ask_AI._call.capacity = None
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise RateLimitException("429")
+        return "done"
+    assert exponential_backoff(flaky, initial_delay=0)() == "done"
+    assert acquired == []
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+from batch_backend import LocalBatchProvider, OpenAIBatchProvider, get_batch_provider, make_bulk_wave
+from config import get_ai_model_name
+from screening_logic import screen_in_waves
+
+CRITERIA = [
+    {'type': 'Topic', 'included': 'Fish', 'excluded': 'Birds'},
+    {'type': 'Design', 'included': 'Field studies', 'excluded': 'Models'}
+]
+
+def test_openai_batch_provider_gets_an_openai_model(tmp_path):
+    assert isinstance(get_batch_provider('openai', str(tmp_path), get_ai_model_name('openai')), OpenAIBatchProvider)
+    with pytest.raises(ValueError):
+        get_batch_provider('openai', str(tmp_path), 'gemini')
+
+def test_waves_through_local_provider_skip_rejected_papers(tmp_path):
+    asked = []
+    def responder(prompt, ai_model, max_tokens, sample, prefix, criterion):
+        asked.append((criterion, prompt))
+        final = 'No' if criterion == 'Topic' and 'birds' in prompt else 'Yes'
+        return f"Initial Response: {final}; x\nReflection: x\nFinal Response: {final}; x"
+    info = pd.DataFrame({
+        'Title': ['Fish in rivers', 'Birds in winter', 'Fish in lakes'],
+        'Abstract': ['About fish.', 'About birds.', 'About fish.']
+    })
+    work_dir = str(tmp_path / 'batches')
+    ask_wave = make_bulk_wave(LocalBatchProvider(work_dir, responder), 'gemini', work_dir, poll_seconds=0)
+
+    results = screen_in_waves([0, 1, 2], info, 'Title', 'Abstract', 1, CRITERIA, [info.copy()], True, ask_wave)
+
+    # One job per criterion; the paper rejected on Topic is not sent to the Design job
+    assert [criterion for criterion, _ in asked] == ['Topic'] * 3 + ['Design'] * 2
+    assert not any('birds' in prompt for criterion, prompt in asked if criterion == 'Design')
+    assert {paper_num: result[2] for paper_num, result in results.items()} == {0: 'Yes', 1: 'No', 2: 'Yes'}
+    assert results[1][3]['Topic']['Final'] == ['No'] and 'Design' not in results[1][3]
+    assert results[0][3]['Design']['Backend'] == ['gemini batch']
@@ -0,0 +1,24 @@
+import ai_interaction
+
+CRITERIA = [{'type': sc_type, 'included': 'Included', 'excluded': 'Excluded'} for sc_type in ('Topic', 'Design', 'Region')]
+
+def test_later_agents_are_only_asked_undecided_criteria(monkeypatch):
+    prefixes = []
+    def fake_ask_ai(content, ai_model, max_tokens=None, sample=0, prefix='', **kwargs):
+        prefixes.append(prefix)
+        blocks = []
+        for SC_num in range(1, prefix.count('\nIncluded:') + 1):
+            # The first agent changes its mind about Design, so Design needs another agent
+            final = 'No' if sample == 0 and f'SC{SC_num}: Design' in prefix else 'Yes'
+            blocks.append(f"SC{SC_num} -\nInitial Response: Yes; x\nReflection: x\nFinal Response: {final}; x")
+        return '\n'.join(blocks)
+    monkeypatch.setattr(ai_interaction, 'ask_ai', fake_ask_ai)
+    monkeypatch.setattr(ai_interaction, 'store_in_info_all', lambda *args: None)
+
+    results = ai_interaction.get_combined_data(CRITERIA, 'Title: x', 3, {}, 1, 'fake', 'x', 'y')
+
+    assert len(prefixes) == 2
+    assert 'SC1: Design' in prefixes[1] and 'Topic' not in prefixes[1] and 'Region' not in prefixes[1]
+    assert {sc_type: finals for sc_type, (_, _, finals) in results.items()} == {
+        'Topic': ['Yes'], 'Design': ['No', 'Yes'], 'Region': ['Yes']
+    }
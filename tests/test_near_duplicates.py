@@ -0,0 +1,61 @@
+import random
+import pandas as pd
+from near_duplicates import find_clusters, find_near_duplicates, normalize_words
+
+PREPRINT_TITLE = "Effects of ocean warming on the reproductive success of Atlantic cod (Gadus morhua) in the North Sea (preprint)"
+PUBLISHED_TITLE = "Effects of océan warming on the reproductive success of Atlantic cod (Gadus morhua) in the North Sea: a long-term field study"
+PREPRINT_ABSTRACT = (
+    "Ocean warming is expected to alter the reproduction of commercially important fish stocks, yet long-term field evidence "
+    "remains scarce. Here we analysed thirty years of spawning survey data for Atlantic cod in the North Sea together with "
+    "sea surface temperature records. We found that spawning occurred earlier in warmer years and that egg survival declined "
+    "by about twelve percent per degree of warming. Recruitment was lowest when warm winters followed poor feeding conditions "
+    "in the previous autumn. These results suggest that continued warming will reduce the productivity of the stock and that "
+    "management targets should account for temperature driven changes in reproductive success."
+)
+# Copy-edited for publication: spelling, numbers, hyphenation and a few words changed
+PUBLISHED_ABSTRACT = (
+    "Ocean warming is expected to alter the reproduction of commercially important fish stocks, but long-term field evidence "
+    "remains scarce. Here we analyzed thirty years of spawning survey data for Atlantic cod in the North Sea together with "
+    "sea surface temperature records. We found that spawning occurred earlier in warmer years and that egg survival declined "
+    "by approximately 12% per degree of warming. Recruitment was lowest when warm winters followed poor feeding conditions "
+    "in the previous autumn. These results indicate that continued warming will reduce the productivity of the stock and that "
+    "management targets should account for temperature-driven changes in reproductive success."
+)
+RELATED = (
+    "Effects of ocean warming on growth of Atlantic herring in the Baltic Sea",
+    "Ocean warming affects growth of herring. We analysed twenty years of survey data in the Baltic Sea together with "
+    "temperature records and found that growth declined in warm years."
+)
+
+def char_jaccard(a, b, size=5):
+    a, b = ' '.join(normalize_words(a)), ' '.join(normalize_words(b))
+    a, b = {a[i:i + size] for i in range(len(a) - size + 1)}, {b[i:i + size] for i in range(len(b) - size + 1)}
+    return len(a & b) / len(a | b)
+
+def test_preprint_and_published_version_are_merged():
+    titles = pd.Series([PREPRINT_TITLE, RELATED[0], "Migration of shorebirds over land", PUBLISHED_TITLE])
+    abstracts = pd.Series([PREPRINT_ABSTRACT, RELATED[1], "Shorebirds fly over land in winter.", PUBLISHED_ABSTRACT])
+    assert find_near_duplicates(titles, abstracts) == {3: 0}
+
+def test_recall_at_the_threshold():
+    rng = random.Random(7)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10))) for _ in range(3000)]
+    texts = []
+    pairs = []
+    while len(pairs) < 200:
+        words = [rng.choice(vocabulary) for _ in range(150)]
+        edited = list(words)
+        for _ in range(rng.randint(1, 6)):
+            edited[rng.randrange(len(edited))] = rng.choice(vocabulary)
+        original, copy = ' '.join(words), ' '.join(edited)
+        # Only pairs at or above the default threshold count towards recall
+        if char_jaccard(original, copy) < 0.8:
+            continue
+        pairs.append((len(texts), len(texts) + 1))
+        texts.extend([original, copy])
+
+    cluster_of = {member: n for n, members in enumerate(find_clusters(texts)) for member in members}
+    found = sum(1 for a, b in pairs if a in cluster_of and cluster_of.get(a) == cluster_of.get(b))
+    assert found / len(pairs) >= 0.95
+    # Unrelated texts are never merged
+    assert all(len(members) == 2 for members in find_clusters(texts))
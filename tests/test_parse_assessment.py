@@ -0,0 +1,27 @@
+from ai_interaction import parse_assessment
+
+def decisions(assessment):
+    initial, final, _ = parse_assessment(assessment)
+    return initial, final
+
+def test_labelled_lines():
+    assert decisions("Initial Response: Yes; on topic.\nReflection: Fine.\nFinal Response: Maybe; unclear design.") == ('Yes', 'Maybe')
+
+def test_markdown_labels():
+    assessment = "**Initial Response:** Yes; fish.\n**Reflection:** Hm.\n**Final Response:** No; it is a review."
+    assert decisions(assessment) == ('Yes', 'No')
+
+def test_last_final_response_wins():
+    assessment = "Initial Response: No; x\nFinal Response: No; x\nOn reflection...\nFinal Response: Yes; x"
+    assert decisions(assessment) == ('No', 'Yes')
+
+def test_json_answer():
+    assessment = '```json\n{"initial_response": "maybe", "reflection": "x", "final_response": "Yes", "reason": "x"}\n```'
+    assert decisions(assessment) == ('Maybe', 'Yes')
+
+def test_bare_decision():
+    assert decisions("Yes.") == ('Yes', 'Yes')
+
+def test_unlabelled_text_is_no_data():
+    assert decisions("The paper looks relevant to the review, but I cannot say more.") == ('No Data', 'No Data')
+    assert decisions("No Data") == ('No Data', 'No Data')
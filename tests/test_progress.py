@@ -0,0 +1,61 @@
+import json
+import os
+from file_operations import PROGRESS_DATA, mark_progress_run, update_html
+
+def read_progress(out_path):
+    with open(os.path.join(out_path, PROGRESS_DATA), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_progress_data_starts_afresh_when_criteria_change(tmp_path):
+    out_path = str(tmp_path)
+    mark_progress_run(out_path, 2, 'started', 'set-a')
+    update_html(out_path, 0, 'First paper', 'Include', lambda *args: None, 2)
+    mark_progress_run(out_path, 2, 'complete', 'set-a')
+
+    # Resuming with the same criteria keeps the papers screened so far
+    mark_progress_run(out_path, 2, 'started', 'set-a')
+    assert [record['type'] for record in read_progress(out_path)] == ['run', 'paper', 'run', 'run']
+
+    mark_progress_run(out_path, 2, 'started', 'set-b')
+    records = read_progress(out_path)
+    assert len(records) == 1 and records[0]['criteria_set'] == 'set-b'
+
+def write_run(out_path, papers):
+    import progress
+    progress.start_progress_events(out_path, len(papers))
+    for paper_number in papers:
+        progress.publish_event('paper', paper_number=paper_number)
+    progress.close_progress_events()
+
+def test_cursor_from_an_earlier_run_starts_the_new_run_over(tmp_path):
+    from progress import events_path, read_events
+    out_path = str(tmp_path)
+    write_run(out_path, [0])
+    _, old_cursor = read_events(events_path(out_path))
+
+    # The new run's file is already longer than the old cursor's offset
+    write_run(out_path, range(5))
+    events, _ = read_events(events_path(out_path), old_cursor)
+    assert [event['event'] for event in events] == ['start'] + ['paper'] * 5
+
+    events, cursor = read_events(events_path(out_path), events[2]['id'])
+    assert [event['paper_number'] for event in events] == [2, 3, 4]
+    assert read_events(events_path(out_path), cursor) == ([], cursor)
+
+def test_stream_ends_when_the_screening_process_dies(tmp_path, monkeypatch):
+    import server
+
+    class KilledProcess:
+        returncode = -9
+        def poll(self):
+            return self.returncode
+
+    monkeypatch.chdir(tmp_path)
+    with open('screening_config.json', 'w') as f:
+        json.dump({'model_to_use': 'gemini'}, f)
+    write_run(os.path.join('AI_Output', 'gemini'), [0])
+    monkeypatch.setattr(server, 'screening_process', KilledProcess())
+
+    body = server.app.test_client().get('/screening_progress/stream').get_data(as_text=True)
+    assert body.count('event: paper') == 1
+    assert body.rstrip().endswith('"message": "The screening process exited with code -9"}')
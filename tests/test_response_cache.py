@@ -0,0 +1,30 @@
+import itertools
+import response_cache
+from response_cache import ResponseCache
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(response_cache.time, 'time', lambda: next(clock))
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_entries=3)
+    for key in 'abc':
+        cache.put(key, 'gemini', f'response {key}')
+    assert cache.get('a') == 'response a'
+
+    cache.put('d', 'gemini', 'response d')
+    cache.evict()
+
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['response a', 'response c', 'response d']
+    cache.close()
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'time', lambda: now[0])
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_age_days=1)
+    cache.put('a', 'gemini', 'response a')
+    assert cache.get('a') == 'response a'
+
+    now[0] += 2 * 86400
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+    cache.close()
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import sys
+import pandas as pd
+from results_journal import ResultsJournal, journal_path, export_to_excel, export_to_parquet
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRITERIA = [{'type': 'Topic', 'included': 'fish', 'excluded': 'birds'}]
+
+# Runs main.py with every backend answering Yes, killing the process on call CRASH_AT
+DRIVER = """
+import os, sys
+sys.path.insert(0, {repo!r})
+import ask_AI
+calls = 0
+def fake(prompt, max_tokens=None, **kwargs):
+    global calls
+    calls += 1
+    if calls == int(os.environ.get('CRASH_AT', '0')):
+        os._exit(1)
+    return "Initial Response: Yes\\nReflection: Fine.\\nFinal Response: Yes"
+for name in list(ask_AI.BACKENDS):
+    ask_AI.BACKENDS[name] = fake
+import main
+main.main()
+"""
+
+def decisions(final):
+    return {'Topic': {'Initial': [final], 'Final': [final], 'Assessment': ['...'], 'Route': 'llm', 'Backend': ['gemma2']}}
+
+def test_export_keeps_latest_record_of_current_criteria(tmp_path):
+    journal = ResultsJournal(journal_path(tmp_path))
+    journal.start_run('gemini', 1, [{'type': 'Old', 'included': '', 'excluded': ''}])
+    journal.record_paper(0, 'Paper A', 'Abstract', 'No', {'Old': decisions('No')['Topic']}, 1)
+    journal.start_run('gemini', 1, CRITERIA)
+    journal.record_paper(1, 'Paper B', 'Abstract', 'No', decisions('No'), 1)
+    journal.record_paper(0, 'Paper A', 'Abstract', 'Yes', decisions('Yes'), 1)
+    journal.record_paper(1, 'Paper B', 'Abstract', 'Yes', {'Topic': dict(decisions('Yes')['Topic'], Route='rule')}, 1)
+    journal.close()
+
+    excel_path = os.path.join(tmp_path, 'screening_results.xlsx')
+    assert export_to_excel(journal_path(tmp_path), excel_path) == 2
+    summary = pd.read_excel(excel_path, sheet_name='screening_results_summary')
+    assert list(summary['Paper Number']) == [0, 1]
+    assert list(summary['Summary Decision']) == ['Yes', 'Yes']
+    agent = pd.read_excel(excel_path, sheet_name='Agent_0')
+    assert list(agent['Topic_Final']) == ['Yes', 'Yes']
+    assert list(agent['Topic_Backend']) == ['gemma2', 'gemma2']
+    assert list(agent['Topic_Route']) == ['llm', 'rule']
+
+def test_parquet_export_has_the_same_papers_as_the_workbook(tmp_path, monkeypatch):
+    journal = ResultsJournal(journal_path(tmp_path))
+    journal.start_run('gemini', 1, [{'type': 'Old', 'included': '', 'excluded': ''}])
+    journal.record_paper(0, 'Paper A', 'Abstract', 'No', {'Old': decisions('No')['Topic']}, 1)
+    journal.start_run('gemini', 1, CRITERIA)
+    journal.record_paper(0, 'Paper A', 'Abstract', 'No', decisions('No'), 1)
+    journal.record_paper(0, 'Paper A', 'Abstract', 'Yes', decisions('Yes'), 1)
+    journal.record_paper(1, 'Paper B', 'Abstract', 'Yes', decisions('Yes'), 1)
+    journal.close()
+
+    # pyarrow is optional, so capture the frame instead of writing it
+    written = []
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', lambda frame, *args, **kwargs: written.append(frame))
+    assert export_to_parquet(journal_path(tmp_path), os.path.join(tmp_path, 'screening_results.parquet'))
+    frame = written[0]
+    assert list(frame['paper_num']) == [0, 1]
+    assert list(frame['criterion']) == ['Topic', 'Topic']
+    assert list(frame['final']) == ['Yes', 'Yes']
+
+def test_resume_after_crash_keeps_every_row(tmp_path):
+    pd.DataFrame({
+        'Title': [f"Paper {i} about fish" for i in range(12)],
+        'Abstract': [f"Abstract {i}" for i in range(12)]
+    }).to_csv(tmp_path / 'papers.csv', index=False)
+    pd.DataFrame(CRITERIA).to_csv(tmp_path / 'ScreeningCriteria.csv', index=False)
+    with open(tmp_path / 'screening_config.json', 'w') as f:
+        json.dump({
+            'model_to_use': 'gemini', 'n_agents': 1, 'proj_location': '.', 'debug': False,
+            'skip_criteria': True, 'papers_file': 'papers.csv',
+            'response_cache': {'enabled': False}, 'export_parquet': False
+        }, f)
+    (tmp_path / 'driver.py').write_text(DRIVER.format(repo=REPO))
+
+    # Killed part way through the run: the journal has the papers, the workbook does not
+    crashed = subprocess.run([sys.executable, 'driver.py'], cwd=tmp_path, env={**os.environ, 'CRASH_AT': '8'}, capture_output=True)
+    assert crashed.returncode == 1
+    out_path = tmp_path / 'AI_Output' / 'gemini'
+    with open(journal_path(out_path)) as f:
+        assert sum(json.loads(line)['type'] == 'paper' for line in f) == 7
+
+    resumed = subprocess.run([sys.executable, 'driver.py'], cwd=tmp_path, capture_output=True)
+    assert resumed.returncode == 0
+    summary = pd.read_excel(out_path / 'screening_results.xlsx', sheet_name='screening_results_summary')
+    assert list(summary['Paper Number']) == list(range(12))
+
+def test_papers_with_failed_calls_are_screened_again_on_resume(tmp_path, monkeypatch):
+    import ai_interaction
+    from screening_logic import screen_paper
+    def bad_key(*args, **kwargs):
+        raise RuntimeError('401 invalid api key')
+    monkeypatch.setattr(ai_interaction, 'ask_ai', bad_key)
+    info = pd.DataFrame({'Title': ['Paper about fish'], 'Abstract': ['Fish in rivers.']})
+    info_all = [info.copy()]
+
+    journal = ResultsJournal(journal_path(tmp_path))
+    journal.start_run('gemini', 1, CRITERIA)
+    title, abstract, summary_decision, save_stuff = screen_paper(
+        0, info, 'Title', 'Abstract', 1, CRITERIA, info_all, 'gemini', True, journal=journal
+    )
+    assert save_stuff['Topic']['Final'] == ['No Data']
+    journal.record_paper(0, title, abstract, summary_decision, save_stuff, 1)
+    assert journal.completed_decision(title) is None
+    journal.close()
+
+    resumed = ResultsJournal(journal_path(tmp_path))
+    resumed.start_run('gemini', 1, CRITERIA)
+    assert resumed.completed_decision(title) is None
+    assert resumed.completed_criteria(title, 1) == {}
+    resumed.close()
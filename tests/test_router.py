@@ -0,0 +1,52 @@
+import threading
+import pytest
+from rate_limiter import CallCancelled, configure_rate_limits
+from router import Router
+
+@pytest.fixture(autouse=True)
+def no_rate_limits():
+    configure_rate_limits({})
+
+def test_failing_backend_is_rested_and_the_call_fails_over():
+    router = Router({'flaky': 1, 'steady': 1}, cooldown_seconds=60)
+    tried = []
+    def attempt(name):
+        tried.append(name)
+        if name == 'flaky':
+            raise RuntimeError('429 rate limit exceeded')
+        return f'answer from {name}'
+
+    assert router.call(attempt, 'prompt') == ('steady', 'answer from steady')
+    assert tried == ['flaky', 'steady']
+
+    # flaky is cooling down, so the next call goes straight to steady
+    assert router.call(attempt, 'prompt') == ('steady', 'answer from steady')
+    assert tried == ['flaky', 'steady', 'steady']
+
+    report = router.report()
+    assert report['flaky']['errors'] == 1 and report['flaky']['rate_limited'] == 1
+    assert report['steady']['served'] == 2
+    assert all(backend['in_flight'] == 0 for backend in router.backends.values())
+
+def test_cooldown_doubles_with_each_failure_in_a_row():
+    router = Router(['only'], cooldown_seconds=5, max_cooldown_seconds=15)
+    assert [router._failed('only', RuntimeError('down')) for _ in range(4)] == [5, 10, 15, 15]
+
+def test_gives_up_with_the_last_error_when_every_backend_fails():
+    router = Router(['a', 'b'], cooldown_seconds=0.01, max_rounds=2)
+    calls = []
+    def attempt(name):
+        calls.append(name)
+        raise RuntimeError(f'{name} is down')
+
+    with pytest.raises(RuntimeError, match='is down'):
+        router.call(attempt, 'prompt')
+    assert sorted(calls) == ['a', 'a', 'b', 'b']
+
+def test_cancelled_call_is_not_sent_and_does_not_rest_the_backend():
+    router = Router(['a'])
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(CallCancelled):
+        router.call(lambda name: 'answer', 'prompt', cancelled=cancelled)
+    assert router.backends['a']['in_flight'] == 0 and router.backends['a']['cooldown_until'] == 0.0
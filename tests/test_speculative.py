@@ -0,0 +1,45 @@
+import threading
+import time
+import pytest
+import ai_interaction
+import metrics
+from rate_limiter import CallCancelled, RateLimiter
+
+CRITERION = {'type': 'Topic', 'included': 'Fish', 'excluded': 'Birds'}
+
+def answer(final):
+    return f"Initial Response: {final}; x\nReflection: x\nFinal Response: {final}; x"
+
+def test_rate_limiter_wait_stops_when_cancelled():
+    limiter = RateLimiter(requests_per_minute=1)
+    limiter.acquire()
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+    started = time.time()
+    with pytest.raises(CallCancelled):
+        limiter.acquire(cancelled=cancelled)
+    assert time.time() - started < 5
+
+def test_speculative_agents_are_cancelled_and_counted(monkeypatch):
+    sent = []
+    def fake_ask_ai(prompt, ai_model, max_tokens=None, sample=0, cancelled=None, **kwargs):
+        # Agent 1 is still on its way when agent 0 decides; agent 2 has not been sent yet
+        if sample == 1:
+            time.sleep(0.3)
+        if sample == 2:
+            time.sleep(0.1)
+            if cancelled.is_set():
+                raise CallCancelled("cancelled")
+        sent.append(sample)
+        return answer('Yes')
+    monkeypatch.setattr(ai_interaction, 'ask_ai', fake_ask_ai)
+    monkeypatch.setattr(ai_interaction, 'store_in_info_all', lambda *args: None)
+    run_metrics = metrics.configure_metrics()
+
+    _, _, final_decisions = ai_interaction.get_data(CRITERION, 'Title: x', 3, 1, {}, 1, 'fake', 'x', 'y', 'speculative')
+
+    assert final_decisions == ['Yes']
+    assert sorted(sent) == [0, 1]
+    discarded = run_metrics.summary()['by_agent']
+    assert discarded['1']['speculative_discarded'] == 1
+    assert '2' not in discarded
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import ai_interaction
+import ask_AI
+from ai_interaction import end_of_final_responses, trim_stopped_response
+
+def test_stops_once_the_decision_word_is_complete():
+    assert end_of_final_responses("Initial Response: Yes\nFinal Response: No") is None
+    assert end_of_final_responses("Final Response: Not") is None
+    assert end_of_final_responses("Final Response: May") is None
+    assert end_of_final_responses("Final Response: Maybe;") is not None
+    assert end_of_final_responses("**Final Response:** No.") is not None
+    assert end_of_final_responses("Final Response: Yes;", count=2) is None
+
+def test_trim_drops_the_lines_after_the_decisions():
+    assert trim_stopped_response("Final Response: Yes; fish\nSC: x") == "Final Response: Yes; fish"
+    assert trim_stopped_response("Final Response: Yes; fi") == "Final Response: Yes; fi"
+
+def test_stop_predicate(monkeypatch):
+    monkeypatch.setattr(ai_interaction, '_budget', {'stream': True})
+    monkeypatch.setattr(ai_interaction, '_structured', {'json_mode': False, 'reask': True})
+    stop_when = ai_interaction.stop_after_final_responses()
+    assert not stop_when("Initial Response: Yes\nFinal Response: Ye")
+    assert stop_when("Initial Response: Yes\nFinal Response: Yes ")
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+def chat_client(chunks, requests):
+    def create(**kwargs):
+        requests.append(kwargs)
+        return FakeStream(chunks)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+def text_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+def test_streamed_chat_usage_is_recorded():
+    usage = SimpleNamespace(prompt_tokens=120, completion_tokens=9, prompt_tokens_details=SimpleNamespace(cached_tokens=100))
+    chunks = [text_chunk("Final Response: Yes"), SimpleNamespace(choices=[], usage=usage)]
+    requests = []
+    ask_AI._call.usage = None
+    output = ask_AI._chat_completion(chat_client(chunks, requests), 'model', 'prompt', 300, stop_when=lambda text: False)
+    assert output == "Final Response: Yes"
+    assert requests[0]['extra_body'] == {'stream_options': {'include_usage': True}}
+    assert ask_AI._call.usage == (120, 100, 9)
+
+def test_stopped_chat_stream_keeps_the_estimate():
+    chunks = [text_chunk("Final Response: Yes"), text_chunk("; fish"), text_chunk(" and more")]
+    ask_AI._call.usage = None
+    stop_when = lambda text: end_of_final_responses(text) is not None
+    output = ask_AI._chat_completion(chat_client(chunks, []), 'model', 'prompt', 300, stop_when=stop_when)
+    assert output == "Final Response: Yes; fish"
+    assert ask_AI._call.usage is None
+
+def test_stopped_claude_stream_records_input_usage(monkeypatch):
+    class ClaudeStream:
+        text_stream = iter(["Final Response: No", ". Off topic", " entirely"])
+        current_message_snapshot = SimpleNamespace(usage=SimpleNamespace(
+            input_tokens=50, cache_read_input_tokens=400, cache_creation_input_tokens=0, output_tokens=1
+        ))
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **request: ClaudeStream()))
+    monkeypatch.setattr(ask_AI, 'get_client', lambda provider, model=None: client)
+    ask_AI._call.usage = None
+    stop_when = lambda text: end_of_final_responses(text) is not None
+    output = ask_AI.ask_claude("prompt", 300, stop_when=stop_when)
+    assert output == "Final Response: No. Off topic"
+    assert ask_AI._call.usage == (450, 400, ask_AI.estimate_tokens(output))
@@ -0,0 +1,15 @@
+from triage import Triage
+
+CRITERIA = [{'type': 'Topic', 'included': 'Fish populations in rivers', 'excluded': 'Bird surveys, reviews and models'}]
+
+def test_keyword_rules_are_off_by_default():
+    triage = Triage(CRITERIA)
+    assert triage.route(CRITERIA[0], 'A review of bird surveys', 'Bird surveys and models.') is None
+
+def test_one_exclude_only_word_is_not_enough():
+    triage = Triage(CRITERIA, keyword_rules=True)
+    assert triage.route(CRITERIA[0], 'A model of plankton growth', 'We fit a growth model.') is None
+    route, decision, _ = triage.route(CRITERIA[0], 'A review of bird surveys', 'Bird surveys in winter.')
+    assert (route, decision) == ('rule', 'No')
+    # Any include word sends the paper to the AI
+    assert triage.route(CRITERIA[0], 'Bird surveys and fish', 'Bird surveys near rivers.') is None
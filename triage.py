@@ -0,0 +1,184 @@
+import re
+import threading
+from collections import Counter
+
+# Words that say nothing about a criterion's topic
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'into', 'are', 'was', 'were', 'any',
+    'not', 'but', 'all', 'only', 'other', 'than', 'such', 'which', 'their', 'its', 'has',
+    'have', 'had', 'been', 'being', 'also', 'more', 'most', 'may', 'can', 'e.g', 'i.e', 'etc',
+    'study', 'studies', 'paper', 'papers', 'article', 'articles', 'research', 'related',
+    'focus', 'focused', 'focusing', 'including', 'include', 'includes', 'included', 'exclude',
+    'excludes', 'excluded', 'about', 'relevant', 'report', 'reports', 'reporting', 'using',
+    'use', 'used', 'based', 'how', 'what', 'where', 'when', 'who', 'why', 'nan'
+}
+
+def stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+def keywords(text):
+    """Stemmed topic words of a criterion description or paper"""
+    if not isinstance(text, str):
+        return set()
+    return {stem(w) for w in re.findall(r'[a-z][a-z\-]+', text.lower()) if len(w) > 2 and w not in STOPWORDS}
+
+def majority_label(final_decisions):
+    """1 if every agent said Yes, 0 if every agent said No, otherwise None"""
+    decisions = {d for d in final_decisions if d in ('Yes', 'No', 'Maybe')}
+    if decisions == {'Yes'}:
+        return 1
+    if decisions == {'No'}:
+        return 0
+    return None
+
+class Triage:
+    """
+    Decide criteria for papers locally when that is safe, before any AI call.
+
+    With keyword_rules, rules are built from each criterion: a paper that mentions at
+    least min_exclude_terms different words only found in the criterion's 'excluded'
+    text, and none of the words of its 'included' text, is excluded. They are off by
+    default, since a wrong exclusion is the costly error in screening and single
+    common words ('review', 'model') are weak evidence. Extra include/exclude
+    regular expressions can be given per criterion type. With classifier enabled, a TF-IDF + logistic
+    regression model per criterion is trained on decisions already in the journal
+    and routes papers it is very sure about.
+
+    route() returns (route, decision, reason) or None when the AI should decide.
+    """
+
+    def __init__(self, screening_criteria, keyword_rules=False, rules=None, exclude_below=0.03, include_above=0.97, min_exclude_terms=2):
+        self.rules = {}
+        for Criterion in screening_criteria:
+            include_terms = keywords(Criterion.get('included'))
+            extra = (rules or {}).get(Criterion['type'], {})
+            self.rules[Criterion['type']] = {
+                'include_terms': include_terms if keyword_rules else set(),
+                'exclude_terms': (keywords(Criterion.get('excluded')) - include_terms) if keyword_rules else set(),
+                'include_patterns': [re.compile(p, re.IGNORECASE) for p in extra.get('include', [])],
+                'exclude_patterns': [re.compile(p, re.IGNORECASE) for p in extra.get('exclude', [])]
+            }
+        self.min_exclude_terms = max(1, int(min_exclude_terms))
+        self.exclude_below = exclude_below
+        self.include_above = include_above
+        self.vectorizer = None
+        self.models = {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def train(self, records, min_papers=50):
+        """
+        Fit one classifier per criterion on journal paper records (papers every agent
+        agreed on, and that were decided by the AI rather than by triage)
+        """
+        try:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            from sklearn.linear_model import LogisticRegression
+        except ImportError:
+            print("Skipping triage classifier - install scikit-learn to enable it")
+            return
+
+        examples = {}
+        for record in records:
+            text = f"{record.get('title', '')} {record.get('abstract', '')}"
+            for criterion, decisions in (record.get('criteria') or {}).items():
+                if decisions.get('Route', 'llm') != 'llm':
+                    continue
+                label = majority_label(decisions.get('Final', []))
+                if label is not None:
+                    examples.setdefault(criterion, []).append((text, label))
+
+        usable = {
+            criterion: pairs for criterion, pairs in examples.items()
+            if criterion in self.rules and len(pairs) >= min_papers
+            and min(sum(label for _, label in pairs), sum(1 - label for _, label in pairs)) >= 5
+        }
+        if not usable:
+            print(f"Triage classifier not trained - needs {min_papers} agreed decisions per criterion with both outcomes")
+            return
+
+        self.vectorizer = TfidfVectorizer(sublinear_tf=True, ngram_range=(1, 2), min_df=2, stop_words='english')
+        self.vectorizer.fit([text for pairs in usable.values() for text, _ in pairs])
+        for criterion, pairs in usable.items():
+            model = LogisticRegression(max_iter=1000, class_weight='balanced')
+            model.fit(self.vectorizer.transform([text for text, _ in pairs]), [label for _, label in pairs])
+            self.models[criterion] = model
+            print(f"Triage classifier for {criterion} trained on {len(pairs)} papers")
+
+    def route(self, Criterion, title, abstract):
+        rules = self.rules.get(Criterion['type'])
+        if rules is None:
+            return None
+        text = f"{title} {abstract}"
+
+        for pattern in rules['exclude_patterns']:
+            if pattern.search(text):
+                return 'rule', 'No', f"matches exclude pattern {pattern.pattern}"
+        for pattern in rules['include_patterns']:
+            if pattern.search(text):
+                return 'rule', 'Yes', f"matches include pattern {pattern.pattern}"
+
+        if rules['include_terms'] and rules['exclude_terms']:
+            words = keywords(text)
+            excluded = words & rules['exclude_terms']
+            if len(excluded) >= self.min_exclude_terms and not words & rules['include_terms']:
+                return 'rule', 'No', f"mentions {', '.join(sorted(excluded))} but none of {', '.join(sorted(rules['include_terms']))}"
+
+        model = self.models.get(Criterion['type'])
+        if model is not None:
+            probability = model.predict_proba(self.vectorizer.transform([text]))[0][1]
+            if probability <= self.exclude_below:
+                return 'classifier', 'No', f"classifier probability of inclusion {probability:.3f}"
+            if probability >= self.include_above:
+                return 'classifier', 'Yes', f"classifier probability of inclusion {probability:.3f}"
+        return None
+
+    def count(self, route, decision):
+        with self._lock:
+            self.counts[(route, decision)] += 1
+
+_triage = None
+
+def configure_triage(triage_config=None, screening_criteria=(), journal=None):
+    """
+    Set up triage from the triage config, e.g.
+    {"enabled": true, "rules": {"Topic": {"exclude": ["\\bbirds?\\b"]}}, "classifier": true}
+    """
+    global _triage
+    triage_config = triage_config or {}
+    if not triage_config.get('enabled', False):
+        _triage = None
+        return None
+    _triage = Triage(
+        screening_criteria,
+        keyword_rules=triage_config.get('keyword_rules', False),
+        rules=triage_config.get('rules'),
+        exclude_below=triage_config.get('exclude_below', 0.03),
+        include_above=triage_config.get('include_above', 0.97),
+        min_exclude_terms=triage_config.get('min_exclude_terms', 2)
+    )
+    if triage_config.get('classifier', False) and journal is not None:
+        records = [
+            record for record in journal.completed.values()
+            if record.get('criteria_set') == journal.criteria_set
+        ]
+        _triage.train(records, triage_config.get('min_training_papers', 50))
+    print("Triage enabled")
+    return _triage
+
+def get_triage():
+    return _triage
+
+def triage_criterion(Criterion, title, abstract, n_agents):
+    """
+    Decisions for a criterion that triage can make locally, as
+    (assessments, initial_decisions, final_decisions, route), or None
+    """
+    if _triage is None:
+        return None
+    routed = _triage.route(Criterion, title, abstract)
+    if routed is None:
+        return None
+    route, decision, reason = routed
+    _triage.count(route, decision)
+    return [f"Triage ({route}): {reason}"] * n_agents, [decision] * n_agents, [decision] * n_agents, route